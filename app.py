@@ -1,15 +1,18 @@
 import os
 import re
-import uuid
+import time
 import logging
-import json
-import tempfile
-import pandas as pd
-from flask import Flask, request, render_template, redirect, url_for, session
+import threading
+from flask import Flask, Response, request, render_template, redirect, url_for, session, jsonify
 from werkzeug.utils import secure_filename
-from databricks_conn import get_customer_data, upload_to_datalake, get_dso_dropdown_options, insert_or_update_dso_config, get_dso_config_data, delete_matched_data_for_dso, get_approved_source_ids
-from match_logic import match_records_by_fields
-from datetime import datetime
+from jobs import register_handler, submit_job, get_job, retry_job
+from job_stages import MATCHING_STAGES, BATCH_STAGES
+from metrics import render_prometheus
+from prepared_store import dataset_name, resolve, is_pending, touch
+from config import BATCH_MAX_FILES, MATCH_API_MAX_BATCH, MATCH_API_WARM_ON_START
+
+# Matching, ingestion, the data views and the warehouse helpers pull in pandas, pyarrow and openpyxl.
+# They are imported in the routes that use them, so a worker boots, and serves '/', without loading them.
 
 # --- Config ---
 UPLOAD_FOLDER = 'temp_uploads'
@@ -21,14 +24,26 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 logging.basicConfig(level=logging.INFO)
 
-# --- Helper Functions ---
-def load_dso_data():
-    return get_dso_config_data()
+def _run_matching_job(params, progress):
+    from pipeline import run_matching_pipeline
+    return run_matching_pipeline(params['dso_name'], params['original_filename'], params['prepared_path'], progress)
+
+def _run_batch_job(params, progress):
+    from batch import run_batch
+    return run_batch(params['rosters'], progress)
+
+register_handler('matching', _run_matching_job, MATCHING_STAGES)
+register_handler('batch', _run_batch_job, BATCH_STAGES)
+
+def _warm_match_api():
+    import match_api
+    match_api.warm()
 
-def save_dso_data(data):
-    with open('data.json', 'w') as f:
-        json.dump(data, f, indent=2)
+if MATCH_API_WARM_ON_START:
+    # Imports and maps the customer features off the main thread, so start-up doesn't wait for them
+    threading.Thread(target=_warm_match_api, name='match-api-import', daemon=True).start()
 
+# --- Helper Functions ---
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -43,8 +58,11 @@ def dsorecon_home():
 
 @app.route('/upload', methods=['GET', 'POST'])
 def upload_file():
+    from dso_config_cache import get_dso_configs, get_dso_config
+    from ingest import start_ingest, MissingColumnsError
+
     if request.method == 'GET':
-        dso_data = load_dso_data().to_dict(orient='records')
+        dso_data = get_dso_configs()
         dso_list = [f"{d['Name']} | {d['NSEntityID']}" for d in dso_data]
         return render_template('upload.html', dso_names=dso_list)
 
@@ -67,68 +85,24 @@ def upload_file():
         session['dso'] = dso_name
         session['original_filename'] = filename
 
-        config_df = load_dso_data().to_dict(orient='records')
-        config_entry = next((e for e in config_df if e["Name"] == dso_name and str(e["NSEntityID"]) == dso_id), None)
-        if not config_entry:
+        config_entry = get_dso_config(dso_id)
+        if not config_entry or config_entry["Name"] != dso_name:
             return f"No config for DSO '{dso_name}'", 400
 
-        dso_header = int(config_entry.get("Header", 0))
-        concat_dr = config_entry.get("Concat_Doctor", [])
-        sheet_name = config_entry.get("SheetName") or 0  # default to first sheet if not specified
-        df = pd.read_excel(file, dtype=str, header=dso_header, sheet_name=sheet_name).fillna('')
-
-        # Clean column names
-        df.columns = df.columns.astype(str).str.strip().str.replace(r'[\r\n]+', '', regex=True)
-        print("\nUploaded Columns:", df.columns.tolist())
-        print(df.head())
-
-        cleaned_mapping = {
-            k: v for k, v in config_entry.items()
-            if k not in ['ID', 'Name', 'NSEntityID', 'Type', 'Header', 'Concat_Doctor','SheetName']
-               and isinstance(v, str)
-               and v.strip().lower() != 'none'
-        }
-
         try:
-            df = df[list(cleaned_mapping.values())]
-        except KeyError as e:
+            prepared_path, df_preview = start_ingest(file, config_entry, dso_name)
+        except MissingColumnsError as e:
             return f"Missing expected column(s): {e}", 400
 
-        df.columns = list(cleaned_mapping.keys())
-
-        if concat_dr and all(col in df.columns for col in concat_dr):
-            df['Doctors'] = df[concat_dr[0]].fillna('') + ' ' + df[concat_dr[1]].fillna('')
-
-        if 'Emails' in df.columns and 'AddEmail' in df.columns:
-            df['Emails'] = df[['Emails', 'AddEmail']].astype(str).agg(','.join, axis=1)
-            df.drop(columns=['AddEmail'], inplace=True)
-        elif 'AddEmail' in df.columns:
-            df['Emails'] = df['AddEmail'].astype(str)
-            df.drop(columns=['AddEmail'], inplace=True)
-        elif 'Emails' not in df.columns:
-            df['Emails'] = None
-
-        df['Emails'] = df['Emails'].apply(
-            lambda x: ','.join(sorted(set(e.strip() for e in str(x).split(',') if e.strip())))
-            if pd.notnull(x) else None
-        )
-
-        df['Source'] = dso_name
-        df['DSO_Id'] = config_entry.get("NSEntityID", '')
-        df['Type'] = config_entry.get("Type", '')
-
-        if 'SourceID' not in df.columns and 'PracticeName' in df.columns and 'Address' in df.columns:
-            df['SourceID'] = df['PracticeName'].astype(str) + ' | ' + df['Address'].astype(str)
-
-        temp_path = os.path.join(tempfile.gettempdir(), f"{uuid.uuid4()}.parquet")
-        df.to_parquet(temp_path)
-        session['prepared_data_path'] = temp_path
-        print("df")
+        # The rest of the sheet is still being written here; run_matching waits for it
+        session['prepared_data_path'] = prepared_path
 
-        df_preview = df.head(30)
+        # The first rows show straight away; the page then reads the whole upload from /api/data
         return render_template(
             'preview.html',
-            table=df_preview.to_html(classes='table table-bordered', index=False),
+            data_url=url_for('data_page', name=dataset_name(prepared_path)),
+            initial_columns=list(df_preview.columns),
+            initial_rows=df_preview.head(30).values.tolist(),
             dso_name=dso_name
         )
 
@@ -140,137 +114,253 @@ def run_matching():
 
     if not all([dso_name, prepared_path, original_filename]):
         logging.error("Missing session data for matching")
-        return redirect(url_for('home'))
-
-    df = pd.read_parquet(prepared_path)
-
-    if 'PracticeName' in df.columns:
-        df['Name'] = df['PracticeName']
-    if 'Addr1' in df.columns:
-        df['Address'] = df['Addr1']
-    df.drop(columns=['Addr1', 'PracticeName'], inplace=True, errors='ignore')
-
-    for col in ['Name', 'Address', 'State', 'Zip', 'Emails', 'Doctors', 'ExternalID', 'City']:
-        if col not in df.columns:
-            df[col] = ''
-
-    df['Source'] = dso_name
-    
-    # Check for already approved SourceIDs and flag them instead of filtering
-    approved_source_ids = get_approved_source_ids()
-    initial_count = len(df)
-    approved_count = 0
-    
-    # Add AlreadyApproved flag column
-    df['AlreadyApproved'] = False
-    
-    if 'SourceID' in df.columns and approved_source_ids:
-        # Convert SourceID to string for comparison
-        df['SourceID'] = df['SourceID'].astype(str)
-        
-        # Flag records that are already approved instead of filtering them out
-        df['AlreadyApproved'] = df['SourceID'].isin(approved_source_ids)
-        approved_count = df['AlreadyApproved'].sum()
-        
-        logging.info(f" Flagged {approved_count} already approved records.")
-    
-    # Separate approved and non-approved records for matching
-    approved_records = df[df['AlreadyApproved'] == True].copy()
-    records_to_match = df[df['AlreadyApproved'] == False].copy()
-    
-    # If there are records to match, run the matching process
-    if not records_to_match.empty:
-        customer_df = get_customer_data()
-        matched_df = match_records_by_fields(records_to_match, customer_df, min_score=2)
-    else:
-        # If no records to match, create empty matched dataframe with same structure
-        matched_df = records_to_match.copy()
-        # Add matching columns with default values
-        for col in ['MatchedName', 'MatchedEmails', 'MatchedAddress', 'MatchedDoctors', 'TotalScore', 'MatchedEntityID', 'MatchedPracticeName']:
-            matched_df[col] = 0.0 if col in ['MatchedName', 'MatchedEmails', 'MatchedAddress', 'MatchedDoctors', 'TotalScore'] else ''
-    
-    # For already approved records, set matching columns to indicate they're pre-approved
-    if not approved_records.empty:
-        for col in ['MatchedName', 'MatchedEmails', 'MatchedAddress', 'MatchedDoctors', 'TotalScore']:
-            approved_records[col] = 0.0
-        for col in ['MatchedEntityID', 'MatchedPracticeName']:
-            approved_records[col] = 'PRE-APPROVED'
-    
-    # Combine approved and matched records
-    if not approved_records.empty and not matched_df.empty:
-        final_df = pd.concat([matched_df, approved_records], ignore_index=True)
-    elif not approved_records.empty:
-        final_df = approved_records
-    else:
-        final_df = matched_df
+        return redirect(url_for('upload_file'))
+
+    job_id = submit_job('matching', {
+        'dso_name': dso_name,
+        'original_filename': original_filename,
+        'prepared_path': prepared_path,
+    })
+    logging.info(f" Queued matching job {job_id} for {dso_name} ({original_filename}).")
+    return redirect(url_for('job_status', job_id=job_id))
 
-    final_df = final_df.loc[:, ~final_df.columns.duplicated()]
-    final_df['FileName'] = original_filename
-    final_df['UploadedDate'] = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+@app.route('/batch-upload', methods=['GET', 'POST'])
+def batch_upload():
+    from dso_config_cache import get_dso_configs, get_dso_config
+    from ingest import start_ingest, MissingColumnsError
 
+    if request.method == 'GET':
+        dso_data = get_dso_configs()
+        dso_list = [f"{d['Name']} | {d['NSEntityID']}" for d in dso_data]
+        return render_template('batch_upload.html', dso_names=dso_list, max_files=BATCH_MAX_FILES)
+
+    files = request.files.getlist('file')
+    dsos = request.form.getlist('dso')
+    if len(files) != len(dsos):
+        return "Each file needs a DSO.", 400
+    pairs = [(f, d) for f, d in zip(files, dsos) if f.filename]
+    if not pairs:
+        return "No file selected.", 400
+    if len(pairs) > BATCH_MAX_FILES:
+        return f"At most {BATCH_MAX_FILES} files can be matched in one batch.", 400
+
+    rosters = []
+    for file, dso in pairs:
+        if not allowed_file(file.filename):
+            return f"'{file.filename}' is not an .xlsx file.", 400
+        if '|' not in dso:
+            return f"Invalid DSO selection for '{file.filename}'.", 400
+        dso_name, dso_id = (part.strip() for part in dso.split('|', 1))
+        config_entry = get_dso_config(dso_id)
+        if not config_entry or config_entry["Name"] != dso_name:
+            return f"No config for DSO '{dso_name}'", 400
+
+        filename = secure_filename(file.filename)
+        try:
+            # Each workbook finishes parsing in the background while the batch job starts
+            prepared_path, _ = start_ingest(file, config_entry, dso_name)
+        except MissingColumnsError as e:
+            return f"Missing expected column(s) in '{filename}': {e}", 400
+        rosters.append({'dso_name': dso_name, 'original_filename': filename, 'prepared_path': prepared_path})
+
+    job_id = submit_job('batch', {'rosters': rosters})
+    logging.info(f" Queued batch job {job_id} for {len(rosters)} file(s).")
+    return redirect(url_for('job_status', job_id=job_id))
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = get_job(job_id)
+    if not job:
+        return "Job not found", 404
+
+    params = job['params']
+    if job['kind'] == 'batch':
+        dso_name = f"{len({r['dso_name'] for r in params['rosters']})} DSO(s)"
+        filename = f"{len(params['rosters'])} file(s)"
+    else:
+        dso_name, filename = params['dso_name'], params['original_filename']
+    message = {
+        'queued': f"Matching for {dso_name} is queued.",
+        'running': f"Matching {filename} for {dso_name}...",
+        'succeeded': "Matching complete and data uploaded to Databricks.",
+        'failed': f"Matching failed: {job['error']}",
+    }[job['status']]
+    if job['status'] == 'succeeded' and job['result'] and job['result'].get('failed'):
+        message = f"Matching complete, but these DSOs failed and were not uploaded: {', '.join(job['result']['failed'])}."
+    return render_template('success.html', message=message, stats=job['result'], job=job)
+
+@app.route('/api/jobs/<job_id>')
+def job_status_api(job_id):
+    job = get_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({k: job[k] for k in ['id', 'status', 'stage', 'stages', 'result', 'error', 'attempts', 'created_at', 'updated_at']})
+
+@app.route('/jobs/<job_id>/retry', methods=['POST'])
+def retry_matching_job(job_id):
+    if not retry_job(job_id):
+        return "Only failed jobs can be retried.", 400
+    return redirect(url_for('job_status', job_id=job_id))
+
+def _match_api_response(records):
+    import match_api
+
+    top_n = request.args.get('top_n', type=int)
+    if top_n is not None and top_n < 1:
+        return None, (jsonify({'error': 'top_n must be at least 1.'}), 400)
+    if any(not isinstance(r, dict) for r in records):
+        return None, (jsonify({'error': 'Each practice must be a JSON object of fields.'}), 400)
+    try:
+        return match_api.match_records(records, top_n=top_n), None
+    except Exception as e:
+        logging.error(f" Match API failed: {e}")
+        return None, (jsonify({'error': str(e)}), 503)
+
+@app.route('/api/match', methods=['POST'])
+def api_match():
+    started = time.perf_counter()
+    record = request.get_json(silent=True)
+    if not isinstance(record, dict):
+        from match_api import INPUT_FIELDS
+        return jsonify({'error': f"Expected a JSON object with any of {INPUT_FIELDS}."}), 400
+    results, error = _match_api_response([record])
+    if error:
+        return error
+    return jsonify({'candidates': results[0], 'elapsed_ms': round((time.perf_counter() - started) * 1000, 2)})
+
+@app.route('/api/match/batch', methods=['POST'])
+def api_match_batch():
+    started = time.perf_counter()
+    body = request.get_json(silent=True)
+    records = body.get('records') if isinstance(body, dict) else body
+    if not isinstance(records, list) or not records:
+        return jsonify({'error': 'Expected {"records": [...]} with at least one practice.'}), 400
+    if len(records) > MATCH_API_MAX_BATCH:
+        return jsonify({'error': f"At most {MATCH_API_MAX_BATCH} practices per call."}), 400
+    results, error = _match_api_response(records)
+    if error:
+        return error
+    return jsonify({
+        'results': [{'id': r.get('id'), 'candidates': c} for r, c in zip(records, results)],
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 2),
+    })
+
+def _bool_arg(name):
+    value = request.args.get(name, '').lower()
+    return {'true': True, '1': True, 'yes': True, 'false': False, '0': False, 'no': False}.get(value)
+
+@app.route('/api/data/<name>')
+def data_page(name):
+    from data_view import read_page
+
+    path = resolve(name)
+    if path is None:
+        if is_pending(name):
+            return jsonify({'pending': True}), 202
+        return jsonify({'error': 'Dataset not found; it may have been evicted.'}), 404
+    columns = [c for c in request.args.get('columns', '').split(',') if c]
     try:
-        delete_matched_data_for_dso(dso_name)
-        upload_to_datalake(final_df)
-        logging.info(f" Uploaded {len(final_df)} records to Databricks ({approved_count} pre-approved, {len(final_df) - approved_count} newly matched).")
+        page = read_page(
+            path,
+            page=request.args.get('page', 1, type=int),
+            page_size=request.args.get('page_size', type=int),
+            sort=request.args.get('sort') or None,
+            descending=request.args.get('order', 'asc').lower() == 'desc',
+            columns=columns or None,
+            min_score=request.args.get('min_score', type=float),
+            max_score=request.args.get('max_score', type=float),
+            approved=_bool_arg('approved'),
+            entity=request.args.get('entity') or None,
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    touch(path)
+    return jsonify(page)
+
+@app.route('/results/<name>')
+def results_page(name):
+    if resolve(name) is None:
+        return "These results are no longer available.", 404
+    title, incremental = None, False
+    job = get_job(request.args.get('job', '')) if request.args.get('job') else None
+    if job and job['result']:
+        runs = job['result'].get('dsos', [dict(job['result'], dso=job['params'].get('dso_name'))])
+        run = next((r for r in runs if r.get('results') == name), None)
+        if run:
+            title, incremental = run.get('dso'), run.get('mode') == 'incremental'
+    return render_template(
+        'results.html', data_url=url_for('data_page', name=name),
+        title=title, incremental=incremental, job_id=job['id'] if job else None
+    )
+
+@app.route('/customer-data/refresh', methods=['POST'])
+def refresh_customer_data():
+    from customer_snapshot import refresh_customer_snapshot
+    from customer_features import get_customer_features
+    import match_api
+
+    full = request.args.get('full', '').lower() in ['true', '1', 'yes']
+    try:
+        meta = refresh_customer_snapshot(full=full)
+        # Rebuild the prepared customer features now rather than in the next matching job
+        get_customer_features()
+        match_api.warm()
     except Exception as e:
-        logging.error(f" Upload failed: {e}")
-        return f"Upload failed: {e}", 500
+        logging.error(f" Customer snapshot refresh failed: {e}")
+        return jsonify({'error': str(e)}), 500
+    return jsonify(meta)
 
-    for path in [session.get('prepared_data_path')]:
-        if path and os.path.exists(path):
-            os.remove(path)
+@app.route('/api/db-pool')
+def db_pool_stats():
+    from databricks_conn import get_pool_stats
+    return jsonify(get_pool_stats())
 
-    return render_template('success.html', 
-                          message=f"Matching complete and data uploaded to Databricks.",
-                          stats={
-                              'total': initial_count,
-                              'approved': approved_count,
-                              'matched': len(final_df) - approved_count
-                          })
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/setup')
 def setup():
-    data_df = get_dso_config_data()
-    data = data_df.to_dict(orient='records')
+    from dso_config_cache import get_dso_configs
+    data = get_dso_configs()
     return render_template('setup.html', data=data)
 
 @app.route('/setup/add', methods=['GET', 'POST'])
 def setup_add():
+    from dso_config_cache import get_dso_config_columns, get_dso_dropdown, save_dso_config
+
     if request.method == 'POST':
         new_dso = {k: v for k, v in request.form.items()}
-        insert_or_update_dso_config(new_dso)
+        save_dso_config(new_dso)
         return redirect(url_for('setup'))
 
-    dso_df = get_dso_dropdown_options()
-    dso_list = dso_df.to_dict(orient='records')
-    columns = list(get_dso_config_data().columns)
+    dso_list = get_dso_dropdown()
+    columns = get_dso_config_columns()
     return render_template('setup_add.html', dso_list=dso_list, columns=columns)
 
 @app.route('/setup/edit/<org_id>', methods=['GET', 'POST'])
 def setup_edit(org_id):
-    data_df = get_dso_config_data()
-    data = data_df.to_dict(orient='records')
-    org = next((d for d in data if str(d["NSEntityID"]) == org_id), None)
+    from dso_config_cache import get_dso_config, get_dso_config_columns, get_dso_dropdown, save_dso_config
+
+    org = get_dso_config(org_id)
 
     if not org:
         return "DSO not found", 404
 
     if request.method == 'POST':
         updated_dso = {k: v for k, v in request.form.items()}
-        insert_or_update_dso_config(updated_dso)
+        save_dso_config(updated_dso)
         return redirect(url_for('setup'))
 
-    dso_df = get_dso_dropdown_options()
-    dso_list = dso_df.to_dict(orient='records')
-    columns = list(data_df.columns)
+    dso_list = get_dso_dropdown()
+    columns = get_dso_config_columns()
 
     return render_template('setup_edit.html', org=org, dso_list=dso_list, columns=columns)
 
 @app.route('/setup/delete/<org_id>', methods=['POST'])
 def setup_delete(org_id):
-    data = load_dso_data()
-    data = [d for d in data if d["NSEntityID"] != org_id]
-    save_dso_data(data)
+    from dso_config_cache import delete_dso_config
+    delete_dso_config(org_id)
     return redirect(url_for('setup'))
 
 if __name__ == '__main__':
@@ -0,0 +1,135 @@
+import time
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from config import (
+    APPROVED_INDEX_MODE, APPROVED_WATERMARK_COLUMN, APPROVED_FULL_RELOAD_SECONDS,
+    APPROVED_BLOOM_MIN_SIZE, APPROVED_BLOOM_BITS_PER_ID
+)
+from databricks_conn import fetch_approved_source_ids
+
+BLOOM_HASHES = 7
+# pandas hash keys must be exactly 16 bytes
+BLOOM_SECOND_KEY = 'approved-bloom-2'
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings, built and queried a whole array at a time."""
+
+    def __init__(self, n_items, bits_per_item):
+        self.n_bits = max(64, int(n_items * bits_per_item))
+        self.bits = np.zeros((self.n_bits + 7) // 8, dtype=np.uint8)
+
+    def _positions(self, values):
+        h1 = pd.util.hash_array(np.asarray(values, dtype=object))
+        h2 = pd.util.hash_array(np.asarray(values, dtype=object), hash_key=BLOOM_SECOND_KEY)
+        # Double hashing: the i-th probe is h1 + i * h2
+        probes = h1[:, None] + np.arange(BLOOM_HASHES, dtype=np.uint64)[None, :] * (h2[:, None] | np.uint64(1))
+        return probes % np.uint64(self.n_bits)
+
+    def add(self, values):
+        positions = self._positions(values).ravel()
+        np.bitwise_or.at(self.bits, positions // 8, (np.uint8(1) << (positions % 8).astype(np.uint8)))
+
+    def might_contain(self, values):
+        positions = self._positions(values)
+        hit = (self.bits[positions // 8] >> (positions % 8).astype(np.uint8)) & 1
+        return hit.all(axis=1)
+
+
+class ApprovedIndex:
+    """
+    Resident set of approved SourceIDs kept as a sorted string array (exact check),
+    fronted by a Bloom filter once it grows past APPROVED_BLOOM_MIN_SIZE.
+    """
+
+    def __init__(self):
+        self.ids = np.array([], dtype=str)
+        self.bloom = None
+        self.watermark = None
+        self.loaded_at = 0.0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def replace(self, ids):
+        self.ids = np.unique(np.asarray(ids, dtype=str))
+        self._rebuild_bloom()
+
+    def add(self, ids):
+        new = np.setdiff1d(np.asarray(ids, dtype=str), self.ids)
+        if len(new):
+            self.ids = np.union1d(self.ids, new)
+            if self.bloom is not None and len(self.ids) * APPROVED_BLOOM_BITS_PER_ID <= self.bloom.n_bits:
+                self.bloom.add(new)
+            else:
+                self._rebuild_bloom()
+        return len(new)
+
+    def _rebuild_bloom(self):
+        if len(self.ids) >= APPROVED_BLOOM_MIN_SIZE:
+            # Leave room for incremental additions before the filter has to be rebuilt
+            self.bloom = BloomFilter(len(self.ids) * 2, APPROVED_BLOOM_BITS_PER_ID)
+            self.bloom.add(self.ids)
+        else:
+            self.bloom = None
+
+    def contains(self, source_ids):
+        """Boolean array: which of source_ids are approved."""
+        values = np.asarray(source_ids, dtype=str)
+        result = np.zeros(len(values), dtype=bool)
+        if len(self.ids) == 0 or len(values) == 0:
+            return result
+        candidates = np.arange(len(values)) if self.bloom is None else np.flatnonzero(self.bloom.might_contain(values))
+        if len(candidates):
+            found = values[candidates]
+            pos = np.minimum(np.searchsorted(self.ids, found), len(self.ids) - 1)
+            result[candidates] = self.ids[pos] == found
+        return result
+
+
+_lock = threading.Lock()
+_index = ApprovedIndex()
+
+
+def _refresh_index():
+    now = time.time()
+    full = not _index.loaded_at or now - _index.loaded_at >= APPROVED_FULL_RELOAD_SECONDS or _index.watermark is None
+    if full:
+        # Full reloads also pick up approvals that were revoked since the last one
+        df = fetch_approved_source_ids(with_watermark=True)
+        _index.replace(df['source_id'].astype(str))
+        _index.loaded_at = now
+        logging.info(f" Approved-ID index loaded with {len(_index)} SourceIDs.")
+    else:
+        df = fetch_approved_source_ids(modified_since=_index.watermark, with_watermark=True)
+        added = _index.add(df['source_id'].astype(str))
+        logging.info(f" Approved-ID index delta: {len(df)} rows, {added} new SourceIDs.")
+    if 'modified' in df.columns and not df['modified'].dropna().empty:
+        latest = str(df['modified'].max())
+        _index.watermark = max(latest, _index.watermark or latest)
+
+
+def approved_source_id_mask(source_ids):
+    """
+    Returns a boolean array marking which SourceIDs are already approved.
+    In 'resident' mode the answer comes from the in-memory index, refreshed incrementally through
+    APPROVED_WATERMARK_COLUMN and rebuilt on every full reload; if a refresh fails, the last known
+    index is used (nothing is flagged if there isn't one).
+    In 'pushdown' mode only these SourceIDs are looked up in the warehouse and nothing is kept
+    between calls, so there is no earlier answer to fall back on: lookup errors are raised.
+    """
+    source_ids = pd.Series(source_ids, dtype=str)
+    if APPROVED_INDEX_MODE == 'resident' and APPROVED_WATERMARK_COLUMN:
+        with _lock:
+            try:
+                _refresh_index()
+            except Exception as e:
+                logging.error(f" Error refreshing the approved-ID index, using the last known one: {e}")
+            return _index.contains(source_ids)
+
+    df = fetch_approved_source_ids(source_ids=source_ids.unique().tolist())
+    lookup = ApprovedIndex()
+    lookup.replace(df['source_id'].astype(str))
+    return lookup.contains(source_ids)
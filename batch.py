@@ -0,0 +1,132 @@
+"""
+Batch matching: many DSO rosters against one load of the customer features.
+
+    python -m batch "Smile Dental=q3/smile.xlsx" 123456=q3/bright.xlsx --output summary.json
+
+Each argument pairs a DSO (its dso_config Name or NSEntityID) with a roster workbook.
+Files for the same DSO are matched together and written in one consolidated upload.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from config import BATCH_STOP_ON_ERROR
+from dso_config_cache import get_dso_configs
+from customer_features import get_customer_features
+from pipeline import run_matching_pipeline
+from ingest import prepare_roster_file
+from metrics import timed, collect_job_timings, track_peak_rss
+
+
+def _group_by_dso(rosters):
+    """{dso_name: ([file names], [prepared paths])} in first-seen order, with repeated file names numbered."""
+    groups = {}
+    for roster in rosters:
+        filenames, paths = groups.setdefault(roster['dso_name'], ([], []))
+        filename, n = roster['original_filename'], 2
+        while filename in filenames:
+            filename, n = f"{roster['original_filename']} ({n})", n + 1
+        filenames.append(filename)
+        paths.append(roster['prepared_path'])
+    return groups
+
+
+def run_batch(rosters, progress=None):
+    """
+    Matches every roster, a list of {'dso_name', 'original_filename', 'prepared_path'}, against
+    customer features loaded once, with one run (and one matched_data write) per DSO.
+    A DSO that fails is reported in the summary and the rest still run, unless BATCH_STOP_ON_ERROR is set.
+    Returns the summary: per-DSO stats and timings and per-file counts.
+    """
+    progress = progress or (lambda stage: None)
+    started = time.perf_counter()
+    with collect_job_timings() as timings, track_peak_rss() as rss:
+        progress('customers')
+        with timed('load_customers') as t:
+            customer_features = get_customer_features()
+            t['rows'] = len(customer_features['customers'])
+
+        progress('matching')
+        dsos, files = [], []
+        for dso_name, (filenames, paths) in _group_by_dso(rosters).items():
+            dso_started = time.perf_counter()
+            try:
+                stats = run_matching_pipeline(dso_name, filenames, paths, customer_features=customer_features)
+            except Exception as e:
+                if BATCH_STOP_ON_ERROR:
+                    raise
+                logging.error(f" Batch matching for {dso_name} failed: {e}")
+                dsos.append({'dso': dso_name, 'files': filenames, 'error': str(e)})
+                files.extend({'file': f, 'dso': dso_name, 'error': str(e)} for f in filenames)
+                continue
+            seconds = round(time.perf_counter() - dso_started, 3)
+            file_stats = stats.pop('files')
+            dsos.append({'dso': dso_name, 'files': filenames, 'seconds': seconds, **stats})
+            files.extend({**f, 'dso': dso_name, 'dso_seconds': seconds, 'results': stats.get('results')} for f in file_stats)
+            logging.info(f" Batch: {dso_name} done in {seconds:.2f}s ({len(filenames)} file(s), {stats['matched']} uploaded).")
+
+    failed = [d['dso'] for d in dsos if 'error' in d]
+    return {
+        'dsos': dsos,
+        'files': files,
+        'failed': failed,
+        'total': sum(d.get('total', 0) for d in dsos),
+        'approved': sum(d.get('approved', 0) for d in dsos),
+        'matched': sum(d.get('matched', 0) for d in dsos),
+        'seconds': round(time.perf_counter() - started, 3),
+        'timings': timings,
+        'peak_rss_mb': round(rss['peak_bytes'] / 2 ** 20, 1),
+    }
+
+
+def _find_config(dso):
+    """The dso_config row whose NSEntityID or Name is dso."""
+    configs = get_dso_configs()
+    for config_entry in configs:
+        if str(config_entry['NSEntityID']) == dso:
+            return config_entry
+    for config_entry in configs:
+        if config_entry['Name'] == dso:
+            return config_entry
+    raise KeyError(f"No dso_config entry for '{dso}'")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Match many DSO rosters in one pass.')
+    parser.add_argument('rosters', nargs='+', metavar='DSO=PATH', help='dso_config Name or NSEntityID and a roster .xlsx')
+    parser.add_argument('--output', help='write the JSON summary here as well as to stdout')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    rosters, parse_seconds = [], {}
+    for arg in args.rosters:
+        dso, sep, path = arg.rpartition('=')
+        if not sep or not dso or not path:
+            parser.error(f"expected DSO=PATH, got '{arg}'")
+        config_entry = _find_config(dso.strip())
+        started = time.perf_counter()
+        prepared_path = prepare_roster_file(path, config_entry, config_entry['Name'])
+        parse_seconds[(config_entry['Name'], path)] = round(time.perf_counter() - started, 3)
+        rosters.append({
+            'dso_name': config_entry['Name'],
+            'original_filename': os.path.basename(path),
+            'prepared_path': prepared_path,
+        })
+        print(f"Prepared {path} for {config_entry['Name']} in {parse_seconds[(config_entry['Name'], path)]:.2f}s", file=sys.stderr)
+
+    summary = run_batch(rosters)
+    summary['parse_seconds'] = [
+        {'dso': dso, 'path': path, 'seconds': seconds} for (dso, path), seconds in parse_seconds.items()
+    ]
+    text = json.dumps(summary, indent=2, default=str)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
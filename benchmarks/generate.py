@@ -0,0 +1,172 @@
+"""
+Seeded synthetic data for the benchmarks: a customer master shaped like get_customer_data()
+and DSO rosters laid out per a dso_config row, drawn from that master with realistic noise.
+"""
+import re
+import zipfile
+import shutil
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
+
+# A dso_config row for the synthetic DSO: target column -> roster column name
+BENCH_DSO_CONFIG = {
+    'ID': 0,
+    'Name': 'Benchmark DSO',
+    'NSEntityID': 'BENCH',
+    'Type': 'DSO',
+    'Header': 1,
+    'SheetName': None,
+    'Concat_Doctor': ['DrFirst', 'DrLast'],
+    'SourceID': 'Location ID',
+    'PracticeName': 'Practice Name',
+    'Address': 'Street Address',
+    'City': 'City',
+    'State': 'State',
+    'Zip': 'Postal Code',
+    'Emails': 'Office Email',
+    'AddEmail': 'Billing Email',
+    'DrFirst': 'Provider First Name',
+    'DrLast': 'Provider Last Name',
+    'ExternalID': 'none',
+}
+# Unmapped columns DSO exports carry along
+EXTRA_COLUMNS = ['Region', 'Open Date', 'Chairs', 'Manager', 'Phone', 'Fax', 'Notes', 'Tax ID']
+
+NAME_WORDS = [
+    'Bright', 'Happy', 'Gentle', 'Main Street', 'Oak Tree', 'Sunrise', 'Valley', 'Lakeside', 'Premier',
+    'Advanced', 'Pacific', 'Summit', 'Riverside', 'Cedar', 'Harbor', 'Willow', 'Canyon', 'Meadow',
+] + [a + b for a in ['Mar', 'Ken', 'Dal', 'Rob', 'Tel', 'Fan', 'Gus', 'Hol', 'Jem', 'Pit', 'Ash', 'Bel']
+     for b in ['ton', 'ley', 'wick', 'ford', 'by', 'ham', 'well', 'more', 'dale', 'son']]
+NAME_SUFFIXES = ['Dental', 'Family Dentistry', 'Smiles', 'Orthodontics', 'Dental Care', 'Dental Group', 'Pediatric Dentistry']
+STREETS = ['Main St', 'Oak Ave', 'Elm Rd', 'Broadway', '1st St', 'Park Blvd', 'Lake Dr', 'Center St', 'Hill Rd', 'Pine Ln']
+CITIES = ['Springfield', 'Riverside', 'Franklin', 'Greenville', 'Bristol', 'Clinton', 'Fairview', 'Salem']
+FIRST_NAMES = ['John', 'Jane', 'Alan', 'Maria', 'Wei', 'Raj', 'Sara', 'Tom', 'Ana', 'Omar', 'Lucy', 'Ken']
+LAST_NAMES = ['Smith', 'Lee', 'Patel', 'Garcia', 'Nguyen', 'Brown', 'Kim', 'Lopez', 'Cohen', 'Okafor']
+FREEMAIL = ['gmail.com', 'yahoo.com', 'outlook.com']
+STATE_NAMES = {
+    'CA': 'California', 'TX': 'Texas', 'NY': 'New York', 'FL': 'Florida', 'IL': 'Illinois',
+    'PA': 'Pennsylvania', 'OH': 'Ohio', 'GA': 'Georgia', 'NC': 'North Carolina', 'MI': 'Michigan',
+    'NJ': 'New Jersey', 'VA': 'Virginia', 'WA': 'Washington', 'AZ': 'Arizona', 'MA': 'Massachusetts',
+}
+
+
+def _pick(rng, values, n):
+    return np.asarray(values, dtype=object)[rng.integers(0, len(values), n)]
+
+
+def _join(*parts):
+    out = np.asarray(parts[0], dtype=str)
+    for p in parts[1:]:
+        out = np.char.add(out, np.asarray(p, dtype=str))
+    return out.astype(object)
+
+
+def make_customers(rows, seed=0):
+    """Customer master with the columns get_customer_data() returns."""
+    rng = np.random.default_rng(seed)
+    name_first = _pick(rng, NAME_WORDS, rows)
+    names = _join(name_first, ' ', _pick(rng, NAME_SUFFIXES, rows))
+    domains = _join(np.char.lower(name_first.astype(str)), np.arange(rows).astype(str), '.com')
+    billing = np.where(rng.random(rows) < 0.4, _pick(rng, FREEMAIL, rows), domains)
+    states = _pick(rng, list(STATE_NAMES), rows)
+    zips = rng.integers(1000, 99999, rows).astype(str)
+    doctor_count = rng.integers(0, 4, rows)
+    doctors = np.full(rows, '', dtype=object)
+    for k in range(3):
+        name = _join(_pick(rng, FIRST_NAMES, rows), ' ', _pick(rng, LAST_NAMES, rows))
+        doctors = np.where(doctor_count > k, np.where(doctors == '', name, doctors + ', ' + name), doctors)
+    return pd.DataFrame({
+        'Name': names,
+        'Address': _join(rng.integers(1, 9999, rows).astype(str), ' ', _pick(rng, STREETS, rows)),
+        'State': states,
+        'Zip': np.char.zfill(zips, 5),
+        'City': _pick(rng, CITIES, rows),
+        'Emails': _join('office@', domains, ', billing@', billing),
+        'Doctors': doctors,
+        'MatchedEntityID': np.char.add('P', np.arange(rows).astype(str)).astype(object),
+        'LastModified': pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 365 * 24, rows), unit='h'),
+    })
+
+
+def _typo(rng, values, rate):
+    """Drops one character from about `rate` of the values."""
+    values = values.astype(object).copy()
+    for i in np.flatnonzero(rng.random(len(values)) < rate):
+        s = values[i]
+        if s:
+            j = rng.integers(0, len(s))
+            values[i] = s[:j] + s[j + 1:]
+    return values
+
+
+def make_roster(customers, rows, seed=0, match_rate=0.8, config=None):
+    """
+    A DSO roster in its source layout (column names from the dso_config row).
+    About match_rate of the rows are noisy copies of customers; the rest are new practices.
+    Also returns the true MatchedEntityID per SourceID ('' for new practices).
+    """
+    config = config or BENCH_DSO_CONFIG
+    rng = np.random.default_rng(seed + 1)
+    matched = rng.random(rows) < match_rate
+    picks = rng.integers(0, len(customers), rows)
+    base = customers.iloc[picks].reset_index(drop=True)
+    fresh = make_customers(rows, seed + 2)
+    src = base.where(pd.DataFrame({col: matched for col in base.columns}), fresh)
+
+    first_doctor = src['Doctors'].str.split(', ').str[0].fillna('')
+    emails = src['Emails'].str.split(', ')
+    state = src['State'].to_numpy(dtype=object)
+    spelled = rng.random(rows) < 0.3
+    state[spelled] = [STATE_NAMES[s] for s in state[spelled]]
+    zips = src['Zip'].to_numpy(dtype=object)
+    # Excel exports often lose the ZIP's leading zero
+    zips = np.where(rng.random(rows) < 0.5, [z.lstrip('0') for z in zips], zips)
+
+    roster = pd.DataFrame({
+        'SourceID': np.char.add('LOC-', np.arange(rows).astype(str)).astype(object),
+        'PracticeName': _typo(rng, src['Name'].to_numpy() + _pick(rng, ['', '', 's', ' PC', ' LLC'], rows), 0.3),
+        'Address': np.where(rng.random(rows) < 0.9, _typo(rng, src['Address'].to_numpy(), 0.3), ''),
+        'City': src['City'].to_numpy(),
+        'State': state,
+        'Zip': zips,
+        'Emails': np.where(rng.random(rows) < 0.7, emails.str[0].fillna(''), ''),
+        'AddEmail': np.where(rng.random(rows) < 0.3, emails.str[1].fillna(''), ''),
+        'DrFirst': first_doctor.str.split(' ').str[0].fillna('').to_numpy(),
+        'DrLast': first_doctor.str.split(' ').str[1].fillna('').to_numpy(),
+    })
+    for col in EXTRA_COLUMNS:
+        roster[col] = _pick(rng, ['', 'n/a', 'East', 'West', '12', '555-0100'], rows)
+
+    truth = pd.Series(np.where(matched, base['MatchedEntityID'], ''), index=roster['SourceID'], name='truth')
+    mapping = {k: v for k, v in config.items() if isinstance(v, str) and k not in ('Name', 'NSEntityID', 'Type') and v != 'none'}
+    return roster.rename(columns=mapping), truth
+
+
+def _set_dimension(path, ref):
+    # Write-only workbooks have no <dimension>; real Excel files do, and without it
+    # openpyxl's read-only mode scans the whole sheet just to size it
+    tmp = path + '.tmp'
+    with zipfile.ZipFile(path) as src, zipfile.ZipFile(tmp, 'w', zipfile.ZIP_DEFLATED) as dst:
+        for item in src.infolist():
+            data = src.read(item.filename)
+            if re.fullmatch(r'xl/worksheets/sheet\d+\.xml', item.filename):
+                data = data.replace(b'<sheetData>', f'<dimension ref="{ref}"/><sheetData>'.encode(), 1)
+            dst.writestr(item, data)
+    shutil.move(tmp, path)
+
+
+def write_roster_excel(roster, path, config=None):
+    """Writes the roster as an .xlsx export, with config['Header'] title rows above the header."""
+    config = config or BENCH_DSO_CONFIG
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Locations')
+    header = int(config.get('Header', 0))
+    for i in range(header):
+        ws.append([f"{config['Name']} location export" if i == 0 else None])
+    ws.append(list(roster.columns))
+    for row in roster.itertuples(index=False, name=None):
+        ws.append(row)
+    wb.save(path)
+    _set_dimension(path, f"A1:{get_column_letter(roster.shape[1])}{len(roster) + header + 1}")
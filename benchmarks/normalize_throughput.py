@@ -0,0 +1,105 @@
+"""
+Per-column throughput of roster normalization: the previous row-at-a-time code vs normalize.py.
+
+    python -m benchmarks.normalize_throughput --rows 100000
+"""
+import argparse
+import random
+import time
+import pandas as pd
+from recordlinkage.preprocessing import clean
+from config import STATE_LOOKUP
+import normalize
+
+STATES = ['CA', 'ca', 'California', 'TX', 'Texas', ' new york ', 'NY', 'FL', 'Florida', 'wa']
+WORDS = ['smile', 'dental', 'family', 'bright', 'oak', 'main', 'kids', 'ortho', '(HQ)', 'Dr.', 'LLC,']
+DOMAINS = ['gmail.com', 'brightsmiles.com', 'yahoo.com', 'oakdental.net']
+
+
+def make_roster(rows, seed):
+    rng = random.Random(seed)
+
+    def email():
+        return f"{rng.choice(['office', 'info', 'billing', 'dr.' + rng.choice(WORDS).lower()])}@{rng.choice(DOMAINS)}"
+
+    return pd.DataFrame({
+        'Name': [' '.join(rng.choices(WORDS, k=rng.randint(2, 4))) for _ in range(rows)],
+        'Address': [f"{rng.randint(1, 9999)} {rng.choice(WORDS)} St" for _ in range(rows)],
+        'State': [rng.choice(STATES) for _ in range(rows)],
+        'Emails': [', '.join(email() for _ in range(rng.randint(0, 3))) for _ in range(rows)],
+        'AddEmail': [email() if rng.random() < 0.5 else '' for _ in range(rows)],
+        'DrFirst': [rng.choice(['John', 'Ann', 'Li', None]) for _ in range(rows)],
+        'DrLast': [rng.choice(['Smith', 'Ng', 'Garcia']) for _ in range(rows)],
+    })
+
+
+def before(df):
+    """The code upload_file and match_records_by_fields ran before normalize.py, column by column."""
+    return {
+        'Emails (combine)': lambda: df[['Emails', 'AddEmail']].astype(str).agg(','.join, axis=1),
+        'Emails (dedupe)': lambda: df['Emails'].apply(
+            lambda x: ','.join(sorted(set(e.strip() for e in str(x).split(',') if e.strip())))
+            if pd.notnull(x) else None
+        ),
+        'Doctors (concat)': lambda: df['DrFirst'].fillna('') + ' ' + df['DrLast'].fillna(''),
+        'Name (clean)': lambda: clean(df['Name'].astype(str).fillna('')),
+        'Address (clean)': lambda: clean(df['Address'].astype(str).fillna('')),
+        'State (clean + lookup)': lambda: clean(df['State'].astype(str).fillna('')).str.strip().map(
+            lambda x: STATE_LOOKUP.get(x.lower(), x.upper())
+        ),
+    }
+
+
+def after(df):
+    return {
+        'Emails (combine)': lambda: normalize.combine_emails(df['Emails'], df['AddEmail']),
+        'Emails (dedupe)': lambda: normalize.dedupe_emails(df['Emails']),
+        'Doctors (concat)': lambda: normalize.concat_doctors(df, ['DrFirst', 'DrLast']),
+        'Name (clean)': lambda: normalize.clean_text(df['Name']),
+        'Address (clean)': lambda: normalize.clean_text(df['Address']),
+        'State (clean + lookup)': lambda: normalize.canonical_state(normalize.clean_text(df['State'])),
+    }
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def run(rows, seed=0, repeat=3):
+    """Returns one dict per column with before/after seconds and rows/sec; results are checked for equality."""
+    df = make_roster(rows, seed)
+    old, new = before(df), after(df)
+    results = []
+    for column in old:
+        old_seconds, old_result = best_of(old[column], repeat)
+        new_seconds, new_result = best_of(new[column], repeat)
+        pd.testing.assert_series_equal(old_result, new_result, check_dtype=False, check_names=False)
+        results.append({
+            'column': column,
+            'rows': rows,
+            'before_rows_per_sec': round(rows / old_seconds),
+            'after_rows_per_sec': round(rows / new_seconds),
+            'speedup': round(old_seconds / new_seconds, 2),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'column':<24}{'before rows/s':>16}{'after rows/s':>16}{'speedup':>10}")
+    for r in run(args.rows, args.seed, args.repeat):
+        print(f"{r['column']:<24}{r['before_rows_per_sec']:>16,}{r['after_rows_per_sec']:>16,}{r['speedup']:>9}x")
+
+
+if __name__ == '__main__':
+    main()
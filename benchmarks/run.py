@@ -0,0 +1,202 @@
+"""
+End-to-end matching benchmark on seeded synthetic data, timed stage by stage.
+
+    python -m benchmarks.run --sizes 1k 10k --output bench.json
+
+Stages: excel_parse, normalize, block_index, exact_index, exact_match (EXACT_MATCH_KEYS), then
+blocking, compare and best_match as timed inside match_logic.score_best_matches for the rows exact
+keys didn't resolve, assemble and upload_build (the bulk INSERTs into an in-memory SQLite stand-in
+for matched_data).
+databricks_conn is imported for the matched_data column list; nothing connects to the warehouse,
+so DATABRICKS_* don't need to be set.
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from contextlib import contextmanager
+import pandas as pd
+from benchmarks.generate import BENCH_DSO_CONFIG, make_customers, make_roster, write_roster_excel
+from ingest import ExcelIngest, transform_chunk
+from match_logic import prepare_roster, prepare_customers, score_best_matches, _score_exact
+from blocking import build_block_index
+from exact_match import build_exact_index, exact_matches
+from metrics import collect_job_timings
+from config import EXACT_MATCH_KEYS
+from bulk_writer import SQLBackend, SQLITE_MAX_PARAMS, bulk_insert
+from databricks_conn import MATCHED_DATA_COLUMNS
+
+# Roster rows, customer master rows
+SIZES = {
+    '1k': (1_000, 10_000),
+    '10k': (10_000, 50_000),
+    '100k': (100_000, 200_000),
+    '1m': (1_000_000, 1_000_000),
+}
+
+
+def _version():
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        ).stdout.strip()
+    except Exception:
+        return 'unknown'
+
+
+def _peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+class Timer:
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        yield
+        self.record(name, time.perf_counter() - started)
+
+    def record(self, name, seconds):
+        self.stages[name] = round(seconds, 4)
+        print(f"  {name:<14}{self.stages[name]:>10.3f}s", flush=True)
+
+
+def _sqlite_standin():
+    conn = sqlite3.connect(':memory:', check_same_thread=False)
+    conn.execute(f"CREATE TABLE matched_data ({', '.join(f'`{c}`' for c in MATCHED_DATA_COLUMNS)})")
+
+    @contextmanager
+    def connection():
+        yield conn
+
+    return conn, SQLBackend(connection, 'matched_data', paramstyle='qmark', max_params=SQLITE_MAX_PARAMS)
+
+
+def run_size(roster_rows, customer_rows, seed=0, min_score=2):
+    """Generates data for one size, runs every stage once and returns the measurements."""
+    print(f"roster {roster_rows:,} x customers {customer_rows:,}", flush=True)
+    timer = Timer()
+    config = BENCH_DSO_CONFIG
+
+    setup_started = time.perf_counter()
+    customers = make_customers(customer_rows, seed)
+    roster, truth = make_roster(customers, roster_rows, seed, config=config)
+    path = os.path.join(tempfile.gettempdir(), f"bench-roster-{seed}-{roster_rows}.xlsx")
+    write_roster_excel(roster, path, config)
+    setup_seconds = time.perf_counter() - setup_started
+    del roster
+
+    try:
+        with timer.stage('excel_parse'):
+            ingest = ExcelIngest(path, config, config['Name'], transform=False)
+            df = pd.concat(list(ingest.chunks()), ignore_index=True)
+            ingest.close()
+    finally:
+        os.remove(path)
+
+    with timer.stage('normalize'):
+        df = transform_chunk(df, config, config['Name'])
+        df['Name'] = df.pop('PracticeName')
+        df1 = prepare_roster(df)
+        df2 = prepare_customers(customers)
+
+    with timer.stage('block_index'):
+        block_index = build_block_index(df2)
+
+    with timer.stage('exact_index'):
+        exact_index = build_exact_index(df2)
+
+    with timer.stage('exact_match'):
+        exact = exact_matches(df1, df2, exact_index, keys=EXACT_MATCH_KEYS)
+        if not exact.empty:
+            exact = _score_exact(exact, df1, df2)
+        unresolved = df1[~df1['SourceID'].isin(exact['SourceID'])]
+
+    # The same call match_records_by_fields makes; it times its own blocking, compare and best_match
+    with collect_job_timings() as timings:
+        fuzzy = score_best_matches(unresolved, df2, min_score, block_index) if len(unresolved) else None
+    stage_timings = {entry['stage']: entry for entry in timings}
+    for name in ['blocking', 'compare', 'best_match']:
+        timer.record(name, stage_timings[name]['seconds'] if name in stage_timings else 0.0)
+
+    with timer.stage('assemble'):
+        best = pd.concat([r for r in [exact, fuzzy] if r is not None and not r.empty], ignore_index=True)
+        best = best.merge(
+            df2[['MatchedEntityID', 'Name']].rename(columns={'Name': 'MatchedPracticeName'}),
+            left_on='level_1', right_index=True, how='left'
+        )
+        out = df.merge(
+            best[['SourceID', 'MatchedName', 'MatchedEmails', 'MatchedAddress', 'MatchedDoctors',
+                  'TotalScore', 'MatchedEntityID', 'MatchedPracticeName']],
+            on='SourceID', how='left'
+        )
+        out['AlreadyApproved'] = False
+        out['FileName'] = 'benchmark.xlsx'
+        out['UploadedDate'] = pd.Timestamp.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    conn, backend = _sqlite_standin()
+    with timer.stage('upload_build'):
+        upload = bulk_insert(out, MATCHED_DATA_COLUMNS, backend)
+    conn.close()
+
+    found = out.set_index('SourceID')['MatchedEntityID'].fillna('')
+    expected = truth.reindex(found.index)
+    return {
+        'roster_rows': roster_rows,
+        'customer_rows': customer_rows,
+        'setup_seconds': round(setup_seconds, 3),
+        'stages': timer.stages,
+        'total_seconds': round(sum(timer.stages.values()), 4),
+        'rows_per_sec': {k: round(roster_rows / v, 1) if v else None for k, v in timer.stages.items()},
+        'exact_matched': len(exact),
+        'candidate_pairs': stage_timings.get('blocking', {}).get('rows') or 0,
+        'matched': int((found != '').sum()),
+        'correct': int(((found == expected) & (expected != '')).sum()),
+        'false_matches': int(((found != expected) & (found != '')).sum()),
+        'upload_bytes': upload['bytes_sent'],
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', default=['1k', '10k'], choices=list(SIZES))
+    parser.add_argument('--roster-rows', type=int, help='overrides --sizes with one custom size')
+    parser.add_argument('--customer-rows', type=int)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    args = parser.parse_args()
+
+    if args.roster_rows:
+        sizes = [(args.roster_rows, args.customer_rows or args.roster_rows * 10)]
+    else:
+        sizes = [SIZES[s] for s in args.sizes]
+
+    report = {
+        'version': _version(),
+        'created_at': pd.Timestamp.now(tz='UTC').isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'seed': args.seed,
+        # peak_rss_mb is the process high-water mark, so it only grows across runs
+        'runs': [run_size(r, c, args.seed) for r, c in sizes],
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
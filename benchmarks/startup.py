@@ -0,0 +1,183 @@
+"""
+Worker start-up time and per-worker memory with the shared, memory-mapped customer features.
+
+    python -m benchmarks.startup --workers 4 --customer-rows 200000 --output startup.json
+
+Publishes seeded customer features into a scratch directory, then starts --workers processes one
+after another the way a WSGI server's workers come up: each imports app, serves '/' once, loads the
+customer features (importing the matching code on the way) and answers a few match API calls.
+Once every worker is up, each one's RSS, PSS (shared pages split between the processes mapping
+them) and private memory are read from /proc/<pid>/smaps_rollup, so this needs Linux. It runs once
+with CUSTOMER_FEATURES_MMAP on and once with it off (every worker reading its own copy) for comparison.
+Everything else, MATCH_API_WARM_ON_START included, uses the shipped defaults unless set in the environment.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+MODES = {'mmap': 'true', 'private': 'false'}
+
+
+def _smaps_mb(pid):
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return {
+        'rss_mb': round(fields['Rss'] / 1024, 1),
+        'pss_mb': round(fields['Pss'] / 1024, 1),
+        'private_mb': round((fields['Private_Clean'] + fields['Private_Dirty']) / 1024, 1),
+    }
+
+
+def _publish_features(customer_rows, seed, scratch):
+    """Writes a seeded customer snapshot and builds its features, as a snapshot refresh would."""
+    from benchmarks.generate import make_customers
+    import customer_snapshot
+    from customer_features import get_customer_features
+
+    customers = make_customers(customer_rows, seed)
+    now = time.time()
+    customer_snapshot._write_snapshot(customers, {
+        'full_refreshed_at': now, 'refreshed_at': now, 'watermark': None,
+        'rows': len(customers), 'content_hash': customer_snapshot._content_hash(customers),
+    })
+    started = time.perf_counter()
+    get_customer_features()
+    build_seconds = time.perf_counter() - started
+
+    records = customers.sample(50, random_state=seed)[['Name', 'Address', 'City', 'State', 'Zip', 'Emails', 'Doctors']]
+    records_path = os.path.join(scratch, 'records.json')
+    records.astype(str).to_json(records_path, orient='records')
+    return build_seconds, records_path
+
+
+def _worker(records_path):
+    """One worker: prints its timings as a JSON line, then stays up until stdin closes."""
+    started = time.perf_counter()
+    import app
+    import_seconds = time.perf_counter() - started
+
+    client = app.app.test_client()
+    started = time.perf_counter()
+    status = client.get('/').status_code
+    first_page_seconds = time.perf_counter() - started
+    heavy_imported = 'pandas' in sys.modules
+    # What a worker that hasn't served the match API holds (with MATCH_API_WARM_ON_START, while it warms)
+    first_page_rss_mb = _smaps_mb(os.getpid())['rss_mb']
+
+    # Includes importing the matching code, which the first page no longer pays for
+    started = time.perf_counter()
+    import match_api
+    from customer_features import get_customer_features
+    get_customer_features()
+    features_seconds = time.perf_counter() - started
+
+    with open(records_path) as f:
+        records = json.load(f)
+    started = time.perf_counter()
+    for record in records:
+        match_api.match_records([record])
+    match_ms = (time.perf_counter() - started) * 1000 / len(records)
+
+    print(json.dumps({
+        'import_seconds': round(import_seconds, 3),
+        'first_page_seconds': round(first_page_seconds, 4),
+        'first_page_status': status,
+        'pandas_loaded_by_first_page': heavy_imported,
+        'first_page_rss_mb': first_page_rss_mb,
+        'features_seconds': round(features_seconds, 3),
+        'match_ms': round(match_ms, 1),
+    }), flush=True)
+    sys.stdin.read()
+
+
+def run_mode(mode, workers, records_path, env):
+    """Starts the workers for one CUSTOMER_FEATURES_MMAP setting and measures them all while they're up."""
+    env = dict(env, CUSTOMER_FEATURES_MMAP=MODES[mode])
+    procs, results = [], []
+    try:
+        for _ in range(workers):
+            started = time.perf_counter()
+            proc = subprocess.Popen(
+                [sys.executable, '-m', 'benchmarks.startup', '--worker', records_path],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env, text=True
+            )
+            procs.append(proc)
+            line = proc.stdout.readline()
+            if not line:
+                raise RuntimeError(f"A {mode} worker exited before it was ready (exit code {proc.wait()})")
+            results.append(dict(json.loads(line), ready_seconds=round(time.perf_counter() - started, 3)))
+        for proc, result in zip(procs, results):
+            result.update(_smaps_mb(proc.pid))
+    finally:
+        for proc in procs:
+            proc.stdin.close()
+            proc.wait()
+
+    total = {k: round(sum(r[k] for r in results), 1) for k in ('rss_mb', 'pss_mb', 'private_mb')}
+    print(f"{mode}: {workers} workers, RSS {total['rss_mb']} MB, PSS {total['pss_mb']} MB, private {total['private_mb']} MB")
+    for i, r in enumerate(results):
+        print(
+            f"  worker {i}: import {r['import_seconds']:.2f}s, '/' {r['first_page_seconds'] * 1000:.0f}ms "
+            f"(RSS {r['first_page_rss_mb']} MB), "
+            f"features {r['features_seconds']:.2f}s, match {r['match_ms']:.0f}ms, "
+            f"RSS {r['rss_mb']} / PSS {r['pss_mb']} / private {r['private_mb']} MB", flush=True
+        )
+    return {'workers': results, 'total': total}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--customer-rows', type=int, default=200_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES))
+    parser.add_argument('--output', default='startup_results.json')
+    parser.add_argument('--worker', metavar='RECORDS', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        _worker(args.worker)
+        return
+
+    scratch = tempfile.mkdtemp(prefix='bench-startup-')
+    # Set before config is imported, here and in the workers, so nothing touches the real caches or the warehouse
+    env = dict(
+        os.environ,
+        CUSTOMER_SNAPSHOT_DIR=os.path.join(scratch, 'snapshot'),
+        CUSTOMER_FEATURES_DIR=os.path.join(scratch, 'features'),
+        CUSTOMER_SNAPSHOT_TTL_SECONDS=str(10 ** 9),
+        JOBS_DB_PATH=os.path.join(scratch, 'jobs.sqlite3'),
+    )
+    os.environ.update(env)
+    try:
+        from config import MATCH_API_WARM_ON_START
+        build_seconds, records_path = _publish_features(args.customer_rows, args.seed, scratch)
+        print(f"Published features for {args.customer_rows:,} customers in {build_seconds:.1f}s", flush=True)
+        report = {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'customer_rows': args.customer_rows,
+            'match_api_warm_on_start': MATCH_API_WARM_ON_START,
+            'build_seconds': round(build_seconds, 3),
+            'modes': {mode: run_mode(mode, args.workers, records_path, env) for mode in args.modes},
+        }
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == '__main__':
+    main()
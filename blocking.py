@@ -0,0 +1,285 @@
+import os
+import json
+import logging
+import numpy as np
+import pandas as pd
+from config import BLOCKING_KEYS, BLOCKING_SN_WINDOW, COMMON_EMAIL_DOMAINS
+from normalize import clean_text, zip_digits
+import metrics
+
+# Words that say nothing about which practice a name refers to
+GENERIC_NAME_WORDS = {
+    'the', 'of', 'and', 'at', 'dental', 'dentistry', 'dentist', 'dentists', 'family', 'care',
+    'group', 'office', 'center', 'centre', 'clinic', 'associates', 'dds', 'dmd', 'pc', 'pa',
+    'pllc', 'llc', 'inc', 'ltd', 'co'
+}
+
+KEY_COLUMNS = {
+    'zip3': 'BlockZip3',
+    'name_phonetic': 'BlockName',
+    'email_domain': 'BlockEmailDomains',
+}
+
+
+def _zip3(zips):
+    digits = zip_digits(zips)
+    return digits.str[:3].where(digits.str.len() >= 5, '')
+
+
+def _name_key(names):
+    # Deferred like normalize.clean_text's import: recordlinkage loads scikit-learn and scipy
+    from recordlinkage.preprocessing import phonetic
+
+    tokens = clean_text(names).str.split()
+    first = tokens.map(lambda t: next((w for w in t if w not in GENERIC_NAME_WORDS), '') if isinstance(t, list) else '')
+    return phonetic(first, 'metaphone').fillna('')
+
+
+def _email_domains(emails):
+    domains = (
+        emails.fillna('').astype(str).str.lower()
+        .str.findall(r'@([a-z0-9.\-]+\.[a-z]{2,})')
+    )
+    return domains.map(lambda d: ','.join(sorted(set(d) - COMMON_EMAIL_DOMAINS)))
+
+
+def add_blocking_keys(df):
+    """
+    Adds the blocking key columns (BlockZip3, BlockName, BlockEmailDomains) to df in place.
+    Must run on the raw Zip/Name/Emails values, before clean() strips '@' and '.' from emails.
+    """
+    df['BlockZip3'] = _zip3(df['Zip']) if 'Zip' in df.columns else ''
+    df['BlockName'] = _name_key(df['Name']) if 'Name' in df.columns else ''
+    df['BlockEmailDomains'] = _email_domains(df['Emails']) if 'Emails' in df.columns else ''
+    return df
+
+
+def _key_array(keys, state=None):
+    """One string key per row ('' when the row has no key), prefixed with the row's State when given."""
+    keys = keys.fillna('').astype(str).to_numpy(dtype=object)
+    if state is not None:
+        keys = np.where(keys != '', state.astype(str).to_numpy(dtype=object) + '|' + keys, '')
+    return keys
+
+
+def _explode(keys, explode):
+    """Returns (row position, key) for every non-empty key; comma-separated keys are split when explode is set."""
+    pos = np.arange(len(keys))
+    if explode:
+        parts = [k.split(',') for k in keys]
+        pos = np.repeat(pos, [len(p) for p in parts])
+        keys = np.array([k for p in parts for k in p], dtype=object)
+    keep = keys != ''
+    return pos[keep], keys[keep].astype(str)
+
+
+def _expand(starts, counts):
+    """Flat indices covering [start, start + count) for every (start, count)."""
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + within
+
+
+def _build_key_lookup(keys, explode):
+    pos, keys = _explode(keys, explode)
+    order = np.argsort(keys, kind='stable')
+    return {'keys': keys[order], 'pos': pos[order]}
+
+
+def _join_pairs(lookup, left_keys, explode):
+    left_pos, keys = _explode(left_keys, explode)
+    lo = np.searchsorted(lookup['keys'], keys, side='left')
+    hi = np.searchsorted(lookup['keys'], keys, side='right')
+    counts = hi - lo
+    return np.repeat(left_pos, counts), lookup['pos'][_expand(lo, counts)]
+
+
+def _build_neighbourhood(keys):
+    right_pos = np.flatnonzero(keys != '')
+    ranked, rank = np.unique(keys[right_pos].astype(str), return_inverse=True)
+    counts = np.bincount(rank, minlength=len(ranked))
+    return {
+        'ranked': ranked,
+        'ranked_state': np.array([k.split('|', 1)[0] for k in ranked], dtype=str),
+        'pos': right_pos[np.argsort(rank, kind='stable')],
+        'starts': np.cumsum(counts) - counts,
+        'counts': counts,
+    }
+
+
+def _sorted_neighbourhood(lookup, left_keys, left_state, window):
+    """
+    Pairs each left value with the right rows whose value falls within window // 2 ranks
+    of it in the sorted right-hand values (same State only, when states are given).
+    Unlike recordlinkage's sorted neighbourhood, the rank window is taken over the right side only,
+    so a row's neighbours don't depend on which other roster rows are being matched with it.
+    """
+    ranked = lookup['ranked']
+    left_pos = np.flatnonzero(left_keys != '')
+    if len(ranked) == 0 or len(left_pos) == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+    half = window // 2
+    offsets = np.arange(-half, half + 1)
+    centre = np.searchsorted(ranked, left_keys[left_pos].astype(str))
+    left = np.repeat(left_pos, len(offsets))
+    ranks = (centre[:, None] + offsets[None, :]).ravel()
+    in_range = (ranks >= 0) & (ranks < len(ranked))
+    left, ranks = left[in_range], ranks[in_range]
+
+    if left_state is not None:
+        same_state = lookup['ranked_state'][ranks] == left_state.astype(str).to_numpy()[left]
+        left, ranks = left[same_state], ranks[same_state]
+
+    # Expand each (left row, right rank) into every right row holding that value
+    counts = lookup['counts'][ranks]
+    return np.repeat(left, counts), lookup['pos'][_expand(lookup['starts'][ranks], counts)]
+
+
+def build_block_index(df2, keys=None, use_state=None):
+    """
+    Precomputes the customer side of every blocking key (sorted key arrays and the
+    address neighbourhood ranking) so it can be reused across roster chunks and runs.
+    df2 must already have cleaned Name/Address/State and the columns from add_blocking_keys().
+    """
+    keys = BLOCKING_KEYS if keys is None else keys
+    use_state = 'State' in df2.columns if use_state is None else use_state
+    state = df2['State'] if use_state else None
+
+    index = {'keys': list(keys), 'use_state': use_state, 'size': len(df2), 'lookups': {}}
+    if use_state:
+        index['state_counts'] = df2['State'].value_counts()
+
+    for key in keys:
+        if key == 'state':
+            if use_state:
+                index['lookups'][key] = _build_key_lookup(_key_array(df2['State']), False)
+        elif key == 'address_sn':
+            if 'Address' in df2.columns:
+                index['lookups'][key] = _build_neighbourhood(_key_array(df2['Address'], state))
+        elif key in KEY_COLUMNS:
+            column = KEY_COLUMNS[key]
+            if column in df2.columns:
+                key_state = state if key == 'name_phonetic' else None
+                index['lookups'][key] = _build_key_lookup(_key_array(df2[column], key_state), key == 'email_domain')
+        else:
+            raise ValueError(f"Unknown blocking key '{key}'")
+    return index
+
+
+def save_block_index(index, path):
+    """
+    Writes a build_block_index() result to the directory path: meta.json and one uncompressed .npy
+    per array (no pickling), so load_block_index() can memory-map them.
+    """
+    os.makedirs(path, exist_ok=True)
+    arrays = {}
+    if 'state_counts' in index:
+        arrays['state_counts.index'] = index['state_counts'].index.to_numpy().astype(str)
+        arrays['state_counts.values'] = index['state_counts'].to_numpy()
+    for key, lookup in index['lookups'].items():
+        for field, values in lookup.items():
+            arrays[f"lookup.{key}.{field}"] = values
+    for name, values in arrays.items():
+        np.save(os.path.join(path, f"{name}.npy"), np.asarray(values), allow_pickle=False)
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({'keys': index['keys'], 'use_state': index['use_state'], 'size': index['size'], 'arrays': list(arrays)}, f)
+
+
+def load_block_index(path, mmap_mode=None):
+    """
+    Reads an index written by save_block_index(). With mmap_mode='r' the arrays are read-only
+    memory maps of the files, so processes loading the same index share one copy in the page cache.
+    """
+    with open(os.path.join(path, 'meta.json')) as f:
+        index = json.load(f)
+    arrays = {
+        name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode, allow_pickle=False)
+        for name in index.pop('arrays')
+    }
+    index['lookups'] = {}
+    if 'state_counts.index' in arrays:
+        index['state_counts'] = pd.Series(np.asarray(arrays['state_counts.values']), index=np.asarray(arrays['state_counts.index']), name='count')
+    for name, values in arrays.items():
+        if name.startswith('lookup.'):
+            _, key, field = name.split('.', 2)
+            index['lookups'].setdefault(key, {})[field] = values
+    return index
+
+
+def candidate_pairs(df1, df2, keys=None, block_index=None):
+    """
+    Builds candidate pairs as the union of several blocking keys:
+      state          - same State (the original blocking)
+      zip3           - same first three ZIP digits
+      name_phonetic  - same State and same metaphone of the first distinctive Name word
+      email_domain   - a shared, non-freemail email domain
+      address_sn     - sorted-neighbourhood window over Address within the same State
+    df1/df2 must already have cleaned Name/Address/State and the columns from add_blocking_keys().
+    Pass a block_index from build_block_index(df2) to avoid rebuilding the customer side.
+    Returns a MultiIndex of (df1 label, df2 label) sorted by position, like recordlinkage.Index.
+    """
+    left, right = candidate_pair_positions(df1, df2, keys, block_index)
+    return pd.MultiIndex.from_arrays([df1.index[left], df2.index[right]], names=[None, None])
+
+
+def candidate_pair_positions(df1, df2, keys=None, block_index=None):
+    """The pairs of candidate_pairs() as (df1 positions, df2 positions) arrays, without building a MultiIndex."""
+    keys = BLOCKING_KEYS if keys is None else keys
+    use_state = 'State' in df1.columns and 'State' in df2.columns
+    if block_index is None or block_index['keys'] != list(keys) or block_index['use_state'] != use_state:
+        block_index = build_block_index(df2, keys, use_state)
+
+    state = df1['State'] if use_state else None
+    n_right = len(df2)
+
+    pair_codes = []
+    for key in keys:
+        lookup = block_index['lookups'].get(key)
+        if key == 'state':
+            if lookup is None:
+                continue
+            left, right = _join_pairs(lookup, _key_array(df1['State']), False)
+        elif key == 'address_sn':
+            if lookup is None or 'Address' not in df1.columns:
+                continue
+            left, right = _sorted_neighbourhood(lookup, _key_array(df1['Address'], state), state, BLOCKING_SN_WINDOW)
+        else:
+            column = KEY_COLUMNS[key]
+            if lookup is None or column not in df1.columns:
+                continue
+            # Names are only compared within the same State, like the original blocking
+            key_state = state if key == 'name_phonetic' else None
+            left, right = _join_pairs(lookup, _key_array(df1[column], key_state), key == 'email_domain')
+
+        codes = np.unique(left.astype(np.int64) * n_right + right)
+        pair_codes.append((key, codes))
+
+    if not pair_codes:
+        logging.info(" No usable blocking keys, comparing every pair.")
+        return np.repeat(np.arange(len(df1)), n_right), np.tile(np.arange(n_right), len(df1))
+
+    union = np.unique(np.concatenate([codes for _, codes in pair_codes]))
+
+    if use_state:
+        state_counts = df1['State'].value_counts()
+        baseline = int((state_counts * block_index['state_counts']).dropna().sum())
+    else:
+        baseline = len(df1) * n_right
+    baseline = max(baseline, 1)
+
+    seen = np.array([], dtype=np.int64)
+    for key, codes in pair_codes:
+        added = np.setdiff1d(codes, seen, assume_unique=True)
+        seen = np.union1d(seen, codes)
+        metrics.observe('dso_block_pairs', len(codes), 'Candidate pairs per blocking key per run.', metrics.COUNT_BUCKETS, key=key)
+        logging.info(
+            f" Blocking key '{key}': {len(codes)} pairs ({len(added)} not covered by earlier keys), "
+            f"{len(codes) / baseline:.1%} of the State-only block."
+        )
+    metrics.observe('dso_candidate_pairs', len(union), 'Candidate pairs per run after the union of keys.', metrics.COUNT_BUCKETS)
+    logging.info(
+        f" Blocking produced {len(union)} candidate pairs vs {baseline} with State-only blocking "
+        f"({1 - len(union) / baseline:.1%} fewer)."
+    )
+
+    return union // n_right, union % n_right
@@ -0,0 +1,184 @@
+import time
+import logging
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
+from config import BULK_INSERT_CHUNK_ROWS, BULK_INSERT_CONCURRENCY, BULK_MERGE_CONCURRENCY
+
+# SQLite's default limit on bound parameters per statement before 3.32; pass it as max_params
+# for SQLite stand-ins
+SQLITE_MAX_PARAMS = 999
+
+
+class SQLBackend:
+    """
+    Target for bulk writes: `connection()` returns a context manager yielding a DB-API
+    connection (e.g. ConnectionPool.connection), plus a table name.
+    paramstyle is 'named' (:name, used for Databricks) or 'qmark' (?, use this for SQLite and DuckDB
+    stand-ins; SQLite's named-parameter lookup gets slow on statements with thousands of parameters).
+    dialect picks the upsert syntax for bulk_merge: 'databricks' (MERGE INTO) or 'sqlite'
+    (INSERT ... ON CONFLICT, which needs a unique index on the key columns).
+    max_params caps the bound parameters (rows x columns) per statement, shrinking chunks to stay
+    under it; None (the default, for Databricks) leaves chunks at chunk_rows. SQLite stand-ins
+    should pass SQLITE_MAX_PARAMS.
+    """
+
+    def __init__(self, connection, table, paramstyle='named', dialect='databricks', max_params=None):
+        self.connection = connection
+        self.table = table
+        self.paramstyle = paramstyle
+        self.dialect = dialect
+        self.max_params = max_params
+
+    def execute(self, query, params):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(query, params)
+            finally:
+                cursor.close()
+            if hasattr(conn, 'commit'):
+                conn.commit()
+
+
+def _column_values(df, col):
+    """Column as a list of plain Python values with missing values as None."""
+    if col not in df.columns:
+        return [None] * len(df)
+    series = df[col]
+    return series.astype(object).where(series.notna(), None).tolist()
+
+
+def _value_size(value):
+    if value is None:
+        return 4
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    return 8
+
+
+def _values_rows(backend, columns, n_rows):
+    """The VALUES row list for n_rows rows of placeholders, and the parameter names for 'named'."""
+    if backend.paramstyle == 'qmark':
+        row = '(' + ', '.join('?' for _ in columns) + ')'
+        return ',\n'.join(row for _ in range(n_rows)), None
+    # Parameter names are laid out column by column to match how values are flattened
+    names = [f"c{j}_r{i}" for j in range(len(columns)) for i in range(n_rows)]
+    rows = ',\n'.join(
+        '(' + ', '.join(f":c{j}_r{i}" for j in range(len(columns))) + ')' for i in range(n_rows)
+    )
+    return rows, names
+
+
+def _insert_statement(backend, columns, n_rows):
+    column_string = ', '.join(f'`{col}`' for col in columns)
+    rows, names = _values_rows(backend, columns, n_rows)
+    return f"INSERT INTO {backend.table} ({column_string})\nVALUES {rows}", names
+
+
+def _merge_statement(backend, columns, keys, n_rows):
+    column_string = ', '.join(f'`{col}`' for col in columns)
+    rows, names = _values_rows(backend, columns, n_rows)
+    updates = [col for col in columns if col not in keys]
+    if backend.dialect == 'sqlite':
+        key_string = ', '.join(f'`{col}`' for col in keys)
+        assignments = ', '.join(f'`{col}` = excluded.`{col}`' for col in updates)
+        return (
+            f"INSERT INTO {backend.table} ({column_string})\nVALUES {rows}\n"
+            f"ON CONFLICT ({key_string}) DO UPDATE SET {assignments}"
+        ), names
+    on = ' AND '.join(f't.`{col}` = s.`{col}`' for col in keys)
+    assignments = ', '.join(f't.`{col}` = s.`{col}`' for col in updates)
+    source_values = ', '.join(f's.`{col}`' for col in columns)
+    return (
+        f"MERGE INTO {backend.table} AS t\n"
+        f"USING (SELECT * FROM VALUES {rows} AS v({column_string})) AS s\n"
+        f"ON {on}\n"
+        f"WHEN MATCHED THEN UPDATE SET {assignments}\n"
+        f"WHEN NOT MATCHED THEN INSERT ({column_string}) VALUES ({source_values})"
+    ), names
+
+
+def _chunk_rows(backend, columns, chunk_rows):
+    """chunk_rows (BULK_INSERT_CHUNK_ROWS by default), shrunk so a chunk binds at most backend.max_params values."""
+    chunk_rows = chunk_rows or BULK_INSERT_CHUNK_ROWS
+    if backend.max_params is None:
+        return chunk_rows
+    return max(1, min(chunk_rows, backend.max_params // max(len(columns), 1)))
+
+
+def _write_chunks(df, columns, backend, build_statement, chunk_rows, concurrency, verb):
+    n = len(df)
+    if n == 0:
+        return {'rows': 0, 'chunks': 0, 'seconds': 0.0, 'rows_per_sec': 0.0, 'bytes_sent': 0}
+
+    started = time.perf_counter()
+    values = [_column_values(df, col) for col in columns]
+    statements = {}
+
+    def write_chunk(start):
+        stop = min(start + chunk_rows, n)
+        size = stop - start
+        if size not in statements:
+            statements[size] = build_statement(size)
+        query, names = statements[size]
+
+        if backend.paramstyle == 'qmark':
+            params = [v for i in range(start, stop) for v in (col[i] for col in values)]
+        else:
+            params = dict(zip(names, chain.from_iterable(col[start:stop] for col in values)))
+
+        backend.execute(query, params)
+        flat = params if backend.paramstyle == 'qmark' else params.values()
+        return len(query) + sum(map(_value_size, flat))
+
+    starts = range(0, n, chunk_rows)
+    if concurrency > 1 and len(starts) > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            bytes_sent = sum(pool.map(write_chunk, starts))
+    else:
+        bytes_sent = sum(map(write_chunk, starts))
+
+    seconds = time.perf_counter() - started
+    summary = {
+        'rows': n,
+        'chunks': len(starts),
+        'seconds': round(seconds, 3),
+        'rows_per_sec': round(n / seconds, 1) if seconds else float(n),
+        'bytes_sent': bytes_sent,
+    }
+    logging.info(
+        f" Bulk {verb} into {backend.table}: {n} rows in {summary['chunks']} chunks, "
+        f"{summary['rows_per_sec']} rows/s, {bytes_sent} bytes sent."
+    )
+    return summary
+
+
+def bulk_insert(df, columns, backend, chunk_rows=None, concurrency=None):
+    """
+    Inserts df[columns] into backend.table in chunks of chunk_rows rows (capped so no statement
+    binds more than backend.max_params values), one parameterized multi-row INSERT per chunk,
+    running up to `concurrency` chunks at a time.
+    Columns missing from df are written as NULL.
+    Returns a summary with rows, chunks, seconds, rows_per_sec and bytes_sent.
+    """
+    chunk_rows = _chunk_rows(backend, columns, chunk_rows)
+    concurrency = concurrency or BULK_INSERT_CONCURRENCY
+    return _write_chunks(
+        df, columns, backend, lambda n_rows: _insert_statement(backend, columns, n_rows),
+        chunk_rows, concurrency, 'insert'
+    )
+
+
+def bulk_merge(df, columns, keys, backend, chunk_rows=None, concurrency=None):
+    """
+    Upserts df[columns] into backend.table matching on the `keys` columns: existing rows are
+    updated, new ones inserted. Same chunking and summary as bulk_insert.
+    Keys must be unique within df. Chunks run one at a time by default (BULK_MERGE_CONCURRENCY)
+    because concurrent MERGEs into one Delta table can conflict.
+    """
+    chunk_rows = _chunk_rows(backend, columns, chunk_rows)
+    concurrency = concurrency or BULK_MERGE_CONCURRENCY
+    return _write_chunks(
+        df, columns, backend, lambda n_rows: _merge_statement(backend, columns, keys, n_rows),
+        chunk_rows, concurrency, 'merge'
+    )
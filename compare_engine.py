@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+from jellyfish import jaro_winkler_similarity
+
+# (roster/customer column, output feature label) scored for every candidate pair
+COMPARE_FIELDS = [
+    ('Name', 'MatchedName'),
+    ('Emails', 'MatchedEmails'),
+    ('Address', 'MatchedAddress'),
+    ('Doctors', 'MatchedDoctors'),
+]
+JW_THRESHOLD = 0.85
+
+
+def _jw_upper_bound(len_left, len_right):
+    """
+    Highest Jaro-Winkler similarity two strings of these lengths could reach:
+    every character of the shorter string matches with no transpositions, plus the
+    maximum 4-character prefix bonus.
+    """
+    shortest = np.minimum(len_left, len_right).astype(float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        jaro = (shortest / len_left + shortest / len_right + 1.0) / 3.0
+    jaro = np.where((len_left == 0) | (len_right == 0), 0.0, jaro)
+    return jaro + 0.4 * (1.0 - jaro)
+
+
+def _values_at(column, rows):
+    """
+    column's values at these positions as an object array. Only those rows are converted, which matters
+    for the Arrow-backed customer columns customer_features maps from disk.
+    """
+    return column.take(rows).to_numpy(dtype=object)
+
+
+def _score_field(left_column, right_column, left_pos, right_pos, threshold):
+    """Returns a 0/1 int8 array: Jaro-Winkler >= threshold for each (left_pos, right_pos) pair."""
+    # Factorize the rows that appear in a pair, both sides together so equal strings share a code
+    left_rows, left_inv = np.unique(left_pos, return_inverse=True)
+    right_rows, right_inv = np.unique(right_pos, return_inverse=True)
+    codes, uniques = pd.factorize(
+        np.concatenate([_values_at(left_column, left_rows), _values_at(right_column, right_rows)]), use_na_sentinel=True
+    )
+    left_codes = codes[:len(left_rows)][left_inv]
+    right_codes = codes[len(left_rows):][right_inv]
+    lengths = np.fromiter((len(u) for u in uniques), dtype=np.int64, count=len(uniques))
+
+    result = np.zeros(len(left_pos), dtype=np.int8)
+
+    # Missing values score 0, same as recordlinkage's missing_value default
+    valid = (left_codes >= 0) & (right_codes >= 0)
+    left_len = np.where(valid, lengths[np.maximum(left_codes, 0)], 0)
+    right_len = np.where(valid, lengths[np.maximum(right_codes, 0)], 0)
+
+    # Identical non-empty strings always score 1.0
+    identical = valid & (left_codes == right_codes) & (left_len > 0)
+    result[identical] = 1
+
+    # Only pairs whose length bound can still clear the threshold need the real comparison
+    todo = valid & ~identical & (_jw_upper_bound(left_len, right_len) >= threshold - 1e-9)
+    if not todo.any():
+        return result
+
+    # Score each distinct string pair once
+    n_uniques = len(uniques)
+    keys = left_codes[todo].astype(np.int64) * n_uniques + right_codes[todo]
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    scores = np.fromiter(
+        (jaro_winkler_similarity(uniques[k // n_uniques], uniques[k % n_uniques]) for k in unique_keys),
+        dtype=float, count=len(unique_keys)
+    )
+    result[todo] = (scores >= threshold)[inverse]
+    return result
+
+
+def score_pairs(left_pos, right_pos, df1, df2, min_score=None, threshold=JW_THRESHOLD, fields=COMPARE_FIELDS):
+    """
+    Scores the pairs (df1 row left_pos[i], df2 row right_pos[i]) on every comparison field.
+    Returns (kept pair indices, int8 feature matrix with one column per field, int8 feature sum).
+    When min_score is given, pairs are dropped as soon as they can no longer reach it,
+    so only pairs with a feature sum >= min_score are returned.
+    """
+    n_fields = len(fields)
+    features = np.zeros((len(left_pos), n_fields), dtype=np.int8)
+    total = np.zeros(len(left_pos), dtype=np.int8)
+    alive = np.arange(len(left_pos))
+
+    for i, (col, _) in enumerate(fields):
+        if min_score is not None:
+            # Skip pairs that could not reach min_score even if every remaining field matched
+            alive = alive[total[alive] + (n_fields - i) >= min_score]
+        if len(alive) == 0:
+            break
+        scored = _score_field(df1[col], df2[col], left_pos[alive], right_pos[alive], threshold)
+        features[alive, i] = scored
+        total[alive] += scored
+
+    keep = np.arange(len(left_pos)) if min_score is None else np.flatnonzero(total >= min_score)
+    return keep, features[keep], total[keep]
+
+
+def compare_candidates(candidate_links, df1, df2, min_score=None, threshold=JW_THRESHOLD, fields=COMPARE_FIELDS):
+    """
+    Scores candidate pairs for all comparison fields in one batch and returns the same
+    0/1 feature frame recordlinkage.Compare produces for compare.string(..., method='jarowinkler').
+    When min_score is given, only pairs with a feature sum >= min_score are returned.
+    """
+    left_pos = df1.index.get_indexer(candidate_links.get_level_values(0))
+    right_pos = df2.index.get_indexer(candidate_links.get_level_values(1))
+    keep, features, _ = score_pairs(left_pos, right_pos, df1, df2, min_score, threshold, fields)
+    return pd.DataFrame(
+        features.astype(float),
+        index=candidate_links[keep],
+        columns=[label for _, label in fields]
+    )
@@ -1,4 +1,8 @@
 # config.py
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
 
 # Lowercase keys for safe .lower() matching
 STATE_LOOKUP = {
@@ -17,3 +21,157 @@ STATE_LOOKUP = {
     'virginia': 'VA', 'washington': 'WA', 'west virginia': 'WV',
     'wisconsin': 'WI', 'wyoming': 'WY'
 }
+
+# --- Customer snapshot ---
+# Local copy of get_customer_data() so matching runs don't query the warehouse every time
+CUSTOMER_SNAPSHOT_DIR = os.getenv("CUSTOMER_SNAPSHOT_DIR", os.path.join("cache", "customer_snapshot"))
+# How long the snapshot is served as-is before a delta refresh is attempted
+CUSTOMER_SNAPSHOT_TTL_SECONDS = int(os.getenv("CUSTOMER_SNAPSHOT_TTL_SECONDS", "900"))
+# Delta refreshes cannot see deleted practices or doctor-only edits, so rebuild fully this often
+CUSTOMER_SNAPSHOT_FULL_REFRESH_SECONDS = int(os.getenv("CUSTOMER_SNAPSHOT_FULL_REFRESH_SECONDS", "86400"))
+# customer_practices column used as the delta watermark (e.g. LastModifiedDate). Left empty the
+# snapshot is only ever fully refreshed, once CUSTOMER_SNAPSHOT_TTL_SECONDS has passed
+CUSTOMER_WATERMARK_COLUMN = os.getenv("CUSTOMER_WATERMARK_COLUMN", "")
+# Cleaned customer fields, blocking keys and block index, rebuilt only when the snapshot changes
+CUSTOMER_FEATURES_DIR = os.getenv("CUSTOMER_FEATURES_DIR", os.path.join("cache", "customer_features"))
+# Memory-map the stored features read-only, so every worker process on the host shares one copy
+# in the page cache; set to false to read them into each process's own memory instead
+CUSTOMER_FEATURES_MMAP = os.getenv("CUSTOMER_FEATURES_MMAP", "true").lower() in ["true", "1", "yes"]
+
+# --- Blocking ---
+# Candidate pairs are the union of these keys: state, zip3, name_phonetic, email_domain, address_sn
+BLOCKING_KEYS = [k.strip() for k in os.getenv("BLOCKING_KEYS", "zip3,name_phonetic,email_domain,address_sn").split(",") if k.strip()]
+# Sorted-neighbourhood window over Address (must be odd)
+BLOCKING_SN_WINDOW = int(os.getenv("BLOCKING_SN_WINDOW", "5"))
+# Shared mailbox providers say nothing about which practice an address belongs to
+COMMON_EMAIL_DOMAINS = {
+    'gmail.com', 'yahoo.com', 'hotmail.com', 'outlook.com', 'aol.com', 'icloud.com', 'me.com',
+    'msn.com', 'live.com', 'comcast.net', 'att.net', 'sbcglobal.net', 'verizon.net', 'bellsouth.net'
+}
+
+# --- Parallel matching ---
+# Worker processes used by match_records_by_fields; 1 keeps matching in the request process
+MATCH_WORKERS = int(os.getenv("MATCH_WORKERS", "1"))
+# Roster rows per worker task
+MATCH_CHUNK_SIZE = int(os.getenv("MATCH_CHUNK_SIZE", "500"))
+# Roster column used to keep blocks together when splitting work
+MATCH_PARTITION_KEY = os.getenv("MATCH_PARTITION_KEY", "State")
+
+# --- Low-memory matching ---
+# Match the roster in bounded chunks and keep low-cardinality columns as categoricals
+MATCH_LOW_MEMORY = os.getenv("MATCH_LOW_MEMORY", "false").lower() in ["true", "1", "yes"]
+# Roster rows whose candidate pairs are generated together in low-memory mode
+MATCH_LOW_MEMORY_CHUNK_ROWS = int(os.getenv("MATCH_LOW_MEMORY_CHUNK_ROWS", "2000"))
+
+# --- Best-match reduction ---
+# Most candidate pairs scored at once; only the running top MATCH_TOP_N per roster row is kept between batches
+MATCH_PAIR_BATCH = int(os.getenv("MATCH_PAIR_BATCH", "500000"))
+# Candidates kept per roster row; above 1 the runner-ups are written to RUNNER_UP_COLUMNS for reviewers
+MATCH_TOP_N = int(os.getenv("MATCH_TOP_N", "1"))
+RUNNER_UP_COLUMNS = ['RunnerUpEntityIDs', 'RunnerUpPracticeNames', 'RunnerUpScores']
+# matched_data has no runner-up columns until they are added with
+#   ALTER TABLE sa.dso_recon.matched_data ADD COLUMNS (RunnerUpEntityIDs STRING, RunnerUpPracticeNames STRING, RunnerUpScores STRING)
+# Until then runner-ups are only kept in each run's results file (the results page); set to true once the table has them
+MATCHED_DATA_RUNNER_UPS = os.getenv("MATCHED_DATA_RUNNER_UPS", "false").lower() in ["true", "1", "yes"]
+
+# --- Exact-key fast path ---
+# Keys tried before fuzzy matching, in order: confirmed, address_zip, email ('' turns the fast path off).
+# Keys shared by several SourceIDs in a roster are ignored, and email hits also need the same 5-digit ZIP
+EXACT_MATCH_KEYS = [k.strip() for k in os.getenv("EXACT_MATCH_KEYS", "confirmed,address_zip,email").split(",") if k.strip()]
+# TotalScore given to exact matches; above the best possible fuzzy score (4) so they stand out
+EXACT_MATCH_SCORE = float(os.getenv("EXACT_MATCH_SCORE", "5"))
+# Table of reviewer-confirmed matches (Source, SourceID, MatchedEntityID) used by the 'confirmed' key; '' skips it
+CONFIRMED_MATCHES_TABLE = os.getenv("CONFIRMED_MATCHES_TABLE", "")
+# matched_data has no MatchType column until it is added with
+#   ALTER TABLE sa.dso_recon.matched_data ADD COLUMNS (MatchType STRING)
+# Until then MatchType is only kept in each run's results file (the results page); set to true once the table has it
+MATCHED_DATA_MATCH_TYPE = os.getenv("MATCHED_DATA_MATCH_TYPE", "false").lower() in ["true", "1", "yes"]
+
+# --- Background matching jobs ---
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join("cache", "jobs.sqlite3"))
+# Matching jobs allowed to run at the same time in one app process
+MATCH_JOB_WORKERS = int(os.getenv("MATCH_JOB_WORKERS", "2"))
+
+# --- Batch matching ---
+# Abort the whole batch on the first DSO that fails instead of reporting it and carrying on
+BATCH_STOP_ON_ERROR = os.getenv("BATCH_STOP_ON_ERROR", "false").lower() in ["true", "1", "yes"]
+# Most roster files accepted by one /batch-upload request
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "50"))
+
+# --- Match API ---
+# Candidates returned per practice by /api/match
+MATCH_API_TOP_N = int(os.getenv("MATCH_API_TOP_N", "5"))
+# Lowest TotalScore (fields matched out of 4) a fuzzy candidate needs, as in batch matching
+MATCH_API_MIN_SCORE = int(os.getenv("MATCH_API_MIN_SCORE", "2"))
+# Most practices accepted by one /api/match/batch call
+MATCH_API_MAX_BATCH = int(os.getenv("MATCH_API_MAX_BATCH", "500"))
+# The resident customer features are re-checked in the background once they are this old
+MATCH_API_REFRESH_SECONDS = int(os.getenv("MATCH_API_REFRESH_SECONDS", "300"))
+# Load the customer features when the app starts instead of on the first API call. Off by default: warming
+# imports pandas and maps or builds the features (and may query the warehouse) in every worker process
+MATCH_API_WARM_ON_START = os.getenv("MATCH_API_WARM_ON_START", "false").lower() in ["true", "1", "yes"]
+
+# --- Bulk writes to matched_data ---
+# Rows per parameterized INSERT/MERGE; keeps each statement well under the warehouse's size limits
+BULK_INSERT_CHUNK_ROWS = int(os.getenv("BULK_INSERT_CHUNK_ROWS", "250"))
+# Chunks written at the same time, each on its own connection
+BULK_INSERT_CONCURRENCY = int(os.getenv("BULK_INSERT_CONCURRENCY", "4"))
+# Concurrent MERGEs into one Delta table can conflict, so merge chunks run one at a time by default
+BULK_MERGE_CONCURRENCY = int(os.getenv("BULK_MERGE_CONCURRENCY", "1"))
+
+# --- Databricks connection pool ---
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+# Idle connections older than this are closed instead of reused
+DB_POOL_MAX_IDLE_SECONDS = int(os.getenv("DB_POOL_MAX_IDLE_SECONDS", "300"))
+# Connections idle longer than this get a SELECT 1 before being handed out
+DB_POOL_HEALTH_CHECK_AFTER_SECONDS = int(os.getenv("DB_POOL_HEALTH_CHECK_AFTER_SECONDS", "30"))
+DB_POOL_WAIT_TIMEOUT_SECONDS = int(os.getenv("DB_POOL_WAIT_TIMEOUT_SECONDS", "60"))
+
+# --- DSO config cache ---
+# Upper bound on staleness if dso_config is edited outside this app
+DSO_CONFIG_CACHE_TTL_SECONDS = int(os.getenv("DSO_CONFIG_CACHE_TTL_SECONDS", "600"))
+# Touched on every config write so all app processes drop their cached copy
+DSO_CONFIG_VERSION_FILE = os.getenv("DSO_CONFIG_VERSION_FILE", os.path.join("cache", "dso_config.version"))
+
+# --- Approved SourceID index ---
+# 'pushdown' looks up only the uploaded SourceIDs in approved_dso on each run;
+# 'resident' keeps every approved SourceID in memory and fetches only rows newer than the watermark
+APPROVED_INDEX_MODE = os.getenv("APPROVED_INDEX_MODE", "pushdown").lower()
+# Column on approved_dso that increases on every insert/update; required for 'resident' mode
+APPROVED_WATERMARK_COLUMN = os.getenv("APPROVED_WATERMARK_COLUMN", "")
+# Periodic full reload so approvals revoked since the last one drop out of the resident index
+APPROVED_FULL_RELOAD_SECONDS = int(os.getenv("APPROVED_FULL_RELOAD_SECONDS", "86400"))
+# SourceIDs per IN (...) list in pushdown queries
+APPROVED_PUSHDOWN_BATCH = int(os.getenv("APPROVED_PUSHDOWN_BATCH", "1000"))
+# The index gets a Bloom filter in front of the exact check once it holds this many SourceIDs
+APPROVED_BLOOM_MIN_SIZE = int(os.getenv("APPROVED_BLOOM_MIN_SIZE", "100000"))
+APPROVED_BLOOM_BITS_PER_ID = int(os.getenv("APPROVED_BLOOM_BITS_PER_ID", "10"))
+
+# --- Upload ingestion ---
+# Rows parsed per chunk while streaming an uploaded workbook; bounds memory during ingestion
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "5000"))
+INGEST_PREVIEW_ROWS = int(os.getenv("INGEST_PREVIEW_ROWS", "30"))
+# Workbooks parsed in the background at the same time
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+# How long a matching job waits for its upload to finish parsing
+PREPARED_WAIT_TIMEOUT_SECONDS = int(os.getenv("PREPARED_WAIT_TIMEOUT_SECONDS", "600"))
+# Prepared uploads, keyed by file contents + DSO config; put it on shared storage when running several app hosts
+PREPARED_STORE_DIR = os.getenv("PREPARED_STORE_DIR", os.path.join("cache", "prepared"))
+# Least recently used datasets are evicted once the store is bigger than this
+PREPARED_STORE_MAX_BYTES = int(os.getenv("PREPARED_STORE_MAX_BYTES", str(2 * 2 ** 30)))
+
+# --- Data views ---
+# Rows per page served by /api/data when the page doesn't ask for a size, and the most it may ask for
+DATA_PAGE_SIZE = int(os.getenv("DATA_PAGE_SIZE", "100"))
+DATA_PAGE_MAX = int(os.getenv("DATA_PAGE_MAX", "1000"))
+# Each run's matched rows are kept in the prepared-dataset store for the results page
+SAVE_MATCHED_RESULTS = os.getenv("SAVE_MATCHED_RESULTS", "true").lower() in ["true", "1", "yes"]
+
+# --- Incremental re-matching ---
+# Re-uploads only match new/changed rows and MERGE them; removed SourceIDs are deleted
+ROSTER_DIFF_MODE = os.getenv("ROSTER_DIFF_MODE", "true").lower() in ["true", "1", "yes"]
+# Unchanged rows are matched again only when one of their candidate customers changed; set this to
+# re-match the whole roster whenever the customer snapshot changes at all (i.e. after every refresh)
+ROSTER_DIFF_SNAPSHOT_SENSITIVE = os.getenv("ROSTER_DIFF_SNAPSHOT_SENSITIVE", "false").lower() in ["true", "1", "yes"]
+# Row hashes of each DSO's last successful upload
+ROSTER_STATE_DIR = os.getenv("ROSTER_STATE_DIR", os.path.join("cache", "roster_state"))
@@ -0,0 +1,187 @@
+import os
+import json
+import fcntl
+import shutil
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+import pandas as pd
+import pyarrow as pa
+from config import CUSTOMER_FEATURES_DIR, CUSTOMER_FEATURES_MMAP, BLOCKING_KEYS, COMMON_EMAIL_DOMAINS
+from customer_snapshot import get_customer_snapshot_with_meta, ensure_customer_snapshot
+from match_logic import prepare_customers, customer_hashes, CUSTOMER_HASH_COLUMN
+from blocking import build_block_index, save_block_index, load_block_index
+from exact_match import build_exact_index, save_exact_index, load_exact_index
+from metrics import timed
+
+# Bump when prepare_customers(), add_blocking_keys(), add_exact_keys(), the indexes or the stored layout change
+FEATURE_VERSION = 4
+
+CUSTOMERS_FILE = 'customers.arrow'
+INDEX_DIR = 'block_index'
+EXACT_INDEX_DIR = 'exact_index'
+META_FILE = 'meta.json'
+BUILD_LOCK_FILE = 'build.lock'
+
+_lock = threading.Lock()
+_cache = {'signature': None, 'features': None}
+
+
+def _signature(snapshot_meta):
+    """What the stored features were built from; any change means they have to be rebuilt."""
+    snapshot = snapshot_meta.get('content_hash') or f"{snapshot_meta.get('refreshed_at')}:{snapshot_meta.get('rows')}"
+    return {
+        'snapshot': snapshot,
+        'blocking_keys': list(BLOCKING_KEYS),
+        'common_email_domains': sorted(COMMON_EMAIL_DOMAINS),
+        'version': FEATURE_VERSION,
+    }
+
+
+def _signature_key(signature):
+    return hashlib.sha1(json.dumps(signature, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def _features_dir(signature):
+    return os.path.join(CUSTOMER_FEATURES_DIR, _signature_key(signature))
+
+
+def build_customer_features(customers):
+    """
+    Cleans the customer master, adds its blocking and exact keys and builds the block and exact indexes.
+    Each row's content hash is kept in CUSTOMER_HASH_COLUMN for diff mode's roster_fingerprints().
+    """
+    prepared = prepare_customers(customers)
+    prepared[CUSTOMER_HASH_COLUMN] = customer_hashes(prepared)
+    return {'customers': prepared, 'block_index': build_block_index(prepared), 'exact_index': build_exact_index(prepared)}
+
+
+def _save(features, signature):
+    path = _features_dir(signature)
+    if os.path.exists(path):
+        return
+    # Build in a temp dir and rename it into place so readers never see half the files
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    os.makedirs(tmp_path, exist_ok=True)
+    try:
+        # Uncompressed Arrow IPC, so _load() can map the columns straight from the file
+        table = pa.Table.from_pandas(features['customers'], preserve_index=False)
+        with pa.OSFile(os.path.join(tmp_path, CUSTOMERS_FILE), 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        save_block_index(features['block_index'], os.path.join(tmp_path, INDEX_DIR))
+        save_exact_index(features['exact_index'], os.path.join(tmp_path, EXACT_INDEX_DIR))
+        with open(os.path.join(tmp_path, META_FILE), 'w') as f:
+            json.dump(signature, f, indent=2)
+        os.replace(tmp_path, path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not os.path.exists(path):
+            raise
+
+    # Older builds are never loaded again. Processes still using one keep their mapping of the removed files
+    # until they pick up this build, so removing them under a running worker is safe
+    for name in os.listdir(CUSTOMER_FEATURES_DIR):
+        if name not in (os.path.basename(path), BUILD_LOCK_FILE) and '.tmp-' not in name:
+            shutil.rmtree(os.path.join(CUSTOMER_FEATURES_DIR, name), ignore_errors=True)
+
+
+def _string_dtype(arrow_type):
+    # Strings stay Arrow-backed, pointing into the mapped file, rather than becoming one Python object per value
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return pd.ArrowDtype(arrow_type)
+    return None
+
+
+def _read_customers(path):
+    # Columns read from a memory map reference it and keep it open for as long as they are in use
+    source = pa.memory_map(path, 'r') if CUSTOMER_FEATURES_MMAP else pa.OSFile(path, 'rb')
+    return pa.ipc.open_file(source).read_all().to_pandas(types_mapper=_string_dtype)
+
+
+def _load(signature):
+    path = _features_dir(signature)
+    if not os.path.exists(os.path.join(path, META_FILE)):
+        return None
+    try:
+        with open(os.path.join(path, META_FILE)) as f:
+            if json.load(f) != signature:
+                return None
+        mmap_mode = 'r' if CUSTOMER_FEATURES_MMAP else None
+        return {
+            'customers': _read_customers(os.path.join(path, CUSTOMERS_FILE)),
+            'block_index': load_block_index(os.path.join(path, INDEX_DIR), mmap_mode),
+            'exact_index': load_exact_index(os.path.join(path, EXACT_INDEX_DIR), mmap_mode),
+        }
+    except Exception as e:
+        logging.warning(f" Unreadable customer features in {path}, rebuilding: {e}")
+        return None
+
+
+@contextmanager
+def _build_lock():
+    """Held while building, so one worker process builds a new version and the others wait to load it."""
+    os.makedirs(CUSTOMER_FEATURES_DIR, exist_ok=True)
+    with open(os.path.join(CUSTOMER_FEATURES_DIR, BUILD_LOCK_FILE), 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _build(signature):
+    """
+    Builds and stores the features, returning (features, signature). The signature is that of the snapshot
+    actually read, which is newer than the one asked for if another process refreshed it in between.
+    """
+    with _build_lock():
+        # Another process may have built this version while we waited for the lock
+        features = _load(signature)
+        if features is not None:
+            return features, signature
+        customers, snapshot_meta = get_customer_snapshot_with_meta()
+        signature = _signature(snapshot_meta)
+        features = _load(signature)
+        if features is not None:
+            return features, signature
+        with timed('build_customer_features', rows=len(customers)):
+            features = build_customer_features(customers)
+        try:
+            _save(features, signature)
+        except Exception as e:
+            logging.warning(f" Couldn't store customer features, they will be rebuilt next run: {e}")
+            return features, signature
+        logging.info(f" Built customer features for {len(customers)} customers.")
+    # Use the stored copy like every other worker does, rather than keeping the private one just built
+    return _load(signature) or features, signature
+
+
+def get_customer_features():
+    """
+    Returns {'customers': prepared customer frame, 'block_index': build_block_index() result,
+    'exact_index': build_exact_index() result, 'signature': key of the snapshot and settings they were built from}
+    for the current customer snapshot. They are built once per snapshot, blocking keys and
+    FEATURE_VERSION into CUSTOMER_FEATURES_DIR, published with one directory rename and, with
+    CUSTOMER_FEATURES_MMAP, memory-mapped read-only so all worker processes share a single copy.
+    The customers' string columns are Arrow-backed (pd.ArrowDtype).
+    When the snapshot changes the new version is swapped in for later calls; callers keep the one they got.
+    Callers must treat the result as read-only; it is shared between jobs.
+    """
+    signature = _signature(ensure_customer_snapshot())
+
+    with _lock:
+        if _cache['signature'] == signature:
+            return _cache['features']
+
+        with timed('load_customer_features') as t:
+            features = _load(signature)
+        if features is None:
+            features, signature = _build(signature)
+        else:
+            t['rows'] = len(features['customers'])
+        features['signature'] = _signature_key(signature)
+
+        _cache.update(signature=signature, features=features)
+        return features
@@ -0,0 +1,181 @@
+import os
+import json
+import uuid
+import fcntl
+import hashlib
+import time
+import logging
+import threading
+from contextlib import contextmanager
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from config import (
+    CUSTOMER_SNAPSHOT_DIR, CUSTOMER_SNAPSHOT_TTL_SECONDS, CUSTOMER_SNAPSHOT_FULL_REFRESH_SECONDS, CUSTOMER_WATERMARK_COLUMN
+)
+from databricks_conn import get_customer_data
+
+SNAPSHOT_FILE = 'customers.parquet'
+# Metadata key in the parquet file's schema holding the snapshot meta, so rows and meta are published together
+META_KEY = b'customer_snapshot'
+# Snapshots before the meta moved into the parquet file kept it here
+LEGACY_META_FILE = 'meta.json'
+REFRESH_LOCK_FILE = 'refresh.lock'
+
+_lock = threading.Lock()
+_cache = {'mtime': None, 'df': None, 'meta': None}
+
+
+def _snapshot_path():
+    return os.path.join(CUSTOMER_SNAPSHOT_DIR, SNAPSHOT_FILE)
+
+
+def _meta_from_schema(schema):
+    raw = (schema.metadata or {}).get(META_KEY)
+    return json.loads(raw) if raw else {}
+
+
+def load_snapshot_meta():
+    """Returns the snapshot metadata (watermark, refresh times, row count) or {} if no snapshot exists."""
+    try:
+        return _meta_from_schema(pq.read_schema(_snapshot_path()))
+    except FileNotFoundError:
+        return {}
+
+
+def _write_snapshot(df, meta):
+    """
+    Publishes the rows and their meta in one os.replace of a single parquet file, written under a name
+    unique to this process and thread, so readers never see half a snapshot or rows with another one's meta.
+    """
+    os.makedirs(CUSTOMER_SNAPSHOT_DIR, exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), META_KEY: json.dumps(meta).encode('utf-8')})
+    tmp_path = f"{_snapshot_path()}.tmp-{os.getpid()}-{uuid.uuid4().hex}"
+    try:
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, _snapshot_path())
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    legacy_meta = os.path.join(CUSTOMER_SNAPSHOT_DIR, LEGACY_META_FILE)
+    if os.path.exists(legacy_meta):
+        os.remove(legacy_meta)
+
+
+@contextmanager
+def _refresh_lock():
+    """Held across a refresh, so only one process (web worker or batch CLI) refreshes the snapshot at a time."""
+    os.makedirs(CUSTOMER_SNAPSHOT_DIR, exist_ok=True)
+    with open(os.path.join(CUSTOMER_SNAPSHOT_DIR, REFRESH_LOCK_FILE), 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _content_hash(df):
+    """Fingerprint of the snapshot's rows and their order, so derived caches know when to rebuild."""
+    hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    return hashlib.sha1(hashes.tobytes() + ','.join(df.columns).encode('utf-8')).hexdigest()
+
+
+def _watermark(df, previous=None):
+    if 'LastModified' not in df.columns or df['LastModified'].dropna().empty:
+        return previous
+    latest = str(pd.to_datetime(df['LastModified']).max())
+    if previous is not None and latest < previous:
+        return previous
+    return latest
+
+
+def _read_snapshot():
+    """(rows, meta) of the current snapshot, both read from the same file."""
+    # One open file for the mtime check and the read, so a snapshot swapped in meanwhile can't be mixed in
+    with open(_snapshot_path(), 'rb') as f:
+        mtime = os.fstat(f.fileno()).st_mtime_ns
+        if _cache['mtime'] != mtime:
+            table = pq.read_table(f)
+            _cache.update(df=table.to_pandas(), meta=_meta_from_schema(table.schema), mtime=mtime)
+    return _cache['df'], _cache['meta']
+
+
+def refresh_customer_snapshot(full=False, max_age=None):
+    """
+    Refreshes the local customer snapshot.
+    A full refresh re-pulls the whole customer master; otherwise only practices
+    modified after the stored watermark are fetched and merged by MatchedEntityID.
+    Without a CUSTOMER_WATERMARK_COLUMN every refresh is full, once the TTL has run out.
+    With max_age, a snapshot that another process refreshed less than max_age seconds ago,
+    while this one waited for the lock, is kept as it is.
+    """
+    with _lock, _refresh_lock():
+        meta = load_snapshot_meta()
+        now = time.time()
+        if max_age is not None and meta and now - meta.get('refreshed_at', 0) < max_age:
+            return meta
+        full = (
+            full
+            or not meta
+            or not CUSTOMER_WATERMARK_COLUMN
+            or not meta.get('watermark')
+            or now - meta.get('full_refreshed_at', 0) >= CUSTOMER_SNAPSHOT_FULL_REFRESH_SECONDS
+        )
+
+        if full:
+            df = get_customer_data()
+            meta = {'full_refreshed_at': now, 'delta_rows': None}
+            logging.info(f" Customer snapshot fully refreshed ({len(df)} rows).")
+        else:
+            delta = get_customer_data(modified_since=meta['watermark'])
+            existing, _ = _read_snapshot()
+            if delta.empty:
+                df = existing
+            else:
+                unchanged = existing[~existing['MatchedEntityID'].isin(delta['MatchedEntityID'])]
+                df = pd.concat([unchanged, delta], ignore_index=True)
+            meta['delta_rows'] = len(delta)
+            logging.info(f" Customer snapshot delta refresh fetched {len(delta)} changed practices.")
+
+        meta['watermark'] = _watermark(df, meta.get('watermark'))
+        meta['refreshed_at'] = now
+        meta['rows'] = len(df)
+        meta['content_hash'] = _content_hash(df)
+        _write_snapshot(df, meta)
+        return meta
+
+
+def ensure_customer_snapshot(max_age=None):
+    """
+    Refreshes the local snapshot when it is older than the TTL and returns its metadata, without reading
+    the snapshot itself. Falls back to the stale snapshot if the warehouse is unreachable.
+    """
+    max_age = CUSTOMER_SNAPSHOT_TTL_SECONDS if max_age is None else max_age
+    meta = load_snapshot_meta()
+
+    if not meta or time.time() - meta.get('refreshed_at', 0) >= max_age:
+        try:
+            refresh_customer_snapshot(max_age=max_age)
+        except Exception as e:
+            if not meta:
+                raise
+            logging.warning(f" Customer snapshot refresh failed, serving snapshot from {meta.get('refreshed_at')}: {e}")
+    return load_snapshot_meta()
+
+
+def get_customer_snapshot(max_age=None):
+    """
+    Returns the customer master from the local snapshot, refreshing it first when
+    it is older than the TTL (see ensure_customer_snapshot).
+    Callers must treat the returned DataFrame as read-only; it is shared between requests.
+    """
+    return get_customer_snapshot_with_meta(max_age)[0]
+
+
+def get_customer_snapshot_with_meta(max_age=None):
+    """Like get_customer_snapshot(), but returns (customers, meta) read together from one snapshot file."""
+    ensure_customer_snapshot(max_age)
+    with _lock:
+        return _read_snapshot()
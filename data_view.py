@@ -0,0 +1,140 @@
+import math
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from config import DATA_PAGE_SIZE, DATA_PAGE_MAX
+
+# Columns the results page shows by default, in order; the other roster columns can be asked for by name
+MATCHED_VIEW_COLUMNS = [
+    'SourceID', 'Name', 'Address', 'City', 'State', 'Zip', 'Emails', 'Doctors',
+    'MatchedEntityID', 'MatchedPracticeName', 'TotalScore', 'MatchType',
+    'MatchedName', 'MatchedEmails', 'MatchedAddress', 'MatchedDoctors', 'AlreadyApproved', 'FileName',
+]
+
+
+def _filter_expression(names, min_score=None, max_score=None, approved=None, entity=None):
+    """
+    (Arrow filter expression or None, columns it reads) for the supported filters.
+    Raises ValueError if one needs a column the dataset lacks.
+    """
+    conditions, filter_columns = [], []
+    if min_score is not None or max_score is not None:
+        if 'TotalScore' not in names:
+            raise ValueError("This dataset has no TotalScore to filter on.")
+        if min_score is not None:
+            conditions.append(ds.field('TotalScore') >= min_score)
+        if max_score is not None:
+            conditions.append(ds.field('TotalScore') <= max_score)
+        filter_columns.append('TotalScore')
+    if approved is not None:
+        if 'AlreadyApproved' not in names:
+            raise ValueError("This dataset has no AlreadyApproved to filter on.")
+        conditions.append(ds.field('AlreadyApproved') == approved)
+        filter_columns.append('AlreadyApproved')
+    if entity is not None:
+        if 'MatchedEntityID' not in names:
+            raise ValueError("This dataset has no MatchedEntityID to filter on.")
+        # 'none' = unmatched rows, 'any' = matched rows, anything else an exact entity ID
+        if entity == 'none':
+            conditions.append(ds.field('MatchedEntityID') == '')
+        elif entity == 'any':
+            conditions.append(ds.field('MatchedEntityID') != '')
+        else:
+            conditions.append(ds.field('MatchedEntityID') == entity)
+        filter_columns.append('MatchedEntityID')
+
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression, filter_columns
+
+
+def _matching_rows(parquet, expression, filter_columns, sort):
+    """
+    (row group, row within it) of every row that passes expression, plus their sort keys when sorting.
+    Only the filter and sort columns are read; without filters or a sort nothing is read at all.
+    """
+    groups, rows, keys = [], [], []
+    read_columns = list(dict.fromkeys(filter_columns + ([sort] if sort else [])))
+    for i in range(parquet.num_row_groups):
+        n = parquet.metadata.row_group(i).num_rows
+        if not read_columns:
+            selected = np.arange(n)
+        else:
+            part = parquet.read_row_group(i, columns=read_columns)
+            part = part.append_column('__row', pa.array(np.arange(n)))
+            if expression is not None:
+                part = part.filter(expression)
+            selected = part['__row'].to_numpy()
+            if sort:
+                keys.append(part[sort].combine_chunks())
+        groups.append(np.full(len(selected), i))
+        rows.append(selected)
+    groups = np.concatenate(groups) if groups else np.array([], dtype=int)
+    rows = np.concatenate(rows) if rows else np.array([], dtype=int)
+    return groups, rows, (pa.concat_arrays(keys) if sort and keys else None)
+
+
+def _take_rows(parquet, columns, groups, rows):
+    """The given rows, in the order given, reading the columns of only the row groups they are in."""
+    if len(rows) == 0:
+        return pa.schema([parquet.schema_arrow.field(c) for c in columns]).empty_table()
+    pieces, order = [], []
+    for i in np.unique(groups):
+        in_group = np.flatnonzero(groups == i)
+        pieces.append(parquet.read_row_group(int(i), columns=columns).take(pa.array(rows[in_group])))
+        order.append(in_group)
+    table = pa.concat_tables(pieces)
+    return table.take(pa.array(np.argsort(np.concatenate(order), kind='stable')))
+
+
+def _json_value(value):
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def read_page(path, page=1, page_size=None, sort=None, descending=False, columns=None, **filters):
+    """
+    One page of a stored Parquet dataset (prepared upload or matched output) for the data views.
+    Filters (see _filter_expression) and the sort only read their own columns; the displayed columns
+    are read just from the row groups that hold the page's rows.
+    Returns {'columns', 'rows' (lists), 'total' (rows after filtering), 'page', 'page_size', 'pages'}.
+    Raises ValueError for unknown columns or filters the dataset can't support.
+    """
+    page_size = min(max(int(page_size or DATA_PAGE_SIZE), 1), DATA_PAGE_MAX)
+    page = max(int(page), 1)
+    parquet = pq.ParquetFile(path)
+    names = parquet.schema_arrow.names
+
+    if columns:
+        unknown = [c for c in columns if c not in names]
+        if unknown:
+            raise ValueError(f"Unknown column(s): {unknown}")
+    else:
+        columns = [c for c in MATCHED_VIEW_COLUMNS if c in names] if 'TotalScore' in names else list(names)
+    if sort is not None and sort not in names:
+        raise ValueError(f"Unknown sort column '{sort}'")
+    expression, filter_columns = _filter_expression(names, **filters)
+
+    groups, rows, keys = _matching_rows(parquet, expression, filter_columns, sort)
+    total = len(rows)
+    start = (page - 1) * page_size
+    if sort is not None:
+        order = pc.array_sort_indices(keys, order='descending' if descending else 'ascending')
+        page_positions = order.slice(start, page_size).to_numpy()
+    else:
+        page_positions = np.arange(start, min(start + page_size, total))
+    table = _take_rows(parquet, columns, groups[page_positions], rows[page_positions])
+
+    values = [table.column(c).to_pylist() for c in columns]
+    return {
+        'columns': columns,
+        'rows': [[_json_value(v) for v in row] for row in zip(*values)],
+        'total': total,
+        'page': page,
+        'page_size': page_size,
+        'pages': max(math.ceil(total / page_size), 1),
+    }
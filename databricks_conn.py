@@ -1,30 +1,76 @@
 import os
+import time
+import logging
 import pandas as pd
 from datetime import datetime
-from dotenv import load_dotenv
-from databricks import sql
-
-# Load environment variables
-load_dotenv()
-DATABRICKS_TOKEN = os.getenv("DATABRICKS_TOKEN")
-DATABRICKS_HOST = os.getenv("DATABRICKS_HOST")
-DATABRICKS_HTTP_PATH = os.getenv("DATABRICKS_HTTP_PATH")
-
-# Validate environment variables
-if not all([DATABRICKS_TOKEN, DATABRICKS_HOST, DATABRICKS_HTTP_PATH]):
-    raise EnvironmentError("Missing one or more Databricks connection environment variables.")
+from config import (
+    CUSTOMER_WATERMARK_COLUMN, APPROVED_WATERMARK_COLUMN, APPROVED_PUSHDOWN_BATCH, DB_POOL_SIZE, DB_POOL_MAX_IDLE_SECONDS,
+    DB_POOL_HEALTH_CHECK_AFTER_SECONDS, DB_POOL_WAIT_TIMEOUT_SECONDS, MATCH_TOP_N, RUNNER_UP_COLUMNS,
+    MATCHED_DATA_RUNNER_UPS, EXACT_MATCH_KEYS, MATCHED_DATA_MATCH_TYPE, CONFIRMED_MATCHES_TABLE
+)
+from bulk_writer import SQLBackend, bulk_insert, bulk_merge
+from db_pool import ConnectionPool
+import metrics
 
 # --- Helper to open a new connection ---
 def get_connection():
+    # Credentials (loaded from .env by config) are checked and the connector imported only when a
+    # connection is first needed, so importing this module, e.g. at worker start-up, stays cheap
+    from databricks import sql
+
+    token = os.getenv("DATABRICKS_TOKEN")
+    host = os.getenv("DATABRICKS_HOST")
+    http_path = os.getenv("DATABRICKS_HTTP_PATH")
+    if not all([token, host, http_path]):
+        raise EnvironmentError("Missing one or more Databricks connection environment variables.")
     return sql.connect(
-        server_hostname=DATABRICKS_HOST,
-        http_path=DATABRICKS_HTTP_PATH,
-        access_token=DATABRICKS_TOKEN
+        server_hostname=host,
+        http_path=http_path,
+        access_token=token
     )
 
+# --- Shared connection pool, so each helper doesn't pay a fresh TLS/session handshake ---
+pool = ConnectionPool(
+    get_connection,
+    size=DB_POOL_SIZE,
+    max_idle_seconds=DB_POOL_MAX_IDLE_SECONDS,
+    health_check_after=DB_POOL_HEALTH_CHECK_AFTER_SECONDS,
+    wait_timeout=DB_POOL_WAIT_TIMEOUT_SECONDS
+)
+
+def _read_sql(query, name='query'):
+    # Reads are idempotent, so retry once on a fresh connection if the pooled one has died
+    started = time.perf_counter()
+    df = pool.run(lambda conn: pd.read_sql(query, conn))
+    _observe_query(name, started, len(df))
+    return df
+
+def _observe_query(name, started, rows=None):
+    metrics.observe('dso_warehouse_query_seconds', time.perf_counter() - started, 'Warehouse query latency.', query=name)
+    if rows is not None:
+        metrics.inc('dso_warehouse_rows_total', rows, 'Rows read from or written to the warehouse.', query=name)
+
+def get_pool_stats():
+    return pool.stats()
+
 # --- Reusable Data Functions ---
-def get_customer_data():
-    query = """
+def get_customer_data(modified_since=None):
+    """
+    Pulls the customer master used for matching.
+    LastModified is only selected when CUSTOMER_WATERMARK_COLUMN is configured; when modified_since
+    is given (which needs that column) only practices changed after that watermark are returned.
+    """
+    watermark_select = ""
+    if CUSTOMER_WATERMARK_COLUMN:
+        watermark_select = f",\n                   p.`{CUSTOMER_WATERMARK_COLUMN}` as LastModified"
+    where_clause = ""
+    if modified_since is not None:
+        if not CUSTOMER_WATERMARK_COLUMN:
+            raise ValueError("modified_since needs CUSTOMER_WATERMARK_COLUMN to be configured")
+        escaped = str(modified_since).replace("'", "''")
+        where_clause = f"WHERE p.`{CUSTOMER_WATERMARK_COLUMN}` > '{escaped}'"
+
+    query = f"""
             SELECT p.CompanyName as Name,
                    p.ShipAddr1 as Address,
                    p.ShipState as State,
@@ -32,91 +78,169 @@ def get_customer_data():
                    p.ShipCity as City,
                    concat_ws(', ', p.Email, p.PaymentNotificationEmail, p.AdditionalBillingEmail, p.CustInvoiceEmail) as Emails,
                    concat_ws(', ', collect_list(concat_ws(' ', d.FirstName, d.LastName))) as Doctors,
-                   p.PracticeId as MatchedEntityID
+                   p.PracticeId as MatchedEntityID{watermark_select}
             FROM `sa`.`netsuite`.`customer_practices` p
             LEFT JOIN `sa`.`netsuite`.`customer_doctors` d on p.PracticeId = d.ParentID
+            {where_clause}
             GROUP BY ALL
         """
-    with get_connection() as conn:
-        return pd.read_sql(query, conn)
+    return _read_sql(query, 'customer_data')
 
 def delete_matched_data_for_dso(dso_name: str):
     query = f"""
         DELETE FROM sa.dso_recon.matched_data
         WHERE Source = '{dso_name}'
     """
-    with get_connection() as conn:
+    started = time.perf_counter()
+    with pool.connection() as conn:
         with conn.cursor() as cursor:
             cursor.execute(query)
-            print(f"Deleted old matched data for DSO: {dso_name}")
+            logging.info(f" Deleted old matched data for DSO: {dso_name}")
+    _observe_query('delete_matched_data', started)
+
+MATCHED_DATA_TABLE = "`sa`.`dso_recon`.`matched_data`"
+MATCHED_DATA_COLUMNS = [
+    'Name', 'Address', 'State', 'City', 'Zip', 'Emails', 'Doctors', 'SourceID', 'Source',
+    'MatchedName', 'MatchedEmails', 'MatchedAddress', 'MatchedDoctors', 'TotalScore',
+    'MatchedEntityID', 'MatchedPracticeName', 'AlreadyApproved', 'FileName', 'UploadedDate'
+]
+# Runner-ups are only written once the table has their columns (see MATCHED_DATA_RUNNER_UPS)
+if MATCH_TOP_N > 1 and MATCHED_DATA_RUNNER_UPS:
+    MATCHED_DATA_COLUMNS += RUNNER_UP_COLUMNS
+# ... and so is MatchType from the exact-key fast path (see MATCHED_DATA_MATCH_TYPE)
+if EXACT_MATCH_KEYS and MATCHED_DATA_MATCH_TYPE:
+    MATCHED_DATA_COLUMNS += ['MatchType']
+# A DSO's row is identified by its SourceID
+MATCHED_DATA_KEYS = ['Source', 'SourceID']
 
-def upload_to_datalake(df: pd.DataFrame):
+def upload_to_datalake(df: pd.DataFrame, backend=None):
+    """
+    Writes matched rows to sa.dso_recon.matched_data in bounded, parameterized chunks.
+    Pass a bulk_writer.SQLBackend to write somewhere else (e.g. a local SQLite file).
+    """
     if df.empty:
-        print("DataFrame is empty. No data to upload.")
+        logging.info(" DataFrame is empty. No data to upload.")
         return
 
     df['UploadedDate'] = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
 
-    columns = [
-        'Name', 'Address', 'State', 'City', 'Zip', 'Emails', 'Doctors', 'SourceID', 'Source',
-        'MatchedName', 'MatchedEmails', 'MatchedAddress', 'MatchedDoctors', 'TotalScore',
-        'MatchedEntityID', 'MatchedPracticeName', 'AlreadyApproved', 'FileName', 'UploadedDate'
-    ]
+    backend = backend or SQLBackend(pool.connection, MATCHED_DATA_TABLE)
+    try:
+        started = time.perf_counter()
+        summary = bulk_insert(df, MATCHED_DATA_COLUMNS, backend)
+        _observe_query('insert_matched_data', started, summary['rows'])
+        metrics.inc('dso_upload_bytes_total', summary['bytes_sent'], 'Bytes sent in matched_data inserts.')
+        return summary
+    except Exception as e:
+        logging.error(f" Bulk insert failed. Error: {e}")
+        raise
 
-    def _quote_sql_value(value):
-        if pd.isna(value) or value is None:
-            return "NULL"
-        if isinstance(value, (int, float)):
-            return str(value)
-        escaped_value = str(value).replace("'", "''")
-        return f"'{escaped_value}'"
-
-    all_values = []
-    for _, row in df.iterrows():
-        row_values = [_quote_sql_value(row.get(col)) for col in columns]
-        all_values.append(f"({', '.join(row_values)})")
-
-    values_string = ',\n'.join(all_values)
-    column_string = ', '.join([f'`{col}`' for col in columns])
-
-    bulk_insert_query = f"""
-        INSERT INTO `sa`.`dso_recon`.`matched_data` ({column_string})
-        VALUES {values_string};
+def merge_into_datalake(df: pd.DataFrame, backend=None):
+    """
+    Upserts rows into matched_data keyed on (Source, SourceID): changed rows are updated in place,
+    new ones inserted. Used by incremental re-matching instead of delete + insert.
     """
+    if df.empty:
+        logging.info(" DataFrame is empty. Nothing to merge.")
+        return
 
+    df['UploadedDate'] = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+    backend = backend or SQLBackend(pool.connection, MATCHED_DATA_TABLE)
     try:
-        with get_connection() as conn:
-            with conn.cursor() as cursor:
-                print("Executing bulk insert (no transaction)...")
-                cursor.execute(bulk_insert_query)
-                print("Bulk insert successful.")
+        started = time.perf_counter()
+        summary = bulk_merge(df, MATCHED_DATA_COLUMNS, MATCHED_DATA_KEYS, backend)
+        _observe_query('merge_matched_data', started, summary['rows'])
+        metrics.inc('dso_upload_bytes_total', summary['bytes_sent'], 'Bytes sent in matched_data inserts.')
+        return summary
     except Exception as e:
-        print(f"Bulk insert failed. Error: {e}")
+        logging.error(f" Bulk merge failed. Error: {e}")
         raise
 
+def delete_matched_rows(dso_name: str, source_ids, batch_size=1000):
+    """Deletes only these SourceIDs of the DSO from matched_data, in parameterized batches."""
+    source_ids = [str(s) for s in source_ids]
+    started = time.perf_counter()
+    for start in range(0, len(source_ids), batch_size):
+        batch = source_ids[start:start + batch_size]
+        params = {'source': dso_name, **{f"s{i}": v for i, v in enumerate(batch)}}
+        placeholders = ', '.join(f":s{i}" for i in range(len(batch)))
+        query = f"DELETE FROM {MATCHED_DATA_TABLE} WHERE Source = :source AND SourceID IN ({placeholders})"
+        with pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(query, params)
+    if source_ids:
+        logging.info(f" Deleted {len(source_ids)} removed SourceIDs for DSO: {dso_name}")
+    _observe_query('delete_matched_rows', started, len(source_ids))
+
+def count_matched_rows(dso_name: str):
+    """Number of matched_data rows currently stored for the DSO."""
+    query = f"SELECT COUNT(*) AS n FROM {MATCHED_DATA_TABLE} WHERE Source = :source"
+    df = pool.run(lambda conn: pd.read_sql(query, conn, params={'source': dso_name}))
+    return int(df['n'].iloc[0])
+
 def get_dso_config_data():
-    with get_connection() as conn:
-        query = "SELECT * FROM sa.dso_recon.dso_config"
-        return pd.read_sql(query, conn)
+    query = "SELECT * FROM sa.dso_recon.dso_config"
+    return _read_sql(query, 'dso_config')
 
 def get_dso_dropdown_options():
-    with get_connection() as conn:
-        query = "SELECT CompanyName AS Name, DSOId AS ID FROM sa.netsuite.customer_dso"
-        return pd.read_sql(query, conn)
+    query = "SELECT CompanyName AS Name, DSOId AS ID FROM sa.netsuite.customer_dso"
+    return _read_sql(query, 'dso_dropdown')
 
-def get_approved_source_ids():
+def fetch_approved_source_ids(source_ids=None, modified_since=None, with_watermark=False):
     """
-    Fetches all approved source_ids from the sa._sigma_write_schema.approved_dso table
-    Returns a set of approved source_ids for quick lookup
+    Reads source_ids from approved_dso as a DataFrame; errors are raised.
+    source_ids: only look these up (sent as IN lists of APPROVED_PUSHDOWN_BATCH).
+    modified_since: only rows with APPROVED_WATERMARK_COLUMN after this value.
+    with_watermark: also return APPROVED_WATERMARK_COLUMN as `modified`.
     """
-    try:
-        with get_connection() as conn:
-            query = "SELECT source_id FROM sa._sigma_write_schema.approved_dso"
-            df = pd.read_sql(query, conn)
-            return set(df['source_id'].astype(str).tolist())
-    except Exception as e:
-        print(f"Error fetching approved source_ids: {e}")
-        return set()  # Return empty set if query fails
+    columns = "source_id"
+    if with_watermark and APPROVED_WATERMARK_COLUMN:
+        columns += f", `{APPROVED_WATERMARK_COLUMN}` as modified"
+    conditions = []
+    if modified_since is not None:
+        escaped = str(modified_since).replace("'", "''")
+        conditions.append(f"`{APPROVED_WATERMARK_COLUMN}` > '{escaped}'")
+
+    if source_ids is None:
+        batches = [None]
+    else:
+        ids = [str(s) for s in source_ids]
+        batches = [ids[i:i + APPROVED_PUSHDOWN_BATCH] for i in range(0, len(ids), APPROVED_PUSHDOWN_BATCH)]
+        if not batches:
+            return pd.DataFrame(columns=['source_id'])
+
+    frames = []
+    for batch in batches:
+        where = list(conditions)
+        if batch is not None:
+            in_list = ', '.join("'" + s.replace("'", "''") + "'" for s in batch)
+            where.append(f"CAST(source_id AS STRING) IN ({in_list})")
+        where_clause = f"WHERE {' AND '.join(where)}" if where else ""
+        frames.append(_read_sql(f"SELECT {columns} FROM sa._sigma_write_schema.approved_dso {where_clause}", 'approved_ids'))
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+def fetch_confirmed_matches(dso_name, source_ids):
+    """
+    Reviewer-confirmed SourceID -> MatchedEntityID for the given SourceIDs of a DSO, read from
+    CONFIRMED_MATCHES_TABLE in IN lists of APPROVED_PUSHDOWN_BATCH. Returns an empty Series when no table is set.
+    """
+    if not CONFIRMED_MATCHES_TABLE:
+        return pd.Series(dtype=object)
+    ids = [str(s) for s in source_ids]
+    source = str(dso_name).replace("'", "''")
+    frames = []
+    for i in range(0, len(ids), APPROVED_PUSHDOWN_BATCH):
+        in_list = ', '.join("'" + s.replace("'", "''") + "'" for s in ids[i:i + APPROVED_PUSHDOWN_BATCH])
+        frames.append(_read_sql(
+            f"SELECT CAST(SourceID AS STRING) AS SourceID, CAST(MatchedEntityID AS STRING) AS MatchedEntityID "
+            f"FROM {CONFIRMED_MATCHES_TABLE} WHERE Source = '{source}' AND CAST(SourceID AS STRING) IN ({in_list})",
+            'confirmed_matches'
+        ))
+    if not frames:
+        return pd.Series(dtype=object)
+    confirmed = pd.concat(frames, ignore_index=True).drop_duplicates('SourceID', keep='last')
+    return pd.Series(confirmed['MatchedEntityID'].to_numpy(), index=confirmed['SourceID'].to_numpy())
 
 def insert_or_update_dso_config(record):
     for key in ["ConcatSourceID", "ConcatDoctorName"]:
@@ -149,6 +273,14 @@ def insert_or_update_dso_config(record):
         WHEN NOT MATCHED THEN INSERT ({insert_cols}) VALUES ({insert_vals})
     """
 
-    with get_connection() as conn:
+    with pool.connection() as conn:
         with conn.cursor() as cursor:
             cursor.execute(merge_query)
+
+def delete_dso_config_row(ns_entity_id):
+    escaped = str(ns_entity_id).replace("'", "''")
+    query = f"DELETE FROM sa.dso_recon.dso_config WHERE NSEntityID = '{escaped}'"
+    with pool.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(query)
+            logging.info(f" Deleted DSO config: {ns_entity_id}")
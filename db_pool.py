@@ -0,0 +1,168 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of DB-API connections created by `factory`.
+    Idle connections older than max_idle_seconds are closed instead of reused, and a
+    connection that sat idle longer than health_check_after is checked with `SELECT 1`
+    before it is handed out.
+    """
+
+    def __init__(self, factory, size=4, max_idle_seconds=300, health_check_after=30, wait_timeout=60):
+        self.factory = factory
+        self.size = size
+        self.max_idle_seconds = max_idle_seconds
+        self.health_check_after = health_check_after
+        self.wait_timeout = wait_timeout
+
+        self._cond = threading.Condition()
+        self._idle = []  # (connection, released_at), most recently used last
+        self._open = 0
+        self._stats = {
+            'hits': 0, 'misses': 0, 'waits': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0,
+            'created': 0, 'closed': 0, 'failed_health_checks': 0, 'reconnects': 0,
+        }
+
+    def _quiet_close(self, conn):
+        try:
+            conn.close()
+        except Exception as e:
+            logging.warning(f" Error closing pooled connection: {e}")
+        with self._cond:
+            self._stats['closed'] += 1
+
+    def _healthy(self, conn):
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+            finally:
+                cursor.close()
+            return True
+        except Exception:
+            with self._cond:
+                self._stats['failed_health_checks'] += 1
+            return False
+
+    def acquire(self):
+        started = time.monotonic()
+        waited = False
+        expired = []
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                # Idle eviction: drop connections that sat unused longer than max_idle_seconds
+                keep = [(c, t) for c, t in self._idle if now - t <= self.max_idle_seconds]
+                expired += [c for c, t in self._idle if now - t > self.max_idle_seconds]
+                self._open -= len(self._idle) - len(keep)
+                self._idle = keep
+
+                if self._idle:
+                    conn, released = self._idle.pop()
+                    self._stats['hits'] += 1
+                    break
+                if self._open < self.size:
+                    conn, released = None, None
+                    self._open += 1
+                    self._stats['misses'] += 1
+                    break
+
+                remaining = self.wait_timeout - (now - started)
+                if remaining <= 0:
+                    raise PoolTimeout(f"No database connection available after {self.wait_timeout}s")
+                waited = True
+                self._cond.wait(remaining)
+
+            if waited:
+                wait = time.monotonic() - started
+                self._stats['waits'] += 1
+                self._stats['wait_seconds'] += wait
+                self._stats['max_wait_seconds'] = max(self._stats['max_wait_seconds'], wait)
+
+        for c in expired:
+            self._quiet_close(c)
+
+        if conn is not None:
+            if now - released <= self.health_check_after or self._healthy(conn):
+                return conn
+            # Dead connection: reconnect in the same slot
+            with self._cond:
+                self._stats['reconnects'] += 1
+            self._quiet_close(conn)
+
+        try:
+            conn = self.factory()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats['created'] += 1
+        return conn
+
+    def release(self, conn, broken=False):
+        if broken:
+            self._quiet_close(conn)
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Checks a connection out for the duration of the block. Broken connections are discarded."""
+        conn = self.acquire()
+        try:
+            yield conn
+        except Exception:
+            self.release(conn, broken=not self._healthy(conn))
+            raise
+        self.release(conn)
+
+    def run(self, func, retries=1):
+        """
+        Calls func(conn) with a pooled connection. If it fails because the connection broke,
+        retries on a fresh connection. Only use for idempotent work such as reads.
+        """
+        for attempt in range(retries + 1):
+            conn = self.acquire()
+            try:
+                result = func(conn)
+            except Exception as e:
+                broken = not self._healthy(conn)
+                self.release(conn, broken=broken)
+                if not broken or attempt == retries:
+                    raise
+                with self._cond:
+                    self._stats['reconnects'] += 1
+                logging.warning(f" Database connection failed ({e}); reconnecting.")
+                continue
+            self.release(conn)
+            return result
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(size=self.size, open=self._open, idle=len(self._idle), in_use=self._open - len(self._idle))
+        return stats
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._quiet_close(conn)
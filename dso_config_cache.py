@@ -0,0 +1,104 @@
+import os
+import time
+import threading
+from config import DSO_CONFIG_CACHE_TTL_SECONDS, DSO_CONFIG_VERSION_FILE
+from databricks_conn import get_dso_config_data, get_dso_dropdown_options, insert_or_update_dso_config, delete_dso_config_row
+
+_lock = threading.Lock()
+_cache = {
+    'records': None,    # dso_config rows as dicts, in table order
+    'by_id': {},        # str(NSEntityID) -> row
+    'columns': [],
+    'dropdown': None,   # customer_dso rows for the setup dropdowns
+    'loaded_at': 0.0,
+    'version': None,
+}
+
+
+def _current_version():
+    # Any process that writes dso_config touches this file, so every worker sees the change
+    try:
+        return os.path.getmtime(DSO_CONFIG_VERSION_FILE)
+    except OSError:
+        return None
+
+
+def _bump_version():
+    os.makedirs(os.path.dirname(DSO_CONFIG_VERSION_FILE) or '.', exist_ok=True)
+    with open(DSO_CONFIG_VERSION_FILE, 'a'):
+        pass
+    os.utime(DSO_CONFIG_VERSION_FILE, None)
+
+
+def _is_fresh():
+    return (
+        _cache['records'] is not None
+        and time.time() - _cache['loaded_at'] < DSO_CONFIG_CACHE_TTL_SECONDS
+        and _cache['version'] == _current_version()
+    )
+
+
+def _load():
+    """
+    The cached (records, by_id, columns), reloading first if stale. They are read under the lock,
+    so callers never see the None an invalidate_dso_configs in another thread leaves behind.
+    """
+    with _lock:
+        if not _is_fresh():
+            version = _current_version()
+            data_df = get_dso_config_data()
+            records = data_df.to_dict(orient='records')
+            _cache.update(
+                records=records,
+                by_id={str(r['NSEntityID']): r for r in records},
+                columns=list(data_df.columns),
+                dropdown=None,
+                loaded_at=time.time(),
+                version=version,
+            )
+        return _cache['records'], _cache['by_id'], _cache['columns']
+
+
+def get_dso_configs():
+    """All dso_config rows as dicts, served from memory until the table changes or the TTL passes."""
+    records, _, _ = _load()
+    return [dict(r) for r in records]
+
+
+def get_dso_config(ns_entity_id):
+    """The dso_config row for this NSEntityID, or None."""
+    _, by_id, _ = _load()
+    record = by_id.get(str(ns_entity_id))
+    return dict(record) if record else None
+
+
+def get_dso_config_columns():
+    _, _, columns = _load()
+    return list(columns)
+
+
+def get_dso_dropdown():
+    """customer_dso Name/ID rows for the setup forms; refreshed together with the config rows."""
+    _load()
+    with _lock:
+        if _cache['dropdown'] is None:
+            _cache['dropdown'] = get_dso_dropdown_options().to_dict(orient='records')
+        return list(_cache['dropdown'])
+
+
+def invalidate_dso_configs():
+    with _lock:
+        _cache['records'] = None
+        _cache['dropdown'] = None
+    _bump_version()
+
+
+def save_dso_config(record):
+    """Writes the config row to the warehouse and invalidates every process's cached copy."""
+    insert_or_update_dso_config(record)
+    invalidate_dso_configs()
+
+
+def delete_dso_config(ns_entity_id):
+    delete_dso_config_row(ns_entity_id)
+    invalidate_dso_configs()
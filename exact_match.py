@@ -0,0 +1,179 @@
+import os
+import numpy as np
+import pandas as pd
+from config import EXACT_MATCH_KEYS
+from normalize import clean_text, zip_digits, email_addresses
+
+# Exact key -> column added by add_exact_keys(); 'confirmed' is looked up by SourceID instead
+KEY_COLUMNS = {
+    'email': 'ExactEmails',
+    'address_zip': 'ExactAddressZip',
+}
+# MatchType written for rows resolved by each key; everything else is 'fuzzy'
+MATCH_TYPES = {
+    'confirmed': 'confirmed',
+    'email': 'exact_email',
+    'address_zip': 'exact_address',
+}
+# An email can also link a DSO's practices to the one customer holding its head-office inbox,
+# so an email hit only counts when the roster row and the customer have the same 5-digit ZIP too
+SAME_ZIP_KEYS = {'email'}
+
+
+def add_exact_keys(df):
+    """
+    Adds the exact key columns to df in place: ExactEmails (the row's email addresses, lower-cased)
+    and ExactAddressZip (cleaned Address + '|' + 5-digit ZIP). Must run on the raw Emails.
+    """
+    df['ExactEmails'] = email_addresses(df['Emails']) if 'Emails' in df.columns else ''
+    if 'Address' in df.columns and 'Zip' in df.columns:
+        address = clean_text(df['Address'].fillna('')).str.strip()
+        zip5 = zip_digits(df['Zip'].fillna('')).str[:5]
+        df['ExactAddressZip'] = (address + '|' + zip5).where((address != '') & (zip5.str.len() == 5), '')
+    else:
+        df['ExactAddressZip'] = ''
+    return df
+
+
+def _explode_keys(keys):
+    """(row position, key) for every non-empty comma-separated key, without repeats within a row."""
+    pairs = pd.DataFrame({'pos': np.arange(len(keys)), 'key': keys.fillna('').astype(str).to_numpy()})
+    pairs = pairs[pairs['key'] != '']
+    pairs = pairs.assign(key=pairs['key'].str.split(',')).explode('key')
+    return pairs[pairs['key'] != ''].drop_duplicates()
+
+
+def _sorted_lookup(keys, pos):
+    order = np.argsort(keys, kind='stable')
+    return {'keys': keys[order], 'pos': pos[order]}
+
+
+def build_exact_index(df2):
+    """
+    Sorted lookups ({'keys', 'pos'} arrays) from each exact key to the customer row position it identifies.
+    Keys shared by several customers are left out, since they can't say which one a roster row is.
+    'entity' maps MatchedEntityID to the row position for confirmed matches.
+    """
+    index = {}
+    for key, column in KEY_COLUMNS.items():
+        if column not in df2.columns:
+            continue
+        pairs = _explode_keys(df2[column])
+        pairs = pairs[~pairs['key'].duplicated(keep=False)]
+        index[key] = _sorted_lookup(pairs['key'].to_numpy().astype(str), pairs['pos'].to_numpy())
+    if 'MatchedEntityID' in df2.columns:
+        entities = df2['MatchedEntityID'].astype(str)
+        unique = ~entities.duplicated(keep=False).to_numpy()
+        index['entity'] = _sorted_lookup(entities.to_numpy().astype(str)[unique], np.flatnonzero(unique))
+    return index
+
+
+def save_exact_index(index, path):
+    """Writes a build_exact_index() result to the directory path as one uncompressed .npy per array."""
+    os.makedirs(path, exist_ok=True)
+    for key, lookup in index.items():
+        for field, values in lookup.items():
+            np.save(os.path.join(path, f"{key}.{field}.npy"), np.asarray(values), allow_pickle=False)
+
+
+def load_exact_index(path, mmap_mode=None):
+    """Reads an index written by save_exact_index(); mmap_mode='r' maps the arrays instead of reading them."""
+    index = {}
+    for name in sorted(os.listdir(path)):
+        key, field, _ = name.split('.')
+        index.setdefault(key, {})[field] = np.load(os.path.join(path, name), mmap_mode=mmap_mode, allow_pickle=False)
+    return index
+
+
+def _shared(pairs, source_ids):
+    """Keys held by more than one SourceID in the roster (e.g. a DSO-wide billing email): they can't identify a practice."""
+    owners = pd.Series(source_ids.to_numpy()[pairs['pos'].to_numpy()], index=pairs['key'].to_numpy())
+    counts = owners.groupby(level=0).nunique()
+    return np.sort(counts.index[counts.to_numpy() > 1].to_numpy().astype(str))
+
+
+def roster_shared_keys(df1_to_match, keys=None):
+    """
+    {key: sorted array of the values held by more than one SourceID} for the email and address keys of a
+    prepared roster. Pass it to exact_matches when matching only part of that roster, so values shared
+    with rows outside the part are still ignored.
+    """
+    keys = EXACT_MATCH_KEYS if keys is None else keys
+    return {
+        key: _shared(_explode_keys(df1_to_match[KEY_COLUMNS[key]]), df1_to_match['SourceID'])
+        for key in keys if key in KEY_COLUMNS and KEY_COLUMNS[key] in df1_to_match.columns
+    }
+
+
+def _zip5(zips, rows):
+    # take() first: the customer column may be the Arrow-backed, memory-mapped one
+    return zip_digits(zips.take(rows)).str[:5].to_numpy()
+
+
+def _same_zip(df1, df2, pos, right):
+    """Whether each (roster row, customer row) pair has the same full 5-digit ZIP."""
+    if 'Zip' not in df1.columns or 'Zip' not in df2.columns:
+        return np.zeros(len(pos), dtype=bool)
+    left, right = _zip5(df1['Zip'], pos), _zip5(df2['Zip'], right)
+    return (left == right) & (pd.Series(left, dtype=object).str.len().to_numpy() == 5)
+
+
+def _lookup(lookup, pairs):
+    """Roster row -> customer row for rows whose keys all point at the same single customer."""
+    keys = pairs['key'].to_numpy().astype(str)
+    at = np.minimum(np.searchsorted(lookup['keys'], keys), max(len(lookup['keys']) - 1, 0))
+    found = lookup['keys'][at] == keys if len(lookup['keys']) else np.zeros(len(keys), dtype=bool)
+    hits = pd.DataFrame({'pos': pairs['pos'].to_numpy()[found], 'right': lookup['pos'][at[found]]})
+    hits = hits.drop_duplicates()
+    hits = hits[~hits['pos'].duplicated(keep=False)]
+    return hits['pos'].to_numpy(), hits['right'].to_numpy()
+
+
+def exact_matches(df1_to_match, df2, exact_index, confirmed=None, keys=None, shared_keys=None):
+    """
+    Resolves prepared roster rows against prepared customers (df2, indexed by build_exact_index)
+    on exact keys, trying keys in order; 'confirmed' uses the confirmed Series of SourceID -> MatchedEntityID.
+    Email and address keys shared by several SourceIDs in the roster are ignored (shared_keys, from
+    roster_shared_keys, when df1_to_match is only part of the roster), and email hits also
+    need the same 5-digit ZIP. A SourceID is resolved by its first row that hits.
+    Returns a frame of level_0/level_1 (roster/customer labels), SourceID and MatchType.
+    """
+    keys = EXACT_MATCH_KEYS if keys is None else keys
+    resolved = np.zeros(len(df1_to_match), dtype=bool)
+    found = []
+    for key in keys:
+        if key == 'confirmed':
+            if confirmed is None or len(confirmed) == 0 or 'entity' not in exact_index:
+                continue
+            entities = df1_to_match['SourceID'].astype(str).map(confirmed)
+            pairs = pd.DataFrame({'pos': np.arange(len(df1_to_match)), 'key': entities.to_numpy()}).dropna()
+            pos, right = _lookup(exact_index['entity'], pairs.astype({'key': str}))
+        elif key in KEY_COLUMNS:
+            column = KEY_COLUMNS[key]
+            if key not in exact_index or column not in df1_to_match.columns:
+                continue
+            pairs = _explode_keys(df1_to_match[column])
+            shared = _shared(pairs, df1_to_match['SourceID']) if shared_keys is None else shared_keys.get(key, [])
+            pairs = pairs[~pairs['key'].isin(shared)]
+            pos, right = _lookup(exact_index[key], pairs)
+            if key in SAME_ZIP_KEYS:
+                same = _same_zip(df1_to_match, df2, pos, right)
+                pos, right = pos[same], right[same]
+        else:
+            raise ValueError(f"Unknown exact match key '{key}'")
+        new = ~resolved[pos]
+        pos, right = pos[new], right[new]
+        resolved[pos] = True
+        found.append(pd.DataFrame({'pos': pos, 'right': right, 'MatchType': MATCH_TYPES[key]}))
+
+    if not found:
+        return pd.DataFrame(columns=['level_0', 'level_1', 'SourceID', 'MatchType'])
+    hits = pd.concat(found, ignore_index=True).sort_values('pos', kind='stable')
+    hits['SourceID'] = df1_to_match['SourceID'].to_numpy()[hits['pos'].to_numpy()]
+    hits = hits.drop_duplicates('SourceID')
+    return pd.DataFrame({
+        'level_0': df1_to_match.index[hits['pos'].to_numpy()],
+        'level_1': df2.index[hits['right'].to_numpy()],
+        'SourceID': hits['SourceID'].to_numpy(),
+        'MatchType': hits['MatchType'].to_numpy(),
+    })
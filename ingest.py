@@ -0,0 +1,306 @@
+import os
+import re
+import time
+import uuid
+import hashlib
+import logging
+import tempfile
+from itertools import chain
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import load_workbook
+from concurrent.futures import ThreadPoolExecutor
+from config import INGEST_CHUNK_ROWS, INGEST_PREVIEW_ROWS, INGEST_WORKERS, PREPARED_WAIT_TIMEOUT_SECONDS
+from normalize import concat_doctors, combine_emails, dedupe_emails
+from prepared_store import dataset_key, dataset_path, claim, touch, evict
+from metrics import timed, inc
+
+# Keys in a dso_config row that are settings rather than column mappings
+CONFIG_KEYS = ['ID', 'Name', 'NSEntityID', 'Type', 'Header', 'Concat_Doctor', 'SheetName']
+
+_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix='ingest')
+
+
+class MissingColumnsError(KeyError):
+    pass
+
+
+def column_mapping(config_entry):
+    """Target column -> uploaded column name, for the mapped (non-'none') entries of a dso_config row."""
+    return {
+        k: v for k, v in config_entry.items()
+        if k not in CONFIG_KEYS
+           and isinstance(v, str)
+           and v.strip().lower() != 'none'
+    }
+
+
+def _cell_str(value):
+    # Same text pd.read_excel(dtype=str) produces for the cell
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _clean_header(value, i):
+    if value is None:
+        return f"Unnamed: {i}"
+    return re.sub(r'[\r\n]+', '', str(value).strip())
+
+
+def transform_chunk(df, config_entry, dso_name):
+    """Applies the DSO config to a frame already renamed to target columns."""
+    concat_dr = config_entry.get("Concat_Doctor", [])
+    if concat_dr and all(col in df.columns for col in concat_dr):
+        df['Doctors'] = concat_doctors(df, concat_dr)
+
+    if 'Emails' in df.columns and 'AddEmail' in df.columns:
+        df['Emails'] = combine_emails(df['Emails'], df['AddEmail'])
+        df.drop(columns=['AddEmail'], inplace=True)
+    elif 'AddEmail' in df.columns:
+        df['Emails'] = df['AddEmail'].astype(str)
+        df.drop(columns=['AddEmail'], inplace=True)
+    elif 'Emails' not in df.columns:
+        df['Emails'] = None
+
+    df['Emails'] = dedupe_emails(df['Emails'])
+
+    df['Source'] = dso_name
+    df['DSO_Id'] = config_entry.get("NSEntityID", '')
+    df['Type'] = config_entry.get("Type", '')
+
+    if 'SourceID' not in df.columns and 'PracticeName' in df.columns and 'Address' in df.columns:
+        df['SourceID'] = df['PracticeName'].astype(str) + ' | ' + df['Address'].astype(str)
+    return df
+
+
+class ExcelIngest:
+    """
+    Streams one sheet of a workbook in openpyxl read-only mode, keeping only the mapped columns.
+    Rows come out in DataFrames of at most chunk_rows rows, already transformed for matching
+    (transform=False yields the mapped columns as read, e.g. to time parsing on its own).
+    """
+
+    def __init__(self, path, config_entry, dso_name, chunk_rows=None, transform=True):
+        self.path = path
+        self.transform = transform
+        self.config_entry = config_entry
+        self.dso_name = dso_name
+        self.chunk_rows = chunk_rows or INGEST_CHUNK_ROWS
+        self.mapping = column_mapping(config_entry)
+
+        self.workbook = load_workbook(path, read_only=True, data_only=True)
+        sheet_name = config_entry.get("SheetName") or 0  # default to first sheet if not specified
+        sheet = self.workbook.worksheets[sheet_name] if isinstance(sheet_name, int) else self.workbook[sheet_name]
+        self.rows = sheet.iter_rows(values_only=True)
+
+        header = int(config_entry.get("Header", 0))
+        for _ in range(header):
+            next(self.rows, None)
+        columns = [_clean_header(v, i) for i, v in enumerate(next(self.rows, None) or ())]
+        logging.debug(f" Uploaded columns: {columns}")
+
+        missing = [v for v in self.mapping.values() if v not in columns]
+        if missing:
+            self.close()
+            raise MissingColumnsError(f"{missing} not in index")
+        # First occurrence wins when a header is repeated, as with read_excel
+        self.indices = [columns.index(v) for v in self.mapping.values()]
+
+    def close(self):
+        self.workbook.close()
+
+    def chunks(self, first_rows=None):
+        """Yields transformed chunks; the first one holds only first_rows rows so a preview can render early."""
+        limit = first_rows or self.chunk_rows
+        width = max(self.indices) + 1 if self.indices else 0
+        buffer, blank_run = [], []
+        for row in self.rows:
+            blank = all(v is None for v in row)
+            row = tuple(row[:width]) + (None,) * (width - len(row))
+            values = [_cell_str(row[i]) for i in self.indices]
+            # Blank rows only count if data follows them; read_excel drops trailing ones
+            if blank:
+                blank_run.append(values)
+                continue
+            buffer.extend(blank_run)
+            blank_run = []
+            buffer.append(values)
+            if len(buffer) >= limit:
+                yield self._frame(buffer)
+                buffer, limit = [], self.chunk_rows
+        if buffer:
+            yield self._frame(buffer)
+
+    def _frame(self, rows):
+        df = pd.DataFrame(rows, columns=list(self.mapping.keys()), dtype=str)
+        return transform_chunk(df, self.config_entry, self.dso_name) if self.transform else df
+
+
+def _marker(path, suffix):
+    return f"{path}.{suffix}"
+
+
+def _write_chunks(chunks, path, t):
+    """Writes transformed chunks to one Parquet file, counting rows into the timed() entry t."""
+    writer = None
+    try:
+        for df in chunks:
+            if writer is None:
+                schema = pa.schema([(col, pa.string()) for col in df.columns])
+                writer = pq.ParquetWriter(path, schema)
+            writer.write_table(pa.Table.from_pandas(df, schema=writer.schema, preserve_index=False))
+            t['rows'] += len(df)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _write_parquet(ingest, first_chunk, chunks, prepared_path):
+    part_path = _marker(prepared_path, 'part')
+    started = time.perf_counter()
+    try:
+        with timed('excel_read', rows=0) as t:
+            try:
+                _write_chunks(chain([first_chunk], chunks), part_path, t)
+            finally:
+                ingest.close()
+        os.replace(part_path, prepared_path)
+        logging.info(f" Prepared {t['rows']} rows in {time.perf_counter() - started:.2f}s -> {prepared_path}")
+        evict()
+    except Exception as e:
+        logging.error(f" Ingestion of {ingest.path} failed: {e}")
+        with open(_marker(prepared_path, 'error'), 'w') as f:
+            f.write(str(e))
+        if os.path.exists(part_path):
+            os.remove(part_path)
+    finally:
+        if os.path.exists(ingest.path):
+            os.remove(ingest.path)
+        if os.path.exists(_marker(prepared_path, 'pending')):
+            os.remove(_marker(prepared_path, 'pending'))
+
+
+def _save_upload(file, path):
+    """Writes the uploaded file to path and returns the SHA-256 of its contents."""
+    digest = hashlib.sha256()
+    with open(path, 'wb') as f:
+        for block in iter(lambda: file.stream.read(1 << 20), b''):
+            digest.update(block)
+            f.write(block)
+    return digest.hexdigest()
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _stored_preview(prepared_path):
+    """The first INGEST_PREVIEW_ROWS rows of an already prepared dataset."""
+    parquet = pq.ParquetFile(prepared_path)
+    batch = next(parquet.iter_batches(batch_size=INGEST_PREVIEW_ROWS), None)
+    return (batch if batch is not None else parquet.schema_arrow.empty_table()).to_pandas()
+
+
+def start_ingest(file, config_entry, dso_name):
+    """
+    Saves the upload, reads the header and the first INGEST_PREVIEW_ROWS rows, and returns (prepared_path, preview_df).
+    prepared_path is in the prepared-dataset store (see prepared_store.py), keyed by the file's contents and the
+    DSO config, so the same workbook uploaded again with the same config is not parsed again.
+    Otherwise the remaining rows are written to prepared_path (Parquet) on a background thread;
+    call wait_for_prepared before reading it.
+    Raises MissingColumnsError if a mapped column is not in the sheet.
+    """
+    workbook_path = os.path.join(tempfile.gettempdir(), f"{uuid.uuid4()}.xlsx")
+    content_hash = _save_upload(file, workbook_path)
+    prepared_path = dataset_path(dataset_key(content_hash, config_entry, dso_name))
+    if os.path.exists(prepared_path):
+        os.remove(workbook_path)
+        touch(prepared_path)
+        inc('dso_prepared_store_total', 1, 'Uploads served from or added to the prepared-dataset store.', result='hit')
+        logging.info(f" Reusing prepared data {prepared_path}")
+        return prepared_path, _stored_preview(prepared_path)
+
+    with timed('excel_preview'):
+        try:
+            ingest = ExcelIngest(workbook_path, config_entry, dso_name)
+        except Exception:
+            os.remove(workbook_path)
+            raise
+
+        chunks = ingest.chunks(first_rows=INGEST_PREVIEW_ROWS)
+        first_chunk = next(chunks, None)
+        if first_chunk is None:
+            first_chunk = transform_chunk(pd.DataFrame(columns=list(ingest.mapping.keys()), dtype=str), config_entry, dso_name)
+    preview = first_chunk
+
+    if not claim(prepared_path):
+        # The same file and config are already being prepared (or just finished); share that result
+        ingest.close()
+        os.remove(workbook_path)
+        inc('dso_prepared_store_total', 1, 'Uploads served from or added to the prepared-dataset store.', result='shared')
+        return prepared_path, preview
+    inc('dso_prepared_store_total', 1, 'Uploads served from or added to the prepared-dataset store.', result='miss')
+    _executor.submit(_write_parquet, ingest, first_chunk, chunks, prepared_path)
+    return prepared_path, preview
+
+
+def prepare_roster_file(path, config_entry, dso_name):
+    """
+    Reads a roster workbook from disk into the prepared-dataset store in the foreground,
+    for callers without a request to answer early (e.g. batch matching). The workbook is left in place.
+    Returns the prepared path, reusing a stored one for the same contents and config;
+    raises MissingColumnsError if a mapped column is not in the sheet.
+    """
+    prepared_path = dataset_path(dataset_key(_file_hash(path), config_entry, dso_name))
+    if not claim(prepared_path):
+        wait_for_prepared(prepared_path)
+        touch(prepared_path)
+        return prepared_path
+    try:
+        ingest = ExcelIngest(path, config_entry, dso_name)
+    except Exception:
+        os.remove(_marker(prepared_path, 'pending'))
+        raise
+    with timed('excel_read', rows=0) as t:
+        try:
+            chunks = ingest.chunks()
+            first_chunk = next(chunks, None)
+            if first_chunk is None:
+                first_chunk = transform_chunk(pd.DataFrame(columns=list(ingest.mapping.keys()), dtype=str), config_entry, dso_name)
+            _write_chunks(chain([first_chunk], chunks), _marker(prepared_path, 'part'), t)
+            os.replace(_marker(prepared_path, 'part'), prepared_path)
+        except Exception:
+            if os.path.exists(_marker(prepared_path, 'part')):
+                os.remove(_marker(prepared_path, 'part'))
+            raise
+        finally:
+            ingest.close()
+            os.remove(_marker(prepared_path, 'pending'))
+    evict()
+    return prepared_path
+
+
+def wait_for_prepared(prepared_path, timeout=None):
+    """Blocks until background ingestion of prepared_path has finished. Raises if it failed or is gone."""
+    timeout = PREPARED_WAIT_TIMEOUT_SECONDS if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    while True:
+        error_path = _marker(prepared_path, 'error')
+        if os.path.exists(error_path):
+            with open(error_path) as f:
+                raise RuntimeError(f"Reading the uploaded file failed: {f.read()}")
+        if os.path.exists(prepared_path):
+            return
+        if not os.path.exists(_marker(prepared_path, 'pending')):
+            raise FileNotFoundError("Prepared data is no longer available; upload the file again.")
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Prepared data was not ready after {timeout}s.")
+        time.sleep(0.2)
@@ -0,0 +1,20 @@
+"""
+Stages the background jobs report, in order. Kept out of pipeline.py and batch.py so the web app
+can register the jobs at start-up without importing the matching code.
+"""
+
+# Stages reported while a matching job runs
+MATCHING_STAGES = [
+    ('read', 'Reading prepared data'),
+    ('approved', 'Checking approved records'),
+    ('customers', 'Loading customer data'),
+    ('matching', 'Fuzzy matching'),
+    ('delete', 'Removing previous results'),
+    ('upload', 'Uploading results'),
+]
+
+# Stages reported while a batch job runs
+BATCH_STAGES = [
+    ('customers', 'Loading customer data'),
+    ('matching', 'Matching and uploading rosters'),
+]
@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import traceback
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from config import JOBS_DB_PATH, MATCH_JOB_WORKERS
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+_executor = ThreadPoolExecutor(max_workers=MATCH_JOB_WORKERS, thread_name_prefix='match-job')
+_handlers = {}
+
+
+@contextmanager
+def _connect():
+    os.makedirs(os.path.dirname(JOBS_DB_PATH) or '.', exist_ok=True)
+    conn = sqlite3.connect(JOBS_DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _init_db():
+    with _connect() as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                stage TEXT,
+                stages TEXT NOT NULL,
+                params TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                owner_pid INTEGER,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        # Jobs whose process has gone away will never finish; mark them failed so they can be retried
+        rows = conn.execute("SELECT id, owner_pid FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)).fetchall()
+        for row in rows:
+            if not _pid_alive(row['owner_pid']):
+                conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                    (FAILED, 'Interrupted by a server restart.', time.time(), row['id'])
+                )
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _update(job_id, **fields):
+    fields['updated_at'] = time.time()
+    for key in ('stages', 'result'):
+        if key in fields:
+            fields[key] = json.dumps(fields[key])
+    assignments = ', '.join(f"{k} = ?" for k in fields)
+    with _connect() as conn:
+        conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+
+def register_handler(kind, func, stages):
+    """
+    Registers the function that runs jobs of this kind.
+    func(params, progress) receives the job params and a progress(stage) callback
+    and returns a JSON-serializable result. stages is a list of (key, label) pairs.
+    """
+    _handlers[kind] = (func, stages)
+
+
+def get_job(job_id):
+    """Returns the job as a dict (params, stages and result decoded), or None."""
+    with _connect() as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if row is None:
+        return None
+    job = dict(row)
+    for key in ('stages', 'params', 'result'):
+        job[key] = json.loads(job[key]) if job[key] else None
+    return job
+
+
+def _run(job_id):
+    job = get_job(job_id)
+    func, _ = _handlers[job['kind']]
+    stages = job['stages']
+
+    def progress(stage):
+        now = time.time()
+        for s in stages:
+            if s['status'] == RUNNING:
+                s['status'] = SUCCEEDED
+                s['finished_at'] = now
+            if s['key'] == stage:
+                s['status'] = RUNNING
+                s['started_at'] = now
+        _update(job_id, stage=stage, stages=stages)
+
+    _update(job_id, status=RUNNING, attempts=job['attempts'] + 1, error=None)
+    try:
+        result = func(job['params'], progress)
+    except Exception as e:
+        logging.error(f" Job {job_id} failed: {e}")
+        for s in stages:
+            if s['status'] == RUNNING:
+                s['status'] = FAILED
+        _update(job_id, status=FAILED, stages=stages, error=str(e) or traceback.format_exc())
+        return
+
+    progress(None)
+    for s in stages:
+        if s['status'] == QUEUED:
+            s['status'] = 'skipped'
+    _update(job_id, status=SUCCEEDED, stage=None, stages=stages, result=result)
+
+
+def _enqueue(job_id):
+    _update(job_id, owner_pid=os.getpid())
+    _executor.submit(_run, job_id)
+
+
+def submit_job(kind, params):
+    """Queues a job on the bounded worker pool and returns its ID."""
+    _, stages = _handlers[kind]
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    with _connect() as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, kind, status, stages, params, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, QUEUED, json.dumps(_fresh_stages(stages)), json.dumps(params), now, now)
+        )
+    _enqueue(job_id)
+    return job_id
+
+
+def _fresh_stages(stages):
+    return [{'key': key, 'label': label, 'status': QUEUED} for key, label in stages]
+
+
+def retry_job(job_id):
+    """Re-queues a failed job with its original params. Returns False if it can't be retried."""
+    job = get_job(job_id)
+    if job is None or job['status'] != FAILED:
+        return False
+    _, stages = _handlers[job['kind']]
+    with _connect() as conn:
+        # Conditional update so two retry clicks can't queue the job twice
+        updated = conn.execute(
+            "UPDATE jobs SET status = ?, stage = NULL, stages = ?, error = NULL, updated_at = ? WHERE id = ? AND status = ?",
+            (QUEUED, json.dumps(_fresh_stages(stages)), time.time(), job_id, FAILED)
+        ).rowcount
+    if not updated:
+        return False
+    _enqueue(job_id)
+    return True
+
+
+_init_db()
@@ -0,0 +1,143 @@
+import time
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from jellyfish import jaro_winkler_similarity
+from config import MATCH_API_TOP_N, MATCH_API_MIN_SCORE, MATCH_API_REFRESH_SECONDS, EXACT_MATCH_KEYS, EXACT_MATCH_SCORE
+from customer_features import get_customer_features
+from match_logic import prepare_roster, score_best_matches
+from compare_engine import COMPARE_FIELDS, score_pairs
+from exact_match import exact_matches
+from normalize import dedupe_emails
+from metrics import observe, LATENCY_BUCKETS
+
+# Fields a request may send for each practice
+INPUT_FIELDS = ['Name', 'Address', 'City', 'State', 'Zip', 'Emails', 'Doctors']
+
+_lock = threading.Lock()
+_resident = {'features': None, 'loaded_at': 0.0, 'refreshing': False}
+
+
+def _refresh():
+    try:
+        features = get_customer_features()
+        with _lock:
+            _resident.update(features=features, loaded_at=time.time())
+    except Exception as e:
+        logging.warning(f" Match API couldn't refresh the customer features, keeping the loaded ones: {e}")
+    finally:
+        with _lock:
+            _resident['refreshing'] = False
+
+
+def warm():
+    """Loads the customer features in the background so the first request doesn't wait for them."""
+    with _lock:
+        if _resident['refreshing']:
+            return
+        _resident['refreshing'] = True
+    threading.Thread(target=_refresh, name='match-api-warm', daemon=True).start()
+
+
+def _features():
+    """
+    The resident customer features. Only the very first call waits for them; after that a stale copy
+    (older than MATCH_API_REFRESH_SECONDS) keeps serving while a background refresh picks up a new snapshot.
+    """
+    with _lock:
+        features, age = _resident['features'], time.time() - _resident['loaded_at']
+    if features is None:
+        features = get_customer_features()
+        with _lock:
+            _resident.update(features=features, loaded_at=time.time())
+    elif age >= MATCH_API_REFRESH_SECONDS:
+        warm()
+    return features
+
+
+def _roster(records):
+    """A prepared roster frame (SourceID = position in records) from the request's field dicts."""
+    df = pd.DataFrame(
+        [{f: str(r.get(f) or '') for f in INPUT_FIELDS} for r in records],
+        columns=INPUT_FIELDS, dtype=object
+    )
+    # Same email clean-up an uploaded roster gets in transform_chunk()
+    df['Emails'] = dedupe_emails(df['Emails'])
+    df['SourceID'] = np.arange(len(df)).astype(str)
+    return prepare_roster(df)
+
+
+def _similarity(left, right):
+    if not isinstance(left, str) or not isinstance(right, str) or not left or not right:
+        return 0.0
+    return round(jaro_winkler_similarity(left, right), 4)
+
+
+def _candidates(roster, customers, left, right, scores, total, match_type):
+    """Candidate dicts for the pairs (roster row left[i], customer row right[i]), in pair order."""
+    # Only the candidates' rows of the (memory-mapped) customer columns are read
+    entity_ids = customers['MatchedEntityID'].take(right).to_numpy()
+    names = customers['Name'].take(right).to_numpy(dtype=object, na_value=None)
+    fields = [
+        (col, label, roster[col].to_numpy(dtype=object)[left], customers[col].take(right).to_numpy(dtype=object))
+        for col, label in COMPARE_FIELDS
+    ]
+    return [
+        {
+            'MatchedEntityID': str(entity_ids[i]),
+            'MatchedPracticeName': names[i],
+            'TotalScore': float(total[i]),
+            'MatchType': match_type[i],
+            # 0/1 per field, as written to matched_data, plus the Jaro-Winkler similarity behind it
+            'scores': {label: float(scores[i, j]) for j, (_, label, _, _) in enumerate(fields)},
+            'similarity': {col: _similarity(ours[i], theirs[i]) for col, _, ours, theirs in fields},
+        }
+        for i in range(len(left))
+    ]
+
+
+def match_records(records, top_n=None, min_score=None):
+    """
+    Matches practices given as dicts of INPUT_FIELDS against the resident customer master with the
+    match_records_by_fields() rules: exact keys first (EXACT_MATCH_KEYS without 'confirmed', which needs
+    a SourceID), then blocked Jaro-Winkler scoring. Returns one list of up to top_n candidates per record,
+    best first; an exact match is always the first candidate.
+    """
+    top_n = MATCH_API_TOP_N if top_n is None else top_n
+    min_score = MATCH_API_MIN_SCORE if min_score is None else min_score
+    started = time.perf_counter()
+
+    features = _features()
+    customers = features['customers']
+    roster = _roster(records)
+    results = [[] for _ in records]
+
+    exact_keys = [k for k in EXACT_MATCH_KEYS if k != 'confirmed']
+    # roster keeps the RangeIndex of records and customers a positional one, so labels are positions
+    exact_right = {}
+    if exact_keys and 'exact_index' in features:
+        exact = exact_matches(roster, customers, features['exact_index'], keys=exact_keys)
+        left, right = exact['level_0'].to_numpy(dtype=int), exact['level_1'].to_numpy(dtype=int)
+        _, scores, _ = score_pairs(left, right, roster, customers)
+        total = np.full(len(left), EXACT_MATCH_SCORE)
+        for i, candidate in zip(left, _candidates(roster, customers, left, right, scores, total, exact['MatchType'].to_numpy())):
+            results[i].append(candidate)
+        exact_right = dict(zip(left, right))
+
+    best = score_best_matches(roster, customers, min_score, features['block_index'], top_n=top_n)
+    if best is not None:
+        left, right = best['level_0'].to_numpy(dtype=int), best['level_1'].to_numpy(dtype=int)
+        keep = np.array([exact_right.get(l) != r for l, r in zip(left, right)], dtype=bool)
+        scores = best[[label for _, label in COMPARE_FIELDS]].to_numpy()[keep]
+        match_type = np.full(int(keep.sum()), 'fuzzy', dtype=object)
+        candidates = _candidates(roster, customers, left[keep], right[keep], scores, best['TotalScore'].to_numpy()[keep], match_type)
+        for i, candidate in zip(left[keep], candidates):
+            if len(results[i]) < top_n:
+                results[i].append(candidate)
+
+    observe(
+        'dso_api_match_seconds', time.perf_counter() - started,
+        'Time to answer one match API call.', LATENCY_BUCKETS, batch=str(len(records) > 1).lower()
+    )
+    return results
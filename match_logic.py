@@ -1,93 +1,390 @@
+import logging
+import numpy as np
 import pandas as pd
-from recordlinkage.preprocessing import clean
-import recordlinkage
-from config import STATE_LOOKUP
-def match_records_by_fields(df1, df2, min_score=2):
-    """
-    Finds matching records between two DataFrames using fuzzy logic.
-    Compares Name, Emails, Address, and Doctors with Jaro-Winkler similarity.
-    Blocking is done on State to reduce candidate comparisons.
-    """
+from concurrent.futures import ProcessPoolExecutor
+from config import (
+    MATCH_WORKERS, MATCH_CHUNK_SIZE, MATCH_PARTITION_KEY, MATCH_LOW_MEMORY, MATCH_LOW_MEMORY_CHUNK_ROWS, MATCH_PAIR_BATCH,
+    MATCH_TOP_N, RUNNER_UP_COLUMNS, EXACT_MATCH_KEYS, EXACT_MATCH_SCORE
+)
+from compare_engine import COMPARE_FIELDS, score_pairs
+from blocking import add_blocking_keys, build_block_index, candidate_pair_positions
+from exact_match import add_exact_keys, build_exact_index, exact_matches, roster_shared_keys
+from normalize import clean_text, canonical_state
+from metrics import timed
 
-    if 'SourceID' not in df1.columns:
-        df1 = df1.copy()
-        df1['SourceID'] = df1.index.astype(str)
+CLEAN_COLUMNS = ['Name', 'Emails', 'Address', 'Doctors', 'State']
+# Roster columns blocking and comparison read; low-memory mode prepares only these
+MATCH_COLUMNS = ['SourceID', 'Name', 'Emails', 'Address', 'Doctors', 'State', 'Zip']
+# Few distinct values per upload, so they are stored as categoricals in low-memory mode
+COMPACT_COLUMNS = ['State', 'Source', 'Type']
+# Content hash of each prepared customer row, stored with the customer features (see customer_hashes)
+CUSTOMER_HASH_COLUMN = 'CustomerHash'
+
+# Prepared customer frame and its block index held by each worker process (set by _init_worker)
+_worker_customers = None
+_worker_block_index = None
 
-    original_df1 = df1.copy()
 
+def prepare_roster(df1):
+    """Cleans the roster side and adds its blocking keys. Returns a new frame."""
     df1_to_match = df1.loc[:, ~df1.columns.duplicated()].copy()
-    df2 = df2.loc[:, ~df2.columns.duplicated()].copy()
 
-    print(" Parsed columns:", list(df1_to_match.columns))
-    print(" First row sample:", df1_to_match[['Name', 'Address', 'Emails', 'Doctors', 'Zip']].head(1).to_dict(orient='records'))
+    # Blocking and exact keys need the raw Zip/Name/Emails, so build them before cleaning
+    add_blocking_keys(df1_to_match)
+    add_exact_keys(df1_to_match)
 
-    # Clean fields
-    for col in ['Name', 'Emails', 'Address', 'Doctors', 'State']:
+    for col in CLEAN_COLUMNS:
         if col in df1_to_match.columns:
-            df1_to_match[col] = clean(df1_to_match[col].astype(str).fillna(''))
-        if col in df2.columns:
-            df2[col] = clean(df2[col].astype(str).fillna(''))
+            df1_to_match[col] = clean_text(df1_to_match[col])
 
     # Normalize state names from full name → abbreviation
     if 'State' in df1_to_match.columns:
-        df1_to_match['State'] = df1_to_match['State'].str.strip().map(lambda x: STATE_LOOKUP.get(x.lower(), x.upper()))
+        df1_to_match['State'] = canonical_state(df1_to_match['State'])
+
+    return df1_to_match
+
+
+def prepare_customers(df2):
+    """Cleans the customer side and adds its blocking keys. The result has a positional index."""
+    df2 = df2.loc[:, ~df2.columns.duplicated()].reset_index(drop=True)
+
+    add_blocking_keys(df2)
+    add_exact_keys(df2)
+
+    for col in CLEAN_COLUMNS:
+        if col in df2.columns:
+            df2[col] = clean_text(df2[col])
 
     if 'State' in df2.columns:
         df2['State'] = df2['State'].str.strip().str.upper()
 
-    # Blocking
-    indexer = recordlinkage.Index()
-    if 'State' in df1_to_match.columns and 'State' in df2.columns:
-        indexer.block('State')
+    return df2
+
+
+def customer_hashes(df2):
+    """64-bit hash of each prepared customer row's values, read from CUSTOMER_HASH_COLUMN when df2 has it."""
+    if CUSTOMER_HASH_COLUMN in df2.columns:
+        return df2[CUSTOMER_HASH_COLUMN].to_numpy(dtype=np.uint64)
+    return pd.util.hash_pandas_object(df2.astype(str), index=False).to_numpy()
+
+
+def roster_fingerprints(df1, customer_features, confirmed=None, exact_keys=None):
+    """
+    What decides each roster row's result besides the row itself and the settings, for diff mode
+    (see pipeline._diff_against_previous). Returns (fingerprints, shared_keys):
+    fingerprints is a uint64 Series indexed like df1 summing the customer_hashes of the row's blocking
+    candidates and of the customer its exact keys resolve to, so it changes when any of them is added,
+    changed or removed; shared_keys is roster_shared_keys() of the whole roster, for matching part of it.
+    """
+    exact_keys = EXACT_MATCH_KEYS if exact_keys is None else exact_keys
+    df2, block_index = customer_features['customers'], customer_features['block_index']
+    if 'SourceID' not in df1.columns:
+        df1 = df1.assign(SourceID=df1.index.astype(str))
+    df1_to_match = prepare_roster(df1)
+    hashes = customer_hashes(df2)
+
+    fingerprints = np.zeros(len(df1_to_match), dtype=np.uint64)
+    left, right = candidate_pair_positions(df1_to_match, df2, block_index=block_index)
+    np.add.at(fingerprints, left, hashes[right])
+
+    shared_keys = roster_shared_keys(df1_to_match, exact_keys)
+    if exact_keys:
+        exact_index = customer_features.get('exact_index') or build_exact_index(df2)
+        exact = exact_matches(df1_to_match, df2, exact_index, confirmed, exact_keys, shared_keys)
+        # Salted with the match type, so a customer found by an exact key counts apart from the same one as a candidate
+        salt = pd.util.hash_array(exact['MatchType'].to_numpy().astype(str).astype(object))
+        hits = hashes[df2.index.get_indexer(exact['level_1'])] ^ salt
+        np.add.at(fingerprints, df1_to_match.index.get_indexer(exact['level_0']), hits)
+    return pd.Series(fingerprints, index=df1.index), shared_keys
+
+
+def compact_columns(df, columns=COMPACT_COLUMNS):
+    """Converts low-cardinality text columns to categoricals, in place."""
+    for col in columns:
+        if col in df.columns and df[col].dtype == object:
+            df[col] = df[col].astype('category')
+    return df
+
+
+def _top_n(group, score, order, right, top_n):
+    """
+    Indices of the top_n entries per group and their rank (0 = best): highest score first,
+    ties to the lowest order (roster position), then the lowest right (customer row).
+    """
+    idx = np.lexsort((right, order, -score, group))
+    sorted_group = group[idx]
+    starts = np.flatnonzero(np.r_[True, sorted_group[1:] != sorted_group[:-1]])
+    rank = np.arange(len(idx)) - np.repeat(starts, np.diff(np.r_[starts, len(idx)]))
+    keep = rank < top_n
+    return idx[keep], rank[keep]
+
+
+def _reduce_best(matches_df, order, top_n=1):
+    """
+    Keeps the top_n pairs (highest TotalScore) per SourceID and numbers them in Rank, 0 for the best.
+    Ties go to the earliest roster row, then the earliest customer row, so the result
+    doesn't depend on how pairs were split up.
+    """
+    group = pd.factorize(matches_df['SourceID'])[0]
+    idx, rank = _top_n(
+        group, matches_df['TotalScore'].to_numpy(), np.asarray(order), matches_df['level_1'].to_numpy(), top_n
+    )
+    return matches_df.iloc[idx].assign(Rank=rank).reset_index(drop=True)
+
+
+def score_best_matches(df1_to_match, df2, min_score=2, block_index=None, pair_batch=None, top_n=1):
+    """
+    Generates and scores candidate pairs for prepared roster rows against prepared customers
+    and returns the top_n pairs per SourceID (level_0/level_1 labels, features, TotalScore,
+    SourceID and Rank, 0 for the best).
+    Pairs are scored pair_batch (MATCH_PAIR_BATCH) at a time and only the running top_n per
+    SourceID is kept between batches, so features for every candidate pair never exist at once.
+    """
+    pair_batch = pair_batch or MATCH_PAIR_BATCH
+    with timed('blocking') as t:
+        left_pos, right_pos = candidate_pair_positions(df1_to_match, df2, block_index=block_index)
+        t['rows'] = len(left_pos)
+    if len(left_pos) == 0:
+        return None
+
+    groups = pd.factorize(df1_to_match['SourceID'])[0]
+    best = None
+    for start in range(0, len(left_pos), pair_batch):
+        left, right = left_pos[start:start + pair_batch], right_pos[start:start + pair_batch]
+        # Compare: Jaro-Winkler >= 0.85 on Name, Emails, Address and Doctors.
+        # Only pairs that reach min_score come back, so no separate threshold filter is needed.
+        with timed('compare', rows=len(left)):
+            keep, features, total = score_pairs(left, right, df1_to_match, df2, min_score=min_score)
+        with timed('best_match', rows=len(keep)):
+            batch = {'left': left[keep], 'right': right[keep], 'features': features, 'total': total}
+            if best is not None:
+                batch = {k: np.concatenate([best[k], v]) for k, v in batch.items()}
+            idx, rank = _top_n(groups[batch['left']], batch['total'], batch['left'], batch['right'], top_n)
+            best = {k: v[idx] for k, v in batch.items()}
+            best['rank'] = rank
+
+    matches_df = pd.DataFrame(best['features'].astype(float), columns=[label for _, label in COMPARE_FIELDS])
+    matches_df.insert(0, 'level_0', df1_to_match.index[best['left']])
+    matches_df.insert(1, 'level_1', df2.index[best['right']])
+    matches_df['TotalScore'] = best['total'].astype(float)
+    matches_df['SourceID'] = df1_to_match['SourceID'].to_numpy()[best['left']]
+    matches_df['Rank'] = best['rank']
+    return matches_df
+
+
+def _init_worker(df2, block_index):
+    global _worker_customers, _worker_block_index
+    _worker_customers = df2
+    _worker_block_index = block_index
+
+
+def _score_chunk(df1_chunk, min_score, top_n):
+    return score_best_matches(df1_chunk, _worker_customers, min_score, _worker_block_index, top_n=top_n)
+
+
+def _combine_best(results, df1_to_match, top_n=1):
+    """
+    Reduces per-chunk winners to the top_n pairs per SourceID (SourceIDs can repeat across chunks).
+    Returns None when no chunk found a match.
+    """
+    results = [r for r in results if r is not None and not r.empty]
+    if not results:
+        return None
+    combined = pd.concat(results, ignore_index=True)
+    return _reduce_best(combined, df1_to_match.index.get_indexer(combined['level_0']), top_n)
+
+
+def _roster_chunk_positions(df1_to_match, chunk_size, partition_key):
+    """
+    Splits the prepared roster into chunks of whole blocks (rows sharing partition_key),
+    so each chunk generates and compares candidates for complete blocks.
+    Blocks larger than chunk_size are split across several chunks.
+    Returns sorted row positions per chunk, keeping roster order so tie-breaking matches an unsplit run.
+    """
+    if partition_key in df1_to_match.columns:
+        positions = df1_to_match.reset_index(drop=True).groupby(partition_key, sort=True, dropna=False).indices.values()
     else:
-        indexer.full()
+        positions = [range(len(df1_to_match))]
+
+    chunks, current = [], []
+    for block in positions:
+        block = sorted(block)
+        for start in range(0, len(block), chunk_size):
+            part = block[start:start + chunk_size]
+            if current and len(current) + len(part) > chunk_size:
+                chunks.append(current)
+                current = []
+            current.extend(part)
+    if current:
+        chunks.append(current)
+    return [sorted(chunk) for chunk in chunks]
+
+
+def _roster_chunks(df1_to_match, chunk_size, partition_key):
+    return [df1_to_match.iloc[chunk] for chunk in _roster_chunk_positions(df1_to_match, chunk_size, partition_key)]
+
+
+def _parallel_best_matches(df1_to_match, df2, min_score, workers, chunk_size, partition_key, block_index=None, top_n=1):
+    chunks = _roster_chunks(df1_to_match, chunk_size, partition_key)
+    logging.info(f" Matching {len(df1_to_match)} rows in {len(chunks)} chunks across {workers} workers.")
+
+    # Build the customer side of the blocking index once and ship it to every worker
+    if block_index is None:
+        block_index = build_block_index(df2)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(df2, block_index)) as pool:
+        results = list(pool.map(_score_chunk, chunks, [min_score] * len(chunks), [top_n] * len(chunks)))
+
+    return _combine_best(results, df1_to_match, top_n)
+
+
+def _chunked_best_matches(df1_to_match, df2, min_score, chunk_size, partition_key, block_index=None, top_n=1):
+    """
+    Serial low-memory version of _parallel_best_matches: one roster chunk's candidate pairs
+    exist at a time and only the winners of each chunk are kept.
+    """
+    if block_index is None:
+        block_index = build_block_index(df2)
+    results = []
+    for positions in _roster_chunk_positions(df1_to_match, chunk_size, partition_key):
+        best = score_best_matches(df1_to_match.iloc[positions], df2, min_score, block_index, top_n=top_n)
+        if best is not None and not best.empty:
+            results.append(best)
+    return _combine_best(results, df1_to_match, top_n)
 
-    candidate_links = indexer.index(df1_to_match, df2)
+
+def _score_exact(exact, df1_to_match, df2):
+    """Adds the per-field features of exact matches for reviewers; their TotalScore is EXACT_MATCH_SCORE."""
+    left = df1_to_match.index.get_indexer(exact['level_0'])
+    right = df2.index.get_indexer(exact['level_1'])
+    _, features, _ = score_pairs(left, right, df1_to_match, df2)
+    labels = [label for _, label in COMPARE_FIELDS]
+    return exact.assign(**dict(zip(labels, features.T.astype(float))), TotalScore=EXACT_MATCH_SCORE, Rank=0)
+
+
+def _runner_up_columns(runner_ups, df2):
+    """RUNNER_UP_COLUMNS per SourceID: the runner-ups' entity IDs, practice names and scores in rank order."""
+    rows = df2.index.get_indexer(runner_ups['level_1'])
+    parts = pd.DataFrame({
+        'SourceID': runner_ups['SourceID'].to_numpy(),
+        'RunnerUpEntityIDs': df2['MatchedEntityID'].take(rows).fillna('').astype(str).to_numpy(),
+        'RunnerUpPracticeNames': df2['Name'].take(rows).fillna('').astype(str).to_numpy(),
+        'RunnerUpScores': runner_ups['TotalScore'].astype(str).to_numpy(),
+    })
+    # Rows come grouped by SourceID in rank order (see _top_n)
+    return parts.groupby('SourceID', sort=False).agg('; '.join)
+
+
+def match_records_by_fields(df1, df2=None, min_score=2, workers=None, chunk_size=None, partition_key=None,
+                            customer_features=None, low_memory=None, top_n=None, exact_keys=None, confirmed=None,
+                            shared_keys=None):
+    """
+    Finds matching records between two DataFrames using fuzzy logic.
+    Compares Name, Emails, Address, and Doctors with Jaro-Winkler similarity.
+    Candidate pairs come from multi-key blocking (see blocking.candidate_pairs).
+    With workers > 1 the roster is split into chunks of whole blocks (partition_key, State by default)
+    and matched in a process pool; the output is the same for any worker count.
+    Pass customer_features (see customer_features.get_customer_features) instead of df2
+    to reuse already prepared customers and their block index.
+    low_memory (MATCH_LOW_MEMORY by default) matches serially in chunks of MATCH_LOW_MEMORY_CHUNK_ROWS
+    roster rows; the output is the same.
+    With top_n (MATCH_TOP_N by default) above 1, the next best candidates of each row are added
+    as RUNNER_UP_COLUMNS ('; '-separated, best first) for reviewers.
+    Rows that match a customer on one of exact_keys (EXACT_MATCH_KEYS by default; see exact_match.py,
+    confirmed is a Series of SourceID -> MatchedEntityID) skip fuzzy matching. They get TotalScore
+    EXACT_MATCH_SCORE, and MatchType says which key resolved each row ('fuzzy' for the rest).
+    When df1 is only part of a roster, pass the whole roster's shared_keys (see roster_fingerprints).
+    df1 and df2 are not modified.
+    """
+    workers = MATCH_WORKERS if workers is None else workers
+    chunk_size = MATCH_CHUNK_SIZE if chunk_size is None else chunk_size
+    partition_key = MATCH_PARTITION_KEY if partition_key is None else partition_key
+    low_memory = MATCH_LOW_MEMORY if low_memory is None else low_memory
+    top_n = MATCH_TOP_N if top_n is None else top_n
+    exact_keys = EXACT_MATCH_KEYS if exact_keys is None else exact_keys
+
+    if 'SourceID' not in df1.columns:
+        df1 = df1.copy()
+        df1['SourceID'] = df1.index.astype(str)
+
+    # Only read from here on; prepare_roster works on its own copy
+    original_df1 = df1
+    if low_memory:
+        df1 = df1[[c for c in dict.fromkeys(MATCH_COLUMNS + [partition_key]) if c in df1.columns]]
+
+    exact_index = None
+    if customer_features is not None:
+        df2, block_index = customer_features['customers'], customer_features['block_index']
+        exact_index = customer_features.get('exact_index')
+        with timed('normalize', rows=len(df1)):
+            df1_to_match = prepare_roster(df1)
+    else:
+        block_index = None
+        with timed('normalize', rows=len(df1) + len(df2)):
+            df1_to_match = prepare_roster(df1)
+            df2 = prepare_customers(df2)
+
+    logging.debug(f" Parsed columns: {list(df1_to_match.columns)}")
 
     empty_result_cols = {
         'MatchedName': 0.0, 'MatchedEmails': 0.0, 'MatchedAddress': 0.0,
         'MatchedDoctors': 0.0, 'TotalScore': 0.0, 'MatchedEntityID': '',
         'MatchedPracticeName': ''
     }
+    if top_n > 1:
+        empty_result_cols.update({col: '' for col in RUNNER_UP_COLUMNS})
+    if exact_keys:
+        empty_result_cols['MatchType'] = ''
 
-    if len(candidate_links) == 0:
-        print(" No candidate pairs found.")
-        for col, val in empty_result_cols.items():
-            original_df1[col] = val
-        return original_df1
+    # Exact-key fast path: resolved SourceIDs don't go through blocking and comparison
+    exact = None
+    if exact_keys:
+        with timed('exact_match', rows=len(df1_to_match)):
+            if exact_index is None:
+                exact_index = build_exact_index(df2)
+            exact = exact_matches(df1_to_match, df2, exact_index, confirmed, exact_keys, shared_keys)
+            if not exact.empty:
+                exact = _score_exact(exact, df1_to_match, df2)
+                df1_to_match = df1_to_match[~df1_to_match['SourceID'].isin(exact['SourceID'])]
+        logging.info(f" Exact keys resolved {len(exact)} of {len(exact) + df1_to_match['SourceID'].nunique()} SourceIDs.")
 
-    # Compare
-    compare = recordlinkage.Compare()
-    compare.string('Name', 'Name', method='jarowinkler', threshold=0.85, label='MatchedName')
-    compare.string('Emails', 'Emails', method='jarowinkler', threshold=0.85, label='MatchedEmails')
-    compare.string('Address', 'Address', method='jarowinkler', threshold=0.85, label='MatchedAddress')
-    compare.string('Doctors', 'Doctors', method='jarowinkler', threshold=0.85, label='MatchedDoctors')
+    if len(df1_to_match) == 0:
+        best_matches = None
+    elif low_memory:
+        best_matches = _chunked_best_matches(
+            df1_to_match, df2, min_score, MATCH_LOW_MEMORY_CHUNK_ROWS, partition_key, block_index, top_n
+        )
+    elif workers > 1 and len(df1_to_match) > chunk_size:
+        best_matches = _parallel_best_matches(
+            df1_to_match, df2, min_score, workers, chunk_size, partition_key, block_index, top_n
+        )
+    else:
+        best_matches = score_best_matches(df1_to_match, df2, min_score, block_index, top_n=top_n)
 
-    features = compare.compute(candidate_links, df1_to_match, df2)
+    if exact is not None and not exact.empty:
+        fuzzy = [] if best_matches is None or best_matches.empty else [best_matches.assign(MatchType='fuzzy')]
+        best_matches = pd.concat([exact] + fuzzy, ignore_index=True)
+    elif exact_keys and best_matches is not None and not best_matches.empty:
+        best_matches = best_matches.assign(MatchType='fuzzy')
 
-    matches = features[features.sum(axis=1) >= min_score].copy()
-    if matches.empty:
-        print(" No matches above threshold.")
-        for col, val in empty_result_cols.items():
-            original_df1[col] = val
-        return original_df1
+    if best_matches is None or best_matches.empty:
+        logging.info(" No candidate pairs found." if best_matches is None else " No matches above threshold.")
+        return original_df1.assign(**empty_result_cols)
 
-    matches['TotalScore'] = matches.sum(axis=1)
-    matches_df = matches.reset_index()
-    matches_df = matches_df.merge(df1_to_match[['SourceID']], left_on='level_0', right_index=True)
+    runner_ups = best_matches[best_matches['Rank'] > 0]
+    best_matches = best_matches[best_matches['Rank'] == 0]
 
     #  FIX: Properly map matched IDs and practice names
-    df2 = df2.reset_index(drop=True)
-    df2['level_1'] = df2.index
-    df2_subset = df2[['level_1', 'MatchedEntityID', 'Name']].rename(columns={'Name': 'MatchedPracticeName'})
-
-    best_matches = matches_df.loc[matches_df.groupby('SourceID')['TotalScore'].idxmax()]
-    best_matches_with_names = best_matches.merge(df2_subset, on='level_1', how='left')
+    # df2 may be the shared, memory-mapped customer features frame: read only the matched rows, don't touch it
+    rows = df2.index.get_indexer(best_matches['level_1'])
+    best_matches_with_names = best_matches.assign(
+        MatchedEntityID=df2['MatchedEntityID'].take(rows).to_numpy(),
+        MatchedPracticeName=df2['Name'].take(rows).to_numpy(),
+    )
 
     result_columns = [
         'SourceID', 'MatchedName', 'MatchedEmails', 'MatchedAddress',
         'MatchedDoctors', 'TotalScore', 'MatchedEntityID', 'MatchedPracticeName'
-    ]
+    ] + (['MatchType'] if exact_keys else [])
     match_results = best_matches_with_names[result_columns]
 
     final_df = pd.merge(original_df1, match_results, on='SourceID', how='left')
@@ -95,11 +392,14 @@ def match_records_by_fields(df1, df2, min_score=2):
     for col in ['MatchedName', 'MatchedEmails', 'MatchedAddress', 'MatchedDoctors', 'TotalScore']:
         final_df[col] = final_df[col].fillna(0.0).astype(float)
 
-    for col in ['MatchedEntityID', 'MatchedPracticeName']:
+    for col in ['MatchedEntityID', 'MatchedPracticeName'] + (['MatchType'] if exact_keys else []):
         final_df[col] = final_df[col].fillna('')
 
-    # Log top 5 for review
-    print(" Top 5 Matches:")
-    print(final_df[['SourceID', 'MatchedPracticeName', 'MatchedEntityID', 'TotalScore']].head())
+    if top_n > 1:
+        runner_up_columns = _runner_up_columns(runner_ups, df2)
+        for col in RUNNER_UP_COLUMNS:
+            final_df[col] = final_df['SourceID'].map(runner_up_columns[col]).fillna('')
+
+    logging.info(f" Matched {len(match_results)} of {len(original_df1)} roster rows to a customer.")
 
     return final_df
@@ -0,0 +1,187 @@
+import os
+import sys
+import time
+import bisect
+import resource
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Seconds; covers sub-millisecond lookups up to multi-minute matching runs
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# Seconds; for request paths that should answer in milliseconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+COUNT_BUCKETS = (10, 100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+MEMORY_BUCKETS = tuple(2 ** 20 * mb for mb in (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384))
+
+# How often track_peak_rss() samples the resident set size
+RSS_SAMPLE_SECONDS = 0.05
+
+_lock = threading.Lock()
+_metrics = {}  # name -> {'type', 'help', 'buckets', 'series': {labels: value or [bucket counts, sum, count]}}
+
+# Stage timings of the job running in this thread/context, if one is being collected
+_job_timings = ContextVar('job_timings', default=None)
+
+
+def _series(name, kind, help_text, buckets=None):
+    metric = _metrics.get(name)
+    if metric is None:
+        metric = _metrics[name] = {'type': kind, 'help': help_text, 'buckets': buckets, 'series': {}}
+    return metric['series']
+
+
+def inc(name, amount=1, help_text='', **labels):
+    """Adds amount to a counter."""
+    key = tuple(sorted(labels.items()))
+    with _lock:
+        series = _series(name, 'counter', help_text)
+        series[key] = series.get(key, 0) + amount
+
+
+def observe(name, value, help_text='', buckets=DURATION_BUCKETS, **labels):
+    """Records one value in a histogram."""
+    key = tuple(sorted(labels.items()))
+    i = bisect.bisect_left(buckets, value)
+    with _lock:
+        series = _series(name, 'histogram', help_text, buckets)
+        state = series.get(key)
+        if state is None:
+            state = series[key] = [[0] * len(buckets), 0.0, 0]
+        if i < len(buckets):
+            state[0][i] += 1
+        state[1] += value
+        state[2] += 1
+
+
+@contextmanager
+def timed(stage, rows=None):
+    """
+    Times a block as dso_stage_duration_seconds{stage}; rows (if known) go to dso_stage_rows_total.
+    Inside collect_job_timings() the timing is also added to the job's summary (repeats of a stage are summed).
+    Yields a dict; set 'rows' on it when the count is only known at the end.
+    """
+    info = {'rows': rows}
+    started = time.perf_counter()
+    try:
+        yield info
+    finally:
+        seconds = time.perf_counter() - started
+        observe('dso_stage_duration_seconds', seconds, 'Time spent per pipeline stage.', stage=stage)
+        if info['rows'] is not None:
+            inc('dso_stage_rows_total', info['rows'], 'Rows processed per pipeline stage.', stage=stage)
+        timings = _job_timings.get()
+        if timings is not None:
+            _add_job_timing(timings, stage, seconds, info['rows'])
+
+
+def _add_job_timing(timings, stage, seconds, rows):
+    # A stage that runs once per chunk is summed into one entry
+    for entry in timings:
+        if entry['stage'] == stage:
+            entry['seconds'] = round(entry['seconds'] + seconds, 3)
+            if rows is not None:
+                entry['rows'] = (entry['rows'] or 0) + rows
+            return
+    timings.append({'stage': stage, 'seconds': round(seconds, 3), 'rows': rows})
+
+
+@contextmanager
+def collect_job_timings():
+    """Collects the timed() stages run in this context into a list for the job's summary."""
+    timings = []
+    token = _job_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _job_timings.reset(token)
+
+
+def peak_rss_bytes():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _current_rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+@contextmanager
+def track_peak_rss():
+    """
+    Samples the resident set size while the block runs and yields a dict whose 'peak_bytes'
+    holds the highest value seen (the process high-water mark where /proc isn't available).
+    Other work running in the process at the same time is included.
+    """
+    info = {'peak_bytes': _current_rss_bytes()}
+    if info['peak_bytes'] is None:
+        try:
+            yield info
+        finally:
+            info['peak_bytes'] = peak_rss_bytes()
+        return
+
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(RSS_SAMPLE_SECONDS):
+            info['peak_bytes'] = max(info['peak_bytes'], _current_rss_bytes() or 0)
+
+    sampler = threading.Thread(target=sample, name='rss-sampler', daemon=True)
+    sampler.start()
+    try:
+        yield info
+    finally:
+        done.set()
+        sampler.join()
+        info['peak_bytes'] = max(info['peak_bytes'], _current_rss_bytes() or 0)
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def render_prometheus():
+    """All metrics of this process in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        snapshot = {
+            name: dict(m, series={k: (list(v[0]), v[1], v[2]) if m['type'] == 'histogram' else v for k, v in m['series'].items()})
+            for name, m in _metrics.items()
+        }
+
+    for name, metric in sorted(snapshot.items()):
+        if metric['help']:
+            lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for key, value in sorted(metric['series'].items()):
+            if metric['type'] == 'counter':
+                lines.append(f"{name}{_format_labels(key)} {value}")
+                continue
+            counts, total, n = value
+            cumulative = 0
+            for bound, count in zip(metric['buckets'], counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {n}")
+            lines.append(f"{name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{name}_count{_format_labels(key)} {n}")
+
+    lines.append("# HELP process_peak_rss_bytes Peak resident set size of this process.")
+    lines.append("# TYPE process_peak_rss_bytes gauge")
+    lines.append(f"process_peak_rss_bytes {peak_rss_bytes()}")
+    rss = _current_rss_bytes()
+    if rss is not None:
+        lines.append("# HELP process_resident_memory_bytes Resident set size of this process.")
+        lines.append("# TYPE process_resident_memory_bytes gauge")
+        lines.append(f"process_resident_memory_bytes {rss}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+from config import STATE_LOOKUP
+
+
+def _on_uniques(series, func):
+    """Applies func (Series -> Series) once per distinct value and broadcasts the result back."""
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    result = func(pd.Series(uniques, dtype=object))
+    return pd.Series(result.to_numpy(dtype=object)[codes], index=series.index)
+
+
+def clean_text(series):
+    """recordlinkage's clean() (lowercase, no brackets/punctuation, single spaces), computed on distinct values."""
+    # recordlinkage pulls in scikit-learn and scipy; importing it here keeps app start-up light
+    from recordlinkage.preprocessing import clean
+
+    return _on_uniques(series.astype(str).fillna(''), clean)
+
+
+def canonical_state(series):
+    """Maps full state names to abbreviations via STATE_LOOKUP; anything else is upper-cased."""
+    def lookup(states):
+        states = states.str.strip()
+        return states.str.lower().map(STATE_LOOKUP).fillna(states.str.upper())
+    return _on_uniques(series, lookup)
+
+
+def combine_emails(primary, additional):
+    """Joins two email columns with a comma, as the DSO mapping's Emails + AddEmail."""
+    return primary.astype(str) + ',' + additional.astype(str)
+
+
+def _dedupe_email_values(emails):
+    missing = emails.isna().to_numpy()
+    parts = emails[~missing].astype(str).str.split(',').explode().str.strip()
+    parts = parts[parts != '']
+    rows = parts.index.to_numpy()
+    values = parts.to_numpy(dtype=object)
+
+    # Sort by row, then address, so duplicates are adjacent and each row's addresses come out in order
+    order = np.lexsort((values.astype(str), rows))
+    rows, values = rows[order], values[order]
+    keep = np.ones(len(rows), dtype=bool)
+    keep[1:] = (rows[1:] != rows[:-1]) | (values[1:] != values[:-1])
+    rows, values = rows[keep], values[keep]
+
+    result = np.full(len(emails), '', dtype=object)
+    if len(rows):
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = rows[1:] != rows[:-1]
+        # Concatenate each row's addresses in one reduceat pass instead of a join per group
+        values = np.where(first, values, ',' + values)
+        result[rows[first]] = np.add.reduceat(values, np.flatnonzero(first))
+    result[missing] = None
+    return pd.Series(result)
+
+
+def dedupe_emails(emails):
+    """
+    Splits comma-separated emails, strips them, drops blanks and duplicates, and joins them back sorted.
+    Missing values stay None; rows with no addresses become ''.
+    """
+    return _on_uniques(emails, _dedupe_email_values)
+
+
+def zip_digits(zips):
+    """ZIP codes as digits only, with the leading zeros Excel drops put back (e.g. 2134 -> 02134)."""
+    digits = zips.astype(str).str.replace(r'\D', '', regex=True)
+    lengths = digits.str.len()
+    return digits.mask(lengths == 4, digits.str.zfill(5)).mask(lengths == 8, digits.str.zfill(9))
+
+
+def email_addresses(emails):
+    """The distinct email addresses in each value, lower-cased, sorted and comma-separated ('' when there are none)."""
+    def extract(values):
+        found = values.fillna('').astype(str).str.lower().str.findall(r'[a-z0-9._%+\-]+@[a-z0-9.\-]+\.[a-z]{2,}')
+        return found.map(lambda addresses: ','.join(sorted(set(addresses))))
+    return _on_uniques(emails, extract)
+
+
+def concat_doctors(df, columns):
+    """First and last name columns from Concat_Doctor joined into one Doctors value."""
+    return df[columns[0]].fillna('') + ' ' + df[columns[1]].fillna('')
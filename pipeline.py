@@ -0,0 +1,368 @@
+import json
+import time
+import hashlib
+import logging
+import pandas as pd
+from datetime import datetime
+from config import (
+    ROSTER_DIFF_MODE, ROSTER_DIFF_SNAPSHOT_SENSITIVE, MATCH_LOW_MEMORY, EXACT_MATCH_KEYS, EXACT_MATCH_SCORE,
+    CONFIRMED_MATCHES_TABLE, SAVE_MATCHED_RESULTS, BLOCKING_KEYS, BLOCKING_SN_WINDOW, COMMON_EMAIL_DOMAINS, MATCH_TOP_N,
+    RUNNER_UP_COLUMNS
+)
+from databricks_conn import (
+    upload_to_datalake, delete_matched_data_for_dso, merge_into_datalake, delete_matched_rows, count_matched_rows,
+    fetch_confirmed_matches, MATCHED_DATA_COLUMNS
+)
+from roster_diff import (
+    load_roster_state, save_roster_state, clear_roster_state, diff_roster, row_hashes,
+    mark_write_started, mark_write_finished, interrupted_write
+)
+from approved_index import approved_source_id_mask
+from match_logic import match_records_by_fields, compact_columns, roster_fingerprints
+from customer_features import get_customer_features, FEATURE_VERSION
+from compare_engine import COMPARE_FIELDS, JW_THRESHOLD
+from ingest import wait_for_prepared
+from prepared_store import touch, new_results_path, dataset_name, evict
+from metrics import timed, collect_job_timings, peak_rss_bytes, track_peak_rss, observe, inc, MEMORY_BUCKETS
+
+# Lowest feature sum a fuzzy match needs
+MIN_SCORE = 2
+# The results file keeps everything written to matched_data plus what the table may not have columns for
+RESULTS_COLUMNS = MATCHED_DATA_COLUMNS + [c for c in RUNNER_UP_COLUMNS + ['MatchType'] if c not in MATCHED_DATA_COLUMNS]
+
+
+def run_matching_pipeline(dso_name, original_filename, prepared_path, progress=None, customer_features=None):
+    """
+    Matches a prepared roster against the customer master and replaces the DSO's rows in matched_data.
+    original_filename and prepared_path may be lists, to match several files for the DSO in one run
+    and write them in one consolidated upload. customer_features is get_customer_features() output
+    when the caller already holds it. progress(stage) is called as each stage in job_stages.MATCHING_STAGES starts.
+    Returns the summary stats shown on the success page, including per-stage and per-file figures.
+    """
+    with collect_job_timings() as timings, track_peak_rss() as rss:
+        stats = _run_matching(
+            dso_name, original_filename, prepared_path, progress or (lambda stage: None), customer_features
+        )
+    observe('dso_job_peak_rss_bytes', rss['peak_bytes'], 'Peak resident set size while a matching job ran.', MEMORY_BUCKETS)
+    stats['timings'] = timings
+    stats['peak_rss_mb'] = round(rss['peak_bytes'] / 2 ** 20, 1)
+    stats['process_peak_rss_mb'] = round(peak_rss_bytes() / 2 ** 20, 1)
+    return stats
+
+
+def _as_list(value):
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def _read_prepared(filenames, prepared_paths):
+    """Reads each prepared file, tagging its rows with FileName. Returns (roster, {file: read seconds})."""
+    frames, read_seconds = [], {}
+    for filename, prepared_path in zip(filenames, prepared_paths):
+        started = time.perf_counter()
+        with timed('wait_for_upload'):
+            try:
+                wait_for_prepared(prepared_path)
+            except FileNotFoundError:
+                raise FileNotFoundError(f"Prepared data for '{filename}' is no longer available; upload the file again.")
+        with timed('read_prepared') as t:
+            frame = pd.read_parquet(prepared_path)
+            t['rows'] = len(frame)
+        touch(prepared_path)
+        frame['FileName'] = filename
+        frames.append(frame)
+        read_seconds[filename] = round(time.perf_counter() - started, 3)
+    df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+    return df, read_seconds
+
+
+def _file_stats(df, final_df, read_seconds):
+    """Rows read, already approved, uploaded and matched to a customer, per file in the run."""
+    uploaded = final_df[final_df['AlreadyApproved'] != True]
+    matched = uploaded[uploaded['MatchedEntityID'].fillna('').astype(str) != '']
+    counts = {
+        'rows': df['FileName'].value_counts(),
+        'approved': df.loc[df['AlreadyApproved'] == True, 'FileName'].value_counts(),
+        'uploaded': uploaded['FileName'].value_counts(),
+        'matched': matched['FileName'].value_counts(),
+    }
+    if 'MatchType' in matched.columns:
+        exact = matched[~matched['MatchType'].fillna('').isin(['', 'fuzzy'])]
+        counts['exact_matched'] = exact['FileName'].value_counts()
+    return [
+        {'file': filename, **{k: int(v.get(filename, 0)) for k, v in counts.items()}, 'read_seconds': seconds}
+        for filename, seconds in read_seconds.items()
+    ]
+
+
+def _run_matching(dso_name, original_filename, prepared_path, progress, customer_features=None):
+    filenames, prepared_paths = _as_list(original_filename), _as_list(prepared_path)
+    progress('read')
+    df, read_seconds = _read_prepared(filenames, prepared_paths)
+
+    if 'PracticeName' in df.columns:
+        df['Name'] = df['PracticeName']
+    if 'Addr1' in df.columns:
+        df['Address'] = df['Addr1']
+    df.drop(columns=['Addr1', 'PracticeName'], inplace=True, errors='ignore')
+
+    for col in ['Name', 'Address', 'State', 'Zip', 'Emails', 'Doctors', 'ExternalID', 'City']:
+        if col not in df.columns:
+            df[col] = ''
+
+    df['Source'] = dso_name
+    if MATCH_LOW_MEMORY:
+        compact_columns(df)
+
+    # Check for already approved SourceIDs and flag them instead of filtering
+    progress('approved')
+    initial_count = len(df)
+    approved_count = 0
+
+    # Add AlreadyApproved flag column
+    df['AlreadyApproved'] = False
+
+    if 'SourceID' in df.columns:
+        # Convert SourceID to string for comparison
+        df['SourceID'] = df['SourceID'].astype(str)
+
+        # Flag records that are already approved instead of filtering them out
+        with timed('approved_lookup', rows=len(df)):
+            df['AlreadyApproved'] = approved_source_id_mask(df['SourceID'])
+        approved_count = int(df['AlreadyApproved'].sum())
+
+        logging.info(f" Flagged {approved_count} already approved records.")
+
+    # Loaded before the diff: a stored result is only reused if the customers that could decide it are unchanged
+    progress('customers')
+    with timed('load_customers') as t:
+        if customer_features is None:
+            customer_features = get_customer_features()
+        t['rows'] = len(customer_features['customers'])
+        confirmed = _confirmed_matches(dso_name, df[df['AlreadyApproved'] == False])
+    signature = _matching_signature(customer_features)
+
+    # Diff mode: only rows that are new or changed since the DSO's last upload, or whose candidate
+    # customers changed since, are matched and written
+    fingerprints, shared_keys = None, None
+    if ROSTER_DIFF_MODE and 'SourceID' in df.columns and df['SourceID'].is_unique:
+        with timed('fingerprints', rows=len(df)):
+            fingerprints, shared_keys = roster_fingerprints(df[df['AlreadyApproved'] == False], customer_features, confirmed)
+            fingerprints = fingerprints.reindex(df.index, fill_value=0)
+    diff = _diff_against_previous(dso_name, df, signature, fingerprints)
+    # Only the SourceIDs, row hashes and fingerprints of the full upload are needed once matching starts
+    roster_state = None
+    if 'SourceID' in df.columns and df['SourceID'].is_unique:
+        roster_state = (df['SourceID'].copy(), diff['hashes'] if diff else row_hashes(df), fingerprints)
+    # What the per-file summary needs from the full upload
+    file_rows = df[['FileName', 'AlreadyApproved']].copy()
+    if diff is not None:
+        df = df[diff['process']]
+        logging.info(f" Incremental run for {dso_name}: {diff['counts']}.")
+
+    # Separate approved and non-approved records for matching.
+    # Boolean indexing already returns new frames and match_records_by_fields doesn't modify its input.
+    approved_records = df[df['AlreadyApproved'] == True]
+    records_to_match = df[df['AlreadyApproved'] == False]
+    del df
+
+    # If there are records to match, run the matching process
+    if not records_to_match.empty:
+        progress('matching')
+        with timed('matching', rows=len(records_to_match)):
+            matched_df = match_records_by_fields(
+                records_to_match, min_score=MIN_SCORE, customer_features=customer_features, confirmed=confirmed,
+                shared_keys=shared_keys
+            )
+    else:
+        # If no records to match, create empty matched dataframe with same structure
+        matched_df = records_to_match.copy()
+        # Add matching columns with default values
+        for col in ['MatchedName', 'MatchedEmails', 'MatchedAddress', 'MatchedDoctors', 'TotalScore', 'MatchedEntityID', 'MatchedPracticeName']:
+            matched_df[col] = 0.0 if col in ['MatchedName', 'MatchedEmails', 'MatchedAddress', 'MatchedDoctors', 'TotalScore'] else ''
+
+    del records_to_match
+
+    # For already approved records, set matching columns to indicate they're pre-approved
+    if not approved_records.empty:
+        approved_records = approved_records.assign(
+            **{col: 0.0 for col in ['MatchedName', 'MatchedEmails', 'MatchedAddress', 'MatchedDoctors', 'TotalScore']},
+            **{col: 'PRE-APPROVED' for col in ['MatchedEntityID', 'MatchedPracticeName']}
+        )
+
+    # Combine approved and matched records
+    if not approved_records.empty and not matched_df.empty:
+        final_df = pd.concat([matched_df, approved_records], ignore_index=True)
+    elif not approved_records.empty:
+        final_df = approved_records
+    else:
+        final_df = matched_df
+    del matched_df, approved_records
+
+    if final_df.columns.duplicated().any():
+        final_df = final_df.loc[:, ~final_df.columns.duplicated()]
+    final_df['UploadedDate'] = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+    processed_approved = int(final_df['AlreadyApproved'].sum()) if len(final_df) else 0
+    _write_matched_data(dso_name, final_df, diff, progress)
+    logging.info(f" Uploaded {len(final_df)} records to Databricks ({processed_approved} pre-approved, {len(final_df) - processed_approved} newly matched).")
+
+    if roster_state is not None:
+        source_ids, hashes, fingerprints = roster_state
+        save_roster_state(dso_name, source_ids, hashes, _matched_flags(source_ids, final_df), signature, fingerprints)
+    mark_write_finished(dso_name)
+    results = _save_results(final_df) if SAVE_MATCHED_RESULTS else None
+
+    stats = {
+        'total': initial_count,
+        'approved': approved_count,
+        'matched': len(final_df) - processed_approved,
+        'mode': 'incremental' if diff else 'full',
+    }
+    if 'MatchType' in final_df.columns:
+        stats.update(_exact_match_stats(final_df))
+    if diff:
+        stats.update(diff['counts'])
+    stats['files'] = _file_stats(file_rows, final_df, read_seconds)
+    if results:
+        stats['results'] = results
+    return stats
+
+
+def _write_matched_data(dso_name, final_df, diff, progress):
+    """
+    Replaces the DSO's rows in matched_data (full run) or applies the diff (incremental run).
+    Neither is atomic: the delete and each chunk are separate statements. The write is recorded as
+    started until the caller marks it finished, so a failure part-way forces the next run to be full.
+    """
+    mode = 'incremental' if diff else 'full'
+    mark_write_started(dso_name, mode, len(final_df))
+    try:
+        if diff is None:
+            # A failed full rewrite leaves matched_data out of step with the saved state, so drop it first
+            clear_roster_state(dso_name)
+            progress('delete')
+            with timed('delete'):
+                delete_matched_data_for_dso(dso_name)
+            progress('upload')
+            with timed('insert', rows=len(final_df)):
+                upload_to_datalake(final_df)
+        else:
+            progress('delete')
+            with timed('delete', rows=len(diff['removed'])):
+                delete_matched_rows(dso_name, diff['removed'])
+            progress('upload')
+            with timed('merge', rows=len(final_df)):
+                merge_into_datalake(final_df)
+    except Exception as e:
+        inc('dso_matched_data_write_failures_total', 1, 'matched_data writes that failed part-way.', mode=mode)
+        logging.error(f" {mode.capitalize()} write of matched_data for {dso_name} failed part-way; its rows may be incomplete: {e}")
+        raise RuntimeError(
+            f"Writing the matches for {dso_name} to Databricks failed part-way, so its matched data may be incomplete. "
+            f"The next upload for {dso_name} rewrites it in full. ({e})"
+        ) from e
+
+
+def _save_results(final_df):
+    """Writes the run's matched rows to the prepared-dataset store for the results page; returns their name."""
+    columns = [c for c in RESULTS_COLUMNS if c in final_df.columns]
+    path = new_results_path()
+    try:
+        with timed('save_results', rows=len(final_df)):
+            final_df[columns].to_parquet(path, index=False, row_group_size=50_000)
+    except Exception as e:
+        logging.warning(f" Couldn't save matched rows for the results page: {e}")
+        return None
+    evict()
+    return dataset_name(path)
+
+
+def _confirmed_matches(dso_name, records_to_match):
+    """Confirmed SourceID -> MatchedEntityID for the 'confirmed' exact key, or None when it isn't in use."""
+    if 'confirmed' not in EXACT_MATCH_KEYS or not CONFIRMED_MATCHES_TABLE or 'SourceID' not in records_to_match.columns:
+        return None
+    try:
+        return fetch_confirmed_matches(dso_name, records_to_match['SourceID'].unique())
+    except Exception as e:
+        logging.warning(f" Couldn't read confirmed matches for {dso_name}, matching without them: {e}")
+        return None
+
+
+def _exact_match_stats(final_df):
+    """How many of the matched rows the exact-key fast path resolved, per key and as a fraction."""
+    match_types = final_df.loc[final_df['AlreadyApproved'] != True, 'MatchType'].fillna('')
+    counts = match_types.value_counts()
+    exact = {t: int(n) for t, n in counts.items() if t not in ('', 'fuzzy')}
+    resolved = sum(exact.values())
+    for match_type, n in exact.items():
+        inc('dso_exact_match_rows_total', n, 'Roster rows resolved by the exact-key fast path.', match_type=match_type)
+    logging.info(f" Exact-key fast path resolved {resolved} of {len(match_types)} rows: {exact}.")
+    return {
+        'exact_matched': resolved,
+        'exact_fraction': round(resolved / len(match_types), 4) if len(match_types) else 0.0,
+        'exact_by_type': exact,
+    }
+
+
+def _matching_signature(customer_features):
+    """
+    Hash of the settings that decide the results besides the roster rows and customers: FEATURE_VERSION and
+    the blocking, comparison and exact-match settings. A diff is only valid against a state saved under the
+    same signature; any change re-matches the whole roster. Customer changes only re-match the rows they
+    could affect (see match_logic.roster_fingerprints), unless ROSTER_DIFF_SNAPSHOT_SENSITIVE adds the
+    customer snapshot here.
+    """
+    settings = {
+        'feature_version': FEATURE_VERSION,
+        'blocking_keys': list(BLOCKING_KEYS),
+        'common_email_domains': sorted(COMMON_EMAIL_DOMAINS),
+        'blocking_sn_window': BLOCKING_SN_WINDOW,
+        'compare_fields': COMPARE_FIELDS,
+        'jw_threshold': JW_THRESHOLD,
+        'min_score': MIN_SCORE,
+        'match_top_n': MATCH_TOP_N,
+        'exact_match_keys': list(EXACT_MATCH_KEYS),
+        'exact_match_score': EXACT_MATCH_SCORE,
+        'confirmed_matches_table': CONFIRMED_MATCHES_TABLE,
+        'matched_data_columns': MATCHED_DATA_COLUMNS,
+    }
+    if ROSTER_DIFF_SNAPSHOT_SENSITIVE:
+        settings['customer_features'] = customer_features.get('signature')
+    return hashlib.sha1(json.dumps(settings, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _matched_flags(source_ids, final_df):
+    """Whether each SourceID has a result. Rows missing from final_df were skipped by the diff because they had one."""
+    no_result = final_df['MatchedEntityID'].fillna('').astype(str) == ''
+    return ~source_ids.isin(final_df.loc[no_result, 'SourceID'].astype(str))
+
+
+def _diff_against_previous(dso_name, df, signature, fingerprints):
+    """
+    diff_roster() result against the DSO's last successful upload, or None when a full run is needed:
+    diff mode off, no usable SourceIDs, an unfinished earlier write, no saved state, a state saved under
+    another matching signature, or matched_data no longer matches that state.
+    """
+    if not ROSTER_DIFF_MODE or 'SourceID' not in df.columns:
+        return None
+    interrupted = interrupted_write(dso_name)
+    if interrupted is not None:
+        logging.warning(f" The last {interrupted.get('mode', '')} write of matched_data for {dso_name} didn't finish; running a full match.")
+        return None
+    if not df['SourceID'].is_unique:
+        logging.info(" SourceIDs are not unique in this upload; running a full match.")
+        return None
+    previous = load_roster_state(dso_name)
+    if previous is None:
+        return None
+    if previous['signature'] != signature:
+        logging.info(f" The matching settings changed since {dso_name}'s last upload; running a full match.")
+        return None
+    try:
+        stored = count_matched_rows(dso_name)
+    except Exception as e:
+        logging.warning(f" Couldn't count existing matched_data rows for {dso_name}, running a full match: {e}")
+        return None
+    if stored != len(previous['hashes']):
+        logging.info(f" matched_data has {stored} rows for {dso_name} but the last upload had {len(previous['hashes'])}; running a full match.")
+        return None
+    return diff_roster(df, previous, fingerprints)
@@ -0,0 +1,145 @@
+import os
+import re
+import json
+import uuid
+import time
+import hashlib
+import logging
+import threading
+from config import PREPARED_STORE_DIR, PREPARED_STORE_MAX_BYTES, PREPARED_WAIT_TIMEOUT_SECONDS
+
+# Bump when transform_chunk() or the Parquet layout written by ingest.py change
+PREPARED_FORMAT_VERSION = 1
+
+_evict_lock = threading.Lock()
+
+
+def config_version(config_entry, dso_name):
+    """Hash of everything in the dso_config row (and the DSO name) that shapes the prepared data."""
+    payload = json.dumps({'dso': dso_name, 'config': config_entry}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def dataset_key(content_hash, config_entry, dso_name):
+    """Store key for a workbook's contents prepared with this DSO config."""
+    return f"{content_hash[:32]}-{config_version(config_entry, dso_name)}-v{PREPARED_FORMAT_VERSION}"
+
+
+def dataset_path(key):
+    return os.path.join(PREPARED_STORE_DIR, f"{key}.parquet")
+
+
+def new_results_path():
+    """Path for one matching run's matched rows; stored (and evicted) alongside the prepared datasets."""
+    os.makedirs(PREPARED_STORE_DIR, exist_ok=True)
+    return dataset_path(f"matched-{uuid.uuid4().hex}")
+
+
+def dataset_name(path):
+    """The name a dataset is served under by the data views (its key, or 'matched-...' for results)."""
+    return os.path.basename(path)[:-len('.parquet')]
+
+
+def resolve(name):
+    """Path of the stored dataset called name, or None if the name is malformed or the dataset isn't there."""
+    if not re.fullmatch(r'[A-Za-z0-9\-]+', name or ''):
+        return None
+    path = dataset_path(name)
+    return path if os.path.exists(path) else None
+
+
+def is_pending(name):
+    """True while an upload called name is still being written to the store."""
+    return bool(re.fullmatch(r'[A-Za-z0-9\-]+', name or '')) and os.path.exists(f"{dataset_path(name)}.pending")
+
+
+def touch(path):
+    """Marks a dataset as just used; eviction removes the least recently used first."""
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+
+def _pending_is_stale(pending_path):
+    try:
+        with open(pending_path) as f:
+            pid = int(f.read().strip() or 0)
+        age = time.time() - os.path.getmtime(pending_path)
+    except (OSError, ValueError):
+        return True
+    if age > PREPARED_WAIT_TIMEOUT_SECONDS:
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def claim(path):
+    """
+    Claims the right to write the dataset at path by creating its .pending marker (holding our PID).
+    Returns False if it is already stored or another process is writing it.
+    A marker left by a dead process, or older than PREPARED_WAIT_TIMEOUT_SECONDS, is taken over,
+    and an .error marker from an earlier failed attempt is cleared.
+    """
+    os.makedirs(PREPARED_STORE_DIR, exist_ok=True)
+    pending_path = f"{path}.pending"
+    for _ in range(2):
+        if os.path.exists(path):
+            return False
+        try:
+            fd = os.open(pending_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not _pending_is_stale(pending_path):
+                return False
+            logging.warning(f" Taking over stale ingestion of {path}")
+            try:
+                os.remove(pending_path)
+            except FileNotFoundError:
+                pass
+            continue
+        with os.fdopen(fd, 'w') as f:
+            f.write(str(os.getpid()))
+        if os.path.exists(f"{path}.error"):
+            os.remove(f"{path}.error")
+        return True
+    return False
+
+
+def evict(max_bytes=None):
+    """Removes the least recently used datasets until the store holds at most max_bytes (PREPARED_STORE_MAX_BYTES)."""
+    max_bytes = PREPARED_STORE_MAX_BYTES if max_bytes is None else max_bytes
+    with _evict_lock:
+        try:
+            names = os.listdir(PREPARED_STORE_DIR)
+        except FileNotFoundError:
+            return 0
+        datasets = []
+        for name in names:
+            if not name.endswith('.parquet'):
+                continue
+            try:
+                st = os.stat(os.path.join(PREPARED_STORE_DIR, name))
+            except FileNotFoundError:
+                continue
+            datasets.append((st.st_mtime, st.st_size, name))
+
+        total = sum(size for _, size, _ in datasets)
+        removed = 0
+        # The most recently used dataset always stays, even if it alone is over the limit
+        for _, size, name in sorted(datasets)[:-1]:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(os.path.join(PREPARED_STORE_DIR, name))
+            except FileNotFoundError:
+                continue
+            total -= size
+            removed += 1
+        if removed:
+            logging.info(f" Evicted {removed} prepared dataset(s); store now holds {total / 2 ** 20:.1f} MB.")
+        return removed
@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from config import ROSTER_STATE_DIR
+
+# Set per upload rather than per row, so they don't count as a change
+UNHASHED_COLUMNS = ['FileName', 'UploadedDate']
+
+
+def row_hashes(df):
+    """64-bit hash of each row's values (columns in sorted order), indexed like df."""
+    columns = sorted(c for c in df.columns if c not in UNHASHED_COLUMNS)
+    return pd.util.hash_pandas_object(df[columns].astype(str), index=False)
+
+
+def _state_path(dso_name):
+    key = hashlib.sha1(dso_name.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(ROSTER_STATE_DIR, f"{key}.parquet")
+
+
+def load_roster_state(dso_name):
+    """
+    The DSO's last successful upload as {'hashes': SourceID -> row hash, 'matched': SourceID -> whether
+    the row got a result, 'fingerprints': SourceID -> the roster_fingerprints() value its result came from,
+    'signature': the matching signature its results came from}, or None if there isn't one.
+    States saved before signatures were recorded have signature None, so they never pass for current;
+    states saved before fingerprints were recorded have fingerprints None.
+    """
+    path = _state_path(dso_name)
+    if not os.path.exists(path):
+        return None
+    try:
+        table = pq.read_table(path)
+    except Exception as e:
+        logging.warning(f" Unreadable roster state for {dso_name}, running a full match: {e}")
+        return None
+    state = table.to_pandas()
+    signature = (table.schema.metadata or {}).get(b'signature')
+    index = pd.Index(state['SourceID'])
+    return {
+        'hashes': pd.Series(state['RowHash'].to_numpy(), index=index),
+        'matched': pd.Series(state['Matched'].to_numpy(), index=index) if 'Matched' in state.columns else None,
+        'fingerprints': pd.Series(state['Fingerprint'].to_numpy(), index=index) if 'Fingerprint' in state.columns else None,
+        'signature': signature.decode('utf-8') if signature else None,
+    }
+
+
+def save_roster_state(dso_name, source_ids, hashes, matched, signature, fingerprints=None):
+    """
+    Records the upload that was just written so the next one can be diffed against it.
+    matched flags the rows that got a result; signature identifies the matching config the results came from
+    (see pipeline._matching_signature) and fingerprints, when diff mode computed them, the rows'
+    roster_fingerprints() (the customers that could decide each row).
+    """
+    os.makedirs(ROSTER_STATE_DIR, exist_ok=True)
+    path = _state_path(dso_name)
+    tmp_path = f"{path}.tmp"
+    state = pd.DataFrame({'SourceID': source_ids.to_numpy(), 'RowHash': hashes.to_numpy(), 'Matched': matched.to_numpy(dtype=bool)})
+    if fingerprints is not None:
+        state['Fingerprint'] = fingerprints.to_numpy(dtype=np.uint64)
+    table = pa.Table.from_pandas(state, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'signature': signature.encode('utf-8')})
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def clear_roster_state(dso_name):
+    path = _state_path(dso_name)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _pending_path(dso_name):
+    return _state_path(dso_name).replace('.parquet', '.pending')
+
+
+def mark_write_started(dso_name, mode, rows):
+    """
+    Records that matched_data is about to be written for the DSO. The delete and the chunked writes
+    are separate statements, so until mark_write_finished() the DSO's rows may be only partly written.
+    """
+    os.makedirs(ROSTER_STATE_DIR, exist_ok=True)
+    with open(_pending_path(dso_name), 'w') as f:
+        json.dump({'dso': dso_name, 'mode': mode, 'rows': rows, 'started_at': time.time()}, f)
+
+
+def mark_write_finished(dso_name):
+    path = _pending_path(dso_name)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def interrupted_write(dso_name):
+    """The mark_write_started() record of a write that never finished, or None."""
+    path = _pending_path(dso_name)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'dso': dso_name}
+
+
+def diff_roster(df, previous, fingerprints=None):
+    """
+    Compares an upload against the previous state (from load_roster_state).
+    Returns the row hashes, a boolean mask of rows to process (new, changed, unchanged but without a
+    result last time, or unchanged but with a different fingerprint, i.e. one of the customers that
+    could decide the row was added, changed or removed), the previous Matched flag of each row,
+    the SourceIDs that disappeared, and new/changed/rematched/customers_changed/unchanged/removed counts.
+    fingerprints (indexed like df) are left out of the comparison when not given.
+    """
+    hashes = row_hashes(df)
+    source_ids = df['SourceID']
+    previous_hashes = previous['hashes']
+    # Positions rather than reindex: a reindex with missing labels would turn the uint64 hashes into floats
+    positions = previous_hashes.index.get_indexer(source_ids.to_numpy())
+    is_new = positions < 0
+    same_hash = ~is_new
+    same_hash[~is_new] = previous_hashes.to_numpy()[positions[~is_new]] == hashes.to_numpy()[~is_new]
+    was_matched = np.zeros(len(df), dtype=bool)
+    if previous['matched'] is not None:
+        was_matched[~is_new] = previous['matched'].to_numpy(dtype=bool)[positions[~is_new]]
+    same_customers = np.ones(len(df), dtype=bool)
+    if fingerprints is not None:
+        same_customers[:] = False
+        if previous['fingerprints'] is not None:
+            previous_fingerprints = previous['fingerprints'].to_numpy(dtype=np.uint64)[positions[~is_new]]
+            same_customers[~is_new] = previous_fingerprints == fingerprints.to_numpy(dtype=np.uint64)[~is_new]
+    unchanged = same_hash & was_matched & same_customers
+    removed = previous_hashes.index.difference(pd.Index(source_ids))
+    return {
+        'hashes': hashes,
+        'process': pd.Series(~unchanged, index=df.index),
+        'matched': pd.Series(was_matched, index=df.index),
+        'removed': list(removed),
+        'counts': {
+            'new': int(is_new.sum()),
+            'changed': int((~is_new & ~same_hash).sum()),
+            'rematched': int((same_hash & ~was_matched).sum()),
+            'customers_changed': int((same_hash & was_matched & ~same_customers).sum()),
+            'unchanged': int(unchanged.sum()),
+            'removed': len(removed),
+        },
+    }
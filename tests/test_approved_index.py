@@ -0,0 +1,52 @@
+import pandas as pd
+import pytest
+
+import approved_index
+
+
+@pytest.fixture
+def warehouse(monkeypatch):
+    """approved_dso as a mutable set; fetch_approved_source_ids reads it unless `down` is set."""
+    state = {'approved': {'1', '2', '3'}, 'down': False}
+
+    def fetch(source_ids=None, modified_since=None, with_watermark=False):
+        if state['down']:
+            raise ConnectionError('warehouse unavailable')
+        ids = sorted(state['approved'] if source_ids is None else state['approved'] & set(source_ids))
+        return pd.DataFrame({'source_id': ids, 'modified': '2026-01-01'})
+
+    monkeypatch.setattr(approved_index, 'fetch_approved_source_ids', fetch)
+    monkeypatch.setattr(approved_index, '_index', approved_index.ApprovedIndex())
+    return state
+
+
+def test_pushdown_reflects_revocations(warehouse, monkeypatch):
+    monkeypatch.setattr(approved_index, 'APPROVED_INDEX_MODE', 'pushdown')
+    assert approved_index.approved_source_id_mask(['1', '2', '9']).tolist() == [True, True, False]
+
+    warehouse['approved'].discard('2')
+    assert approved_index.approved_source_id_mask(['1', '2', '9']).tolist() == [True, False, False]
+
+
+def test_pushdown_raises_instead_of_using_a_stale_answer(warehouse, monkeypatch):
+    monkeypatch.setattr(approved_index, 'APPROVED_INDEX_MODE', 'pushdown')
+    approved_index.approved_source_id_mask(['1', '2'])
+
+    warehouse['approved'].discard('2')
+    warehouse['down'] = True
+    with pytest.raises(ConnectionError):
+        approved_index.approved_source_id_mask(['1', '2'])
+
+
+def test_resident_full_reload_drops_revoked_ids(warehouse, monkeypatch):
+    monkeypatch.setattr(approved_index, 'APPROVED_INDEX_MODE', 'resident')
+    monkeypatch.setattr(approved_index, 'APPROVED_WATERMARK_COLUMN', 'modified')
+    monkeypatch.setattr(approved_index, 'APPROVED_FULL_RELOAD_SECONDS', 0)
+    assert approved_index.approved_source_id_mask(['2', '3']).tolist() == [True, True]
+
+    warehouse['approved'].discard('2')
+    assert approved_index.approved_source_id_mask(['2', '3']).tolist() == [False, True]
+
+    # A failed refresh keeps answering from the last full reload
+    warehouse['down'] = True
+    assert approved_index.approved_source_id_mask(['2', '3']).tolist() == [False, True]
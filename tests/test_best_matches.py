@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.generate import make_customers
+from blocking import build_block_index, candidate_pairs
+from compare_engine import compare_candidates
+from match_logic import _reduce_best, prepare_customers, prepare_roster, score_best_matches
+
+COLUMNS = ['level_0', 'level_1', 'SourceID', 'MatchedName', 'MatchedEmails', 'MatchedAddress', 'MatchedDoctors',
+           'TotalScore', 'Rank']
+
+
+@pytest.fixture(scope='module')
+def prepared():
+    customers = make_customers(2000, seed=5)
+    # Repeat some customers under new IDs so several candidates tie on score
+    copies = customers.iloc[:150].assign(MatchedEntityID=lambda df: df['MatchedEntityID'] + '-copy')
+    customers = pd.concat([customers, copies], ignore_index=True)
+
+    rng = np.random.default_rng(5)
+    roster = customers.iloc[rng.integers(0, 2000, 300)][['Name', 'Address', 'State', 'Zip', 'Emails', 'Doctors']]
+    roster = roster.reset_index(drop=True)
+    for col in ['Name', 'Address', 'Emails']:
+        typo = rng.random(len(roster)) < 0.4
+        roster.loc[typo, col] = roster.loc[typo, col].str[1:]
+    roster['SourceID'] = [f"LOC-{i}" for i in range(len(roster))]
+    # A few SourceIDs span two roster rows, which compete for the same top_n
+    roster.loc[250:, 'SourceID'] = roster.loc[200:249, 'SourceID'].to_numpy()
+
+    df1, df2 = prepare_roster(roster), prepare_customers(customers)
+    return df1, df2, build_block_index(df2)
+
+
+def _brute_force(df1, df2, block_index, min_score, top_n):
+    """Every candidate pair scored at once, then reduced; the path score_best_matches replaced."""
+    matches = compare_candidates(candidate_pairs(df1, df2, block_index=block_index), df1, df2)
+    matches['TotalScore'] = matches.sum(axis=1)
+    matches = matches[matches['TotalScore'] >= min_score]
+    matches = matches.reset_index().merge(df1[['SourceID']], left_on='level_0', right_index=True)
+    return _reduce_best(matches, df1.index.get_indexer(matches['level_0']), top_n)
+
+
+def _sorted(best):
+    return best[COLUMNS].sort_values(['SourceID', 'Rank']).reset_index(drop=True)
+
+
+@pytest.mark.parametrize('min_score', [1, 2, 3])
+@pytest.mark.parametrize('top_n', [1, 3])
+@pytest.mark.parametrize('pair_batch', [97, 1_000_000])
+def test_same_top_n_as_scoring_every_pair(prepared, min_score, top_n, pair_batch):
+    df1, df2, block_index = prepared
+    expected = _brute_force(df1, df2, block_index, min_score, top_n)
+    result = score_best_matches(df1, df2, min_score, block_index, pair_batch=pair_batch, top_n=top_n)
+
+    pd.testing.assert_frame_equal(_sorted(result), _sorted(expected), check_dtype=False)
+    assert (result['TotalScore'] >= min_score).all()
+
+
+def test_fixture_has_ties_and_pruned_pairs(prepared):
+    df1, df2, block_index = prepared
+    everything = _brute_force(df1, df2, block_index, min_score=0, top_n=1000)
+    tied = everything[everything['Rank'] < 2].groupby('SourceID')['TotalScore'].agg(lambda s: s.nunique() == 1 and len(s) == 2)
+    assert tied.sum() > 10
+    assert (everything['TotalScore'] < 2).sum() > 0
@@ -0,0 +1,119 @@
+import sqlite3
+from contextlib import contextmanager
+
+import pandas as pd
+import pytest
+
+from bulk_writer import SQLITE_MAX_PARAMS, SQLBackend, bulk_insert, bulk_merge
+
+COLUMNS = ['Source', 'SourceID', 'Name', 'TotalScore']
+KEYS = ['Source', 'SourceID']
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / 'matched.sqlite3')
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE matched_data (Source TEXT, SourceID TEXT, Name TEXT, TotalScore REAL)")
+        conn.execute("CREATE UNIQUE INDEX matched_data_key ON matched_data (Source, SourceID)")
+
+    @contextmanager
+    def connection():
+        conn = sqlite3.connect(path)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    return connection
+
+
+def _frame(n, start=0, name='practice'):
+    return pd.DataFrame({
+        'Source': 'dso',
+        'SourceID': [str(i) for i in range(start, start + n)],
+        'Name': [f"{name} {i}" if i % 7 else None for i in range(start, start + n)],
+        'TotalScore': [float(i % 5) for i in range(start, start + n)],
+    })
+
+
+def _rows(connection):
+    with connection() as conn:
+        return pd.read_sql_query("SELECT * FROM matched_data ORDER BY CAST(SourceID AS INTEGER)", conn)
+
+
+@pytest.mark.parametrize('paramstyle', ['named', 'qmark'])
+@pytest.mark.parametrize('concurrency', [1, 3])
+def test_bulk_insert_writes_every_row(database, paramstyle, concurrency):
+    backend = SQLBackend(database, 'matched_data', paramstyle=paramstyle, dialect='sqlite')
+    df = _frame(103)
+
+    summary = bulk_insert(df, COLUMNS, backend, chunk_rows=10, concurrency=concurrency)
+
+    assert summary['rows'] == 103
+    assert summary['chunks'] == 11
+    assert summary['bytes_sent'] > 0
+    pd.testing.assert_frame_equal(_rows(database), df, check_dtype=False)
+
+
+@pytest.mark.parametrize('paramstyle', ['named', 'qmark'])
+def test_bulk_insert_writes_missing_columns_as_null(database, paramstyle):
+    backend = SQLBackend(database, 'matched_data', paramstyle=paramstyle, dialect='sqlite')
+    bulk_insert(_frame(5).drop(columns=['Name']), COLUMNS, backend)
+    assert _rows(database)['Name'].isna().all()
+
+
+@pytest.mark.parametrize('paramstyle', ['named', 'qmark'])
+def test_bulk_merge_updates_existing_and_inserts_new_rows(database, paramstyle):
+    backend = SQLBackend(database, 'matched_data', paramstyle=paramstyle, dialect='sqlite')
+    bulk_insert(_frame(50), COLUMNS, backend, chunk_rows=20)
+
+    changes = _frame(40, start=30, name='renamed')
+    summary = bulk_merge(changes, COLUMNS, KEYS, backend, chunk_rows=15)
+
+    assert summary['rows'] == 40
+    expected = pd.concat([_frame(30), changes], ignore_index=True)
+    pd.testing.assert_frame_equal(_rows(database), expected, check_dtype=False)
+
+
+def test_empty_frame_writes_nothing(database):
+    backend = SQLBackend(database, 'matched_data', paramstyle='qmark', dialect='sqlite')
+    summary = bulk_insert(_frame(0), COLUMNS, backend)
+    assert summary['rows'] == 0 and summary['chunks'] == 0
+    assert _rows(database).empty
+
+
+@pytest.mark.parametrize('paramstyle', ['named', 'qmark'])
+def test_chunks_stay_under_the_parameter_cap(database, paramstyle):
+    executed = []
+    backend = SQLBackend(database, 'matched_data', paramstyle=paramstyle, dialect='sqlite', max_params=10)
+    execute = backend.execute
+    backend.execute = lambda query, params: executed.append(len(params)) or execute(query, params)
+
+    summary = bulk_insert(_frame(9), COLUMNS, backend, chunk_rows=250)
+
+    # 4 columns under a cap of 10 parameters leaves 2 rows per statement
+    assert summary['chunks'] == 5
+    assert max(executed) <= 10
+    assert len(_rows(database)) == 9
+
+
+def test_uncapped_backend_chunks_at_bulk_insert_chunk_rows():
+    executed = []
+    backend = SQLBackend(None, 'matched_data')
+    backend.execute = lambda query, params: executed.append(len(params))
+    columns = [f"col{i}" for i in range(19)]
+
+    summary = bulk_insert(pd.DataFrame({col: range(600) for col in columns}), columns, backend, concurrency=1)
+
+    # Databricks has no SQLite-style parameter cap, so 600 rows go out as 250 + 250 + 100
+    assert backend.max_params is None
+    assert summary['chunks'] == 3
+    assert executed == [250 * 19, 250 * 19, 100 * 19]
+
+
+def test_sqlite_cap_shrinks_chunks(database):
+    backend = SQLBackend(database, 'matched_data', paramstyle='qmark', dialect='sqlite', max_params=SQLITE_MAX_PARAMS)
+    summary = bulk_insert(_frame(600), COLUMNS, backend, chunk_rows=600, concurrency=1)
+    assert summary['chunks'] == 3
+    assert len(_rows(database)) == 600
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from compare_engine import COMPARE_FIELDS, JW_THRESHOLD, compare_candidates, score_pairs
+
+recordlinkage = pytest.importorskip('recordlinkage')
+pa = pytest.importorskip('pyarrow')
+
+WORDS = ['smile', 'smiles', 'dental', 'dentl', 'care', 'bright', 'brite', 'oak', 'oaks', 'main', 'st', 'street', 'dr', 'john', 'jon', 'smith', 'smyth', '']
+
+
+def _frame(n, seed):
+    rng = np.random.default_rng(seed)
+
+    def text():
+        return ' '.join(rng.choice(WORDS, size=rng.integers(1, 4))).strip()
+
+    df = pd.DataFrame({col: [text() for _ in range(n)] for col, _ in COMPARE_FIELDS})
+    # Missing values must score 0, like recordlinkage's missing_value default
+    for col, _ in COMPARE_FIELDS:
+        df.loc[rng.random(n) < 0.1, col] = None
+    return df
+
+
+def _baseline(links, df1, df2):
+    compare = recordlinkage.Compare()
+    for col, label in COMPARE_FIELDS:
+        compare.string(col, col, method='jarowinkler', threshold=JW_THRESHOLD, label=label)
+    return compare.compute(links, df1, df2)
+
+
+@pytest.fixture
+def frames():
+    df1 = _frame(60, 1)
+    df2 = _frame(80, 2)
+    df2.index = df2.index + 1000
+    links = pd.MultiIndex.from_product([df1.index, df2.index])
+    return df1, df2, links
+
+
+def test_compare_candidates_matches_recordlinkage(frames):
+    df1, df2, links = frames
+    expected = _baseline(links, df1, df2)
+    result = compare_candidates(links, df1, df2)
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False, check_names=False)
+
+
+def test_score_pairs_min_score_keeps_only_pairs_reaching_it(frames):
+    df1, df2, links = frames
+    expected = _baseline(links, df1, df2)
+    expected_total = expected.sum(axis=1).to_numpy()
+
+    left_pos = df1.index.get_indexer(links.get_level_values(0))
+    right_pos = df2.index.get_indexer(links.get_level_values(1))
+    for min_score in (1, 2, 3):
+        keep, features, total = score_pairs(left_pos, right_pos, df1, df2, min_score=min_score)
+        np.testing.assert_array_equal(keep, np.flatnonzero(expected_total >= min_score))
+        np.testing.assert_array_equal(features, expected.to_numpy()[keep])
+        np.testing.assert_array_equal(total, expected_total[keep])
+
+
+def test_score_pairs_on_arrow_backed_customer_columns(frames):
+    df1, df2, links = frames
+    expected = _baseline(links, df1, df2)
+    arrow = df2.astype(pd.ArrowDtype(pa.string()))
+
+    left_pos = df1.index.get_indexer(links.get_level_values(0))
+    right_pos = df2.index.get_indexer(links.get_level_values(1))
+    _, features, _ = score_pairs(left_pos, right_pos, df1, arrow)
+    np.testing.assert_array_equal(features, expected.to_numpy())
@@ -0,0 +1,67 @@
+import os
+import multiprocessing
+
+import pandas as pd
+import pytest
+
+import customer_snapshot
+
+
+@pytest.fixture
+def snapshot_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(customer_snapshot, 'CUSTOMER_SNAPSHOT_DIR', str(tmp_path))
+    monkeypatch.setattr(customer_snapshot, '_cache', {'mtime': None, 'df': None, 'meta': None})
+    return tmp_path
+
+
+def _customers(tag, n=200):
+    return pd.DataFrame({
+        'Name': [f"{tag} practice {i}" for i in range(n)],
+        'MatchedEntityID': [f"{tag}-{i}" for i in range(n)],
+    })
+
+
+def _refresh_repeatedly(tag):
+    customer_snapshot.get_customer_data = lambda modified_since=None: _customers(tag)
+    for _ in range(10):
+        customer_snapshot.refresh_customer_snapshot(full=True)
+
+
+def test_rows_and_meta_are_published_together(snapshot_dir):
+    customers = _customers('a')
+    customer_snapshot._write_snapshot(customers, {'rows': len(customers), 'content_hash': 'abc'})
+
+    df, meta = customer_snapshot._read_snapshot()
+    pd.testing.assert_frame_equal(df, customers)
+    assert meta == customer_snapshot.load_snapshot_meta() == {'rows': len(customers), 'content_hash': 'abc'}
+    assert os.listdir(snapshot_dir) == [customer_snapshot.SNAPSHOT_FILE]
+
+
+def test_no_snapshot_has_empty_meta(snapshot_dir):
+    assert customer_snapshot.load_snapshot_meta() == {}
+
+
+def test_fresh_snapshot_is_not_refreshed_again(snapshot_dir, monkeypatch):
+    calls = []
+    monkeypatch.setattr(customer_snapshot, 'get_customer_data', lambda modified_since=None: calls.append(1) or _customers('a'))
+    first = customer_snapshot.refresh_customer_snapshot(max_age=60)
+    second = customer_snapshot.refresh_customer_snapshot(max_age=60)
+    assert len(calls) == 1
+    assert first == second
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason='needs fork')
+def test_concurrent_refreshes_keep_meta_consistent_with_rows(snapshot_dir):
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=_refresh_repeatedly, args=(tag,)) for tag in 'abcd']
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+    df, meta = customer_snapshot._read_snapshot()
+    assert meta['content_hash'] == customer_snapshot._content_hash(df)
+    assert meta['rows'] == len(df)
+    # No temp files or half-published snapshots left behind
+    assert sorted(os.listdir(snapshot_dir)) == sorted([customer_snapshot.SNAPSHOT_FILE, customer_snapshot.REFRESH_LOCK_FILE])
@@ -0,0 +1,188 @@
+import threading
+
+import pytest
+
+import db_pool
+from db_pool import ConnectionPool, PoolTimeout
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, query, params=None):
+        if self.conn.dead:
+            raise ConnectionError('connection reset')
+        self.conn.queries.append(query)
+
+    def fetchall(self):
+        return [(1,)]
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, number):
+        self.number = number
+        self.dead = False
+        self.closed = False
+        self.queries = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        self.closed = True
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(db_pool.time, 'monotonic', clock)
+    return clock
+
+
+def _pool(**kwargs):
+    created = []
+
+    def factory():
+        created.append(FakeConnection(len(created)))
+        return created[-1]
+
+    return ConnectionPool(factory, **kwargs), created
+
+
+def test_released_connection_is_reused(clock):
+    pool, created = _pool(size=2)
+    conn = pool.acquire()
+    pool.release(conn)
+    assert pool.acquire() is conn
+    assert len(created) == 1
+    stats = pool.stats()
+    assert (stats['hits'], stats['misses'], stats['open'], stats['in_use']) == (1, 1, 1, 1)
+
+
+def test_acquire_times_out_when_every_connection_is_in_use():
+    pool, _ = _pool(size=1, wait_timeout=0.05)
+    pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+
+
+def test_waiting_acquire_gets_the_released_connection():
+    pool, created = _pool(size=1, wait_timeout=5)
+    conn = pool.acquire()
+    releaser = threading.Timer(0.05, pool.release, [conn])
+    releaser.start()
+    assert pool.acquire() is conn
+    releaser.join()
+    assert len(created) == 1
+    assert pool.stats()['waits'] == 1
+
+
+def test_idle_connections_are_evicted(clock):
+    pool, created = _pool(size=2, max_idle_seconds=300)
+    first = pool.acquire()
+    pool.release(first)
+    clock.now += 301
+
+    second = pool.acquire()
+    assert second is not first
+    assert first.closed
+    stats = pool.stats()
+    assert (stats['closed'], stats['open'], stats['created']) == (1, 1, 2)
+
+
+def test_stale_connection_is_health_checked_and_replaced(clock):
+    pool, created = _pool(size=1, health_check_after=30)
+    first = pool.acquire()
+    pool.release(first)
+
+    # Reused without a check while it's recent
+    clock.now += 10
+    assert pool.acquire() is first
+    assert first.queries == []
+    pool.release(first)
+
+    first.dead = True
+    clock.now += 60
+    second = pool.acquire()
+    assert second is not first and first.closed
+    stats = pool.stats()
+    assert (stats['failed_health_checks'], stats['reconnects'], stats['open']) == (1, 1, 1)
+
+
+def test_broken_connection_is_discarded_by_connection_block(clock):
+    pool, created = _pool(size=1)
+    with pytest.raises(ConnectionError):
+        with pool.connection() as conn:
+            conn.dead = True
+            conn.cursor().execute("SELECT 2")
+    assert conn.closed
+    assert pool.stats()['open'] == 0
+    with pool.connection() as conn:
+        assert conn is created[1]
+
+
+def test_run_retries_once_on_a_fresh_connection(clock):
+    pool, created = _pool(size=1)
+    attempts = []
+
+    def query(conn):
+        attempts.append(conn)
+        if len(attempts) == 1:
+            conn.dead = True
+            raise ConnectionError('connection reset')
+        return conn.number
+
+    assert pool.run(query) == 1
+    assert attempts == created and created[0].closed
+    assert pool.stats()['reconnects'] == 1
+
+
+def test_run_does_not_retry_errors_on_a_healthy_connection(clock):
+    pool, _ = _pool(size=1)
+    attempts = []
+
+    def query(conn):
+        attempts.append(conn)
+        raise ValueError('bad query')
+
+    with pytest.raises(ValueError):
+        pool.run(query)
+    assert len(attempts) == 1
+    # The connection is still good, so it goes back to the pool
+    assert pool.stats()['idle'] == 1
+
+
+def test_run_gives_up_after_the_retry(clock):
+    pool, created = _pool(size=1)
+
+    def query(conn):
+        conn.dead = True
+        raise ConnectionError('connection reset')
+
+    with pytest.raises(ConnectionError):
+        pool.run(query)
+    assert len(created) == 2
+    assert pool.stats()['open'] == 0
+
+
+def test_failed_connect_frees_the_slot():
+    def factory():
+        raise ConnectionError('warehouse unavailable')
+
+    pool = ConnectionPool(factory, size=1, wait_timeout=0.05)
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            pool.acquire()
+    assert pool.stats()['open'] == 0
@@ -0,0 +1,39 @@
+import pandas as pd
+import pytest
+
+import dso_config_cache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(dso_config_cache, 'DSO_CONFIG_VERSION_FILE', str(tmp_path / 'dso_config.version'))
+    monkeypatch.setattr(dso_config_cache, '_cache', {
+        'records': None, 'by_id': {}, 'columns': [], 'dropdown': None, 'loaded_at': 0.0, 'version': None,
+    })
+    monkeypatch.setattr(dso_config_cache, 'get_dso_config_data', lambda: pd.DataFrame({
+        'NSEntityID': [101, 102], 'DSO': ['Bright Smiles', 'Oak Dental'],
+    }))
+    return dso_config_cache
+
+
+def test_reads_are_served_from_one_load(cache):
+    assert [r['DSO'] for r in cache.get_dso_configs()] == ['Bright Smiles', 'Oak Dental']
+    assert cache.get_dso_config('102')['DSO'] == 'Oak Dental'
+    assert cache.get_dso_config(999) is None
+    assert cache.get_dso_config_columns() == ['NSEntityID', 'DSO']
+
+
+def test_reads_survive_an_invalidation_right_after_the_load(cache, monkeypatch):
+    # Another thread saving a config between a reader's load and its return used to leave
+    # the reader looking at records=None
+    load = cache._load
+
+    def load_then_invalidate():
+        loaded = load()
+        cache.invalidate_dso_configs()
+        return loaded
+
+    monkeypatch.setattr(cache, '_load', load_then_invalidate)
+    assert len(cache.get_dso_configs()) == 2
+    assert cache.get_dso_config(101)['DSO'] == 'Bright Smiles'
+    assert cache.get_dso_config_columns() == ['NSEntityID', 'DSO']
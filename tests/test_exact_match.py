@@ -0,0 +1,68 @@
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from exact_match import build_exact_index, exact_matches
+from match_logic import prepare_customers, prepare_roster
+
+
+@pytest.fixture
+def customers():
+    return prepare_customers(pd.DataFrame({
+        'Name': ['Big DSO HQ', 'Oak Dental', 'Pine Dental'],
+        'Address': ['1 Corporate Way', '12 Oak St', '9 Pine Rd'],
+        'State': ['NY', 'NJ', 'PA'],
+        'Zip': ['10001', '07001', '19001'],
+        'Emails': ['ap@bigdso.com', 'front@oakdental.com', 'hello@pinedental.com'],
+        'Doctors': ['', 'Jane Roe', 'John Doe'],
+        'MatchedEntityID': ['HQ', 'OAK', 'PINE'],
+    }))
+
+
+def _roster(rows):
+    df = pd.DataFrame(rows, columns=['SourceID', 'Name', 'Address', 'State', 'Zip', 'Emails', 'Doctors'])
+    return prepare_roster(df)
+
+
+def _matches(roster, customers, keys=('address_zip', 'email')):
+    found = exact_matches(roster, customers, build_exact_index(customers), keys=list(keys))
+    return dict(zip(found['SourceID'], zip(customers.loc[found['level_1'], 'MatchedEntityID'], found['MatchType'])))
+
+
+def test_email_shared_by_several_roster_practices_is_ignored(customers):
+    roster = _roster([
+        # Same ZIP as the head office, so only the shared email keeps them from matching it
+        ['1', 'Midtown Dental', '5 Main St', 'NY', '10001', 'ap@bigdso.com', ''],
+        ['2', 'Chelsea Dental', '80 Eighth Ave', 'NY', '10001', 'ap@bigdso.com', ''],
+    ])
+    assert _matches(roster, customers) == {}
+
+
+def test_email_needs_the_same_zip(customers):
+    roster = _roster([
+        ['1', 'Oak Dental', '', 'NJ', '07001', 'front@oakdental.com', ''],
+        ['2', 'Pine Dental', '', 'PA', '19104', 'hello@pinedental.com', ''],
+    ])
+    assert _matches(roster, customers) == {'1': ('OAK', 'exact_email')}
+
+
+def test_address_is_tried_before_email(customers):
+    roster = _roster([
+        ['1', 'Oak Dental', '12 Oak St', 'NJ', '07001', 'front@oakdental.com', ''],
+        ['2', 'Big DSO HQ', '1 Corporate Way', 'NY', '10001', '', ''],
+    ])
+    assert _matches(roster, customers) == {'1': ('OAK', 'exact_address'), '2': ('HQ', 'exact_address')}
+
+
+def test_rows_of_one_source_id_may_share_a_key(customers):
+    roster = _roster([
+        ['1', 'Oak Dental', '', 'NJ', '07001', 'front@oakdental.com', ''],
+        ['1', 'Oak Dental', '', 'NJ', '07001-1234', 'front@oakdental.com', ''],
+    ])
+    assert _matches(roster, customers) == {'1': ('OAK', 'exact_email')}
+
+
+def test_arrow_backed_customers(customers):
+    arrow = customers.astype({c: pd.ArrowDtype(pa.string()) for c in ['Zip', 'MatchedEntityID']})
+    roster = _roster([['1', 'Oak Dental', '', 'NJ', '07001', 'front@oakdental.com', '']])
+    assert _matches(roster, arrow) == {'1': ('OAK', 'exact_email')}
@@ -0,0 +1,74 @@
+import datetime
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+from ingest import ExcelIngest, MissingColumnsError
+
+CONFIG = {
+    'ID': 1, 'Name': 'Bright Smiles', 'NSEntityID': '101', 'Type': 'DSO', 'Header': 1,
+    'Concat_Doctor': [], 'SheetName': 'PRACTICE',
+    'SourceID': 'Location ID', 'PracticeName': 'Practice', 'Phone': 'Phone', 'Zip': 'Zip',
+    'Address': 'Unnamed: 2', 'Opened': 'Opened', 'State': 'StateCode', 'City': 'none',
+}
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    wb = Workbook()
+    wb.active.title = 'Notes'
+    sheet = wb.create_sheet('PRACTICE')
+    sheet.append(['Roster export'])
+    # No header over the address column, a repeated Phone header and a line break in a header
+    sheet.append(['Location ID', ' Practice ', None, 'Phone', 'Zip', 'Phone', 'Opened', 'State\nCode'])
+    sheet.append([1001.0, 'Oak Dental', '1 Main St', '555-0100', 2134.0, 'fax', datetime.datetime(2020, 5, 1), 'CA'])
+    sheet.append([1002, 'Kids Ortho', None, 5550101, '02134', None, None, 'ny'])
+    sheet.append([None] * 8)
+    sheet.append([1003.5, None, '9 Elm St', None, 98101, 'fax', 'soon', None])
+    for row in range(7, 10):
+        # Formatted but empty cells give trailing rows with no values
+        sheet.cell(row=row, column=1).number_format = '0.00'
+    path = tmp_path / 'roster.xlsx'
+    wb.save(path)
+    return str(path)
+
+
+def _read_excel(path, config_entry):
+    """The upload path before ExcelIngest: read the whole sheet as text, then pick the mapped columns."""
+    df = pd.read_excel(path, dtype=str, header=config_entry['Header'], sheet_name=config_entry['SheetName']).fillna('')
+    df.columns = df.columns.astype(str).str.strip().str.replace(r'[\r\n]+', '', regex=True)
+    mapping = {
+        k: v for k, v in config_entry.items()
+        if k not in ['ID', 'Name', 'NSEntityID', 'Type', 'Header', 'Concat_Doctor', 'SheetName']
+           and isinstance(v, str) and v.strip().lower() != 'none'
+    }
+    df = df[list(mapping.values())]
+    df.columns = list(mapping.keys())
+    return df
+
+
+def _ingest(path, config_entry, chunk_rows=None):
+    ingest = ExcelIngest(path, config_entry, config_entry['Name'], chunk_rows=chunk_rows, transform=False)
+    try:
+        return pd.concat(list(ingest.chunks(first_rows=1)), ignore_index=True)
+    finally:
+        ingest.close()
+
+
+@pytest.mark.parametrize('chunk_rows', [1, 2, 1000])
+def test_same_frame_as_read_excel(workbook, chunk_rows):
+    expected = _read_excel(workbook, CONFIG)
+    result = _ingest(workbook, CONFIG, chunk_rows)
+
+    pd.testing.assert_frame_equal(result, expected)
+    assert len(result) == 4  # the blank row between records is kept, the trailing ones are not
+    assert result['SourceID'].tolist() == ['1001', '1002', '', '1003.5']
+    assert result['Zip'].tolist() == ['2134', '02134', '', '98101']
+    assert result['Phone'].tolist() == ['555-0100', '5550101', '', '']  # first Phone column wins
+    assert result['Address'].tolist() == ['1 Main St', '', '', '9 Elm St']
+
+
+def test_missing_column_is_reported(workbook):
+    with pytest.raises(MissingColumnsError):
+        ExcelIngest(workbook, dict(CONFIG, Zip='Postcode'), CONFIG['Name'])
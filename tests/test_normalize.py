@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+from recordlinkage.preprocessing import clean
+
+import normalize
+from config import STATE_LOOKUP
+
+# The row-at-a-time code upload_file and match_records_by_fields ran before normalize.py
+OLD = {
+    'combine_emails': lambda df: df[['Emails', 'AddEmail']].astype(str).agg(','.join, axis=1),
+    'dedupe_emails': lambda df: df['Emails'].apply(
+        lambda x: ','.join(sorted(set(e.strip() for e in str(x).split(',') if e.strip()))) if pd.notnull(x) else None
+    ),
+    'concat_doctors': lambda df: df['DrFirst'].fillna('') + ' ' + df['DrLast'].fillna(''),
+    'clean_name': lambda df: clean(df['Name'].astype(str).fillna('')),
+    'state': lambda df: clean(df['State'].astype(str).fillna('')).str.strip().map(
+        lambda x: STATE_LOOKUP.get(x.lower(), x.upper())
+    ),
+}
+
+NEW = {
+    'combine_emails': lambda df: normalize.combine_emails(df['Emails'], df['AddEmail']),
+    'dedupe_emails': lambda df: normalize.dedupe_emails(df['Emails']),
+    'concat_doctors': lambda df: normalize.concat_doctors(df, ['DrFirst', 'DrLast']),
+    'clean_name': lambda df: normalize.clean_text(df['Name']),
+    'state': lambda df: normalize.canonical_state(normalize.clean_text(df['State'])),
+}
+
+
+@pytest.fixture
+def roster():
+    edge_cases = pd.DataFrame({
+        'Name': ['Bright Smiles (HQ)', 'bright  smiles', None, '', 'Dr. Ann Ng, LLC', 'Café Dental', np.nan, 'Bright Smiles (HQ)'],
+        'State': ['California', ' ca ', 'NEW YORK', None, 'tx', 'Texas', '', 'Puerto Rico'],
+        'Emails': ['b@x.com, a@x.com', 'a@x.com,a@x.com, ', None, '', ' , ', 'nan', 'C@x.com,c@x.com', 'z@y.com'],
+        'AddEmail': ['a@x.com', None, 'q@x.com', '', 'nan', 'b@x.com', '', None],
+        'DrFirst': ['Ann', None, 'Li', '', 'John', None, 'Jo', 'Ann'],
+        'DrLast': ['Ng', 'Smith', None, '', 'Garcia', None, '', 'Ng'],
+    })
+    rng = np.random.default_rng(3)
+    words = ['smile', 'Dental', '(HQ)', 'Dr.', 'LLC,', 'oak', 'kids']
+    emails = ['office@a.com', 'info@b.net', 'billing@a.com', '']
+    states = ['CA', 'ca', 'California', 'Texas', ' new york ', 'wa', 'FL']
+    generated = pd.DataFrame({
+        'Name': [' '.join(rng.choice(words, 3)) for _ in range(300)],
+        'State': rng.choice(states, 300),
+        'Emails': [', '.join(rng.choice(emails, rng.integers(0, 4))) for _ in range(300)],
+        'AddEmail': rng.choice(emails, 300),
+        'DrFirst': rng.choice(['John', 'Ann', None], 300),
+        'DrLast': rng.choice(['Smith', 'Ng', None], 300),
+    })
+    return pd.concat([edge_cases, generated], ignore_index=True)
+
+
+@pytest.mark.parametrize('transform', list(OLD))
+def test_same_output_as_the_previous_row_at_a_time_code(roster, transform):
+    expected = OLD[transform](roster)
+    result = NEW[transform](roster)
+    pd.testing.assert_series_equal(result, expected, check_dtype=False, check_names=False)
+
+
+def test_dedupe_after_combine_matches_the_upload_path(roster):
+    combined = OLD['combine_emails'](roster)
+    expected = OLD['dedupe_emails'](pd.DataFrame({'Emails': combined}))
+    result = normalize.dedupe_emails(normalize.combine_emails(roster['Emails'], roster['AddEmail']))
+    pd.testing.assert_series_equal(result, expected, check_dtype=False, check_names=False)
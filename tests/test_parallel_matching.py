@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.generate import make_customers
+from blocking import candidate_pair_positions
+from match_logic import match_records_by_fields, prepare_customers, prepare_roster
+
+RESULT_COLUMNS = ['SourceID', 'MatchedEntityID', 'TotalScore', 'MatchedName', 'MatchedEmails', 'MatchedAddress', 'MatchedDoctors']
+
+
+@pytest.fixture(scope='module')
+def customers():
+    return make_customers(3000, seed=7)
+
+
+@pytest.fixture(scope='module')
+def roster(customers):
+    rng = np.random.default_rng(11)
+    picks = rng.integers(0, len(customers), 400)
+    roster = customers.iloc[picks][['Name', 'Address', 'State', 'Zip', 'Emails', 'Doctors']].reset_index(drop=True)
+    # Drop a character from some names and addresses, and duplicate a few practices, so there are near-misses and ties
+    for col in ['Name', 'Address']:
+        typo = rng.random(len(roster)) < 0.4
+        roster.loc[typo, col] = roster.loc[typo, col].str[1:]
+    roster = pd.concat([roster, roster.iloc[:20]], ignore_index=True)
+    roster['SourceID'] = [f"LOC-{i}" for i in range(len(roster))]
+    return roster
+
+
+def _match(roster, customers, **kwargs):
+    result = match_records_by_fields(roster, customers, min_score=2, exact_keys=[], top_n=1, **kwargs)
+    return result[RESULT_COLUMNS].sort_values('SourceID').reset_index(drop=True)
+
+
+def test_same_result_on_every_run(roster, customers):
+    first = _match(roster, customers, workers=1)
+    assert (first['TotalScore'] >= 2).sum() > len(roster) // 2
+    pd.testing.assert_frame_equal(_match(roster, customers, workers=1), first)
+
+
+@pytest.mark.parametrize('workers, chunk_size', [(2, 50), (3, 120), (2, 1000)])
+def test_same_result_for_any_worker_count_and_chunk_size(roster, customers, workers, chunk_size):
+    expected = _match(roster, customers, workers=1)
+    pd.testing.assert_frame_equal(_match(roster, customers, workers=workers, chunk_size=chunk_size), expected)
+
+
+def test_same_result_in_low_memory_mode(roster, customers):
+    expected = _match(roster, customers, workers=1)
+    pd.testing.assert_frame_equal(_match(roster, customers, workers=1, low_memory=True), expected)
+
+
+def test_candidate_pairs_do_not_depend_on_the_rest_of_the_chunk(roster, customers):
+    left, right = prepare_roster(roster), prepare_customers(customers)
+    keys = ['state', 'zip3', 'name_phonetic', 'email_domain', 'address_sn']
+    whole = set(zip(*candidate_pair_positions(left, right, keys)))
+
+    pieces = set()
+    for start in range(0, len(left), 70):
+        l, r = candidate_pair_positions(left.iloc[start:start + 70], right, keys)
+        pieces |= set(zip(l + start, r))
+    assert pieces == whole
@@ -0,0 +1,176 @@
+import sqlite3
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import databricks_conn
+import pipeline
+import roster_diff
+from benchmarks.generate import make_customers
+from bulk_writer import SQLITE_MAX_PARAMS, SQLBackend
+from customer_features import build_customer_features
+from roster_diff import diff_roster, load_roster_state, row_hashes, save_roster_state
+
+DSO = 'Bright Smiles'
+COMPARED_COLUMNS = [c for c in databricks_conn.MATCHED_DATA_COLUMNS if c != 'UploadedDate']
+
+
+@pytest.fixture
+def matched_data(tmp_path, monkeypatch):
+    """Runs the pipeline against a SQLite stand-in for matched_data; returns run(roster, customers) -> (table, stats)."""
+    monkeypatch.setattr(roster_diff, 'ROSTER_STATE_DIR', str(tmp_path / 'roster_state'))
+    monkeypatch.setattr(pipeline, 'SAVE_MATCHED_RESULTS', False)
+    monkeypatch.setattr(pipeline, 'approved_source_id_mask', lambda ids: np.isin(ids, ['LOC-3', 'LOC-4']))
+
+    # A file rather than :memory:, so concurrent chunks each get their own connection
+    path = str(tmp_path / 'matched.sqlite3')
+    db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    db.execute(f"CREATE TABLE matched_data ({', '.join(f'`{c}`' for c in databricks_conn.MATCHED_DATA_COLUMNS)})")
+    db.execute("CREATE UNIQUE INDEX matched_data_key ON matched_data (Source, SourceID)")
+
+    @contextmanager
+    def connection():
+        conn = sqlite3.connect(path, timeout=30)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    backend = SQLBackend(connection, 'matched_data', paramstyle='qmark', dialect='sqlite', max_params=SQLITE_MAX_PARAMS)
+    monkeypatch.setattr(pipeline, 'upload_to_datalake', lambda df: databricks_conn.upload_to_datalake(df, backend))
+    monkeypatch.setattr(pipeline, 'merge_into_datalake', lambda df: databricks_conn.merge_into_datalake(df, backend))
+    monkeypatch.setattr(pipeline, 'delete_matched_data_for_dso', lambda dso: db.execute("DELETE FROM matched_data WHERE Source = ?", (dso,)))
+    monkeypatch.setattr(pipeline, 'delete_matched_rows', lambda dso, ids: db.executemany(
+        "DELETE FROM matched_data WHERE Source = ? AND SourceID = ?", [(dso, i) for i in ids]
+    ))
+    monkeypatch.setattr(pipeline, 'count_matched_rows', lambda dso: db.execute(
+        "SELECT COUNT(*) FROM matched_data WHERE Source = ?", (dso,)
+    ).fetchone()[0])
+
+    def run(roster, customers):
+        prepared_path = str(tmp_path / 'roster.parquet')
+        roster.to_parquet(prepared_path, index=False)
+        features = build_customer_features(customers)
+        features['signature'] = str(pd.util.hash_pandas_object(customers, index=False).sum())
+        stats = pipeline.run_matching_pipeline(DSO, 'roster.xlsx', prepared_path, customer_features=features)
+        table = pd.read_sql_query("SELECT * FROM matched_data ORDER BY SourceID", db)
+        return table[COMPARED_COLUMNS], stats
+
+    return run
+
+
+def _roster(customers, rows, seed):
+    rng = np.random.default_rng(seed)
+    roster = customers.iloc[rng.integers(0, len(customers), rows)][['Name', 'Address', 'State', 'Zip', 'Emails', 'Doctors']]
+    roster = roster.reset_index(drop=True)
+    for col in ['Name', 'Address', 'Emails']:
+        typo = rng.random(len(roster)) < 0.4
+        roster.loc[typo, col] = roster.loc[typo, col].str[1:]
+    roster.insert(0, 'SourceID', [f"LOC-{i}" for i in range(len(roster))])
+    return roster
+
+
+@pytest.fixture
+def uploads():
+    customers = make_customers(1500, seed=21).drop(columns=['LastModified'])
+    first = _roster(customers, 300, seed=21)
+    # Two pairs of practices in one ZIP sharing an inbox, which then can't resolve either of them exactly.
+    # Next time one practice of the first pair changes and one of the second pair is gone.
+    intact = first.index[first['Emails'].str.startswith('office@')]
+    (a1, b1), (a2, b2) = (intact[0], intact[1]), (intact[2], intact[3])
+    for a, b in [(a1, b1), (a2, b2)]:
+        first.loc[b, ['Emails', 'Zip']] = first.loc[a, ['Emails', 'Zip']].to_numpy()
+
+    second = first.copy()
+    second.loc[20:29, 'Name'] = second.loc[20:29, 'Name'] + ' group'
+    second.loc[b1, 'Name'] = 'x' + second.loc[b1, 'Name']
+    second = second.drop(index=list(range(40, 50)) + [b2])
+    second = pd.concat([second, _roster(customers, 10, seed=22).assign(SourceID=lambda df: 'NEW-' + df['SourceID'])], ignore_index=True)
+
+    # Customers change like a delta refresh: edited practices move to the end, some go, some arrive
+    rng = np.random.default_rng(23)
+    edited = customers.iloc[rng.choice(1500, 40, replace=False)].copy()
+    edited['Name'] = edited['Name'].str.upper() + ' DENTAL'
+    gone = rng.choice(1500, 20, replace=False)
+    arrivals = first.iloc[60:70][['Name', 'Address', 'State', 'Zip', 'Emails', 'Doctors']].assign(
+        City='', MatchedEntityID=[f"NEW{i}" for i in range(10)]
+    )
+    unchanged = customers.drop(index=edited.index.union(gone))
+    changed = pd.concat([unchanged, edited, arrivals], ignore_index=True)
+    return customers, first, second, changed
+
+
+def test_diff_mode_leaves_the_same_table_as_a_full_run(matched_data, uploads, monkeypatch):
+    customers, first, second, changed = uploads
+    matched_data(first, customers)
+
+    incremental, stats = matched_data(second, changed)
+    assert stats['mode'] == 'incremental'
+    assert stats['customers_changed'] > 0
+    assert 0 < stats['unchanged'] < len(second)
+
+    monkeypatch.setattr(pipeline, 'ROSTER_DIFF_MODE', False)
+    full, stats = matched_data(second, changed)
+    assert stats['mode'] == 'full'
+    pd.testing.assert_frame_equal(incremental, full)
+
+
+def test_unrelated_customer_changes_keep_stored_results(matched_data, uploads):
+    customers, first, _, _ = uploads
+    matched_data(first, customers)
+
+    outsider = customers.iloc[[0]].assign(Name='Zzyzx Qwerty', Address='1 Nowhere Rd', Zip='00001',
+                                          Emails='zq@zzyzx.example', Doctors='', MatchedEntityID='P-OUT')
+    _, stats = matched_data(first, pd.concat([customers, outsider], ignore_index=True))
+    assert stats['mode'] == 'incremental'
+    # Only the few rows that get the new practice as a blocking candidate are matched again
+    assert stats['new'] == stats['changed'] == 0
+    assert stats['customers_changed'] <= 5
+    assert stats['unchanged'] > len(first) // 2
+
+
+def test_snapshot_sensitive_mode_rematches_everything(matched_data, uploads, monkeypatch):
+    customers, first, _, _ = uploads
+    monkeypatch.setattr(pipeline, 'ROSTER_DIFF_SNAPSHOT_SENSITIVE', True)
+    matched_data(first, customers)
+    _, stats = matched_data(first, customers.iloc[:-1])
+    assert stats['mode'] == 'full'
+
+
+def test_roster_state_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(roster_diff, 'ROSTER_STATE_DIR', str(tmp_path))
+    df = pd.DataFrame({'SourceID': ['a', 'b', 'c'], 'Name': ['Oak', 'Elm', None], 'FileName': 'one.xlsx'})
+    hashes = row_hashes(df)
+    fingerprints = pd.Series(np.array([2 ** 64 - 1, 0, 2 ** 63 + 5], dtype=np.uint64))
+    save_roster_state(DSO, df['SourceID'], hashes, pd.Series([True, False, True]), 'sig-1', fingerprints)
+
+    state = load_roster_state(DSO)
+    assert state['signature'] == 'sig-1'
+    assert state['hashes'].to_dict() == dict(zip(df['SourceID'], hashes))
+    assert state['matched'].tolist() == [True, False, True]
+    assert state['fingerprints'].to_numpy(dtype=np.uint64).tolist() == fingerprints.tolist()
+
+    # Row hashes ignore column order and the per-upload columns
+    again = df[['Name', 'SourceID']].assign(FileName='two.xlsx', UploadedDate='2026-01-01')
+    pd.testing.assert_series_equal(row_hashes(again), hashes)
+
+    upload = pd.DataFrame({'SourceID': ['a', 'b', 'c', 'd'], 'Name': ['Oak', 'Elm', 'Ash', 'Fir']})
+    diff = diff_roster(upload, state, pd.Series(np.array([2 ** 64 - 1, 0, 2 ** 63 + 5, 7], dtype=np.uint64)))
+    assert diff['process'].tolist() == [False, True, True, True]
+    assert diff['counts'] == {'new': 1, 'changed': 1, 'rematched': 1, 'customers_changed': 0, 'unchanged': 1, 'removed': 0}
+
+    moved = diff_roster(upload, state, pd.Series(np.array([1, 0, 2 ** 63 + 5, 7], dtype=np.uint64)))
+    assert moved['process'].tolist() == [True, True, True, True]
+    assert moved['counts']['customers_changed'] == 1
+
+
+def test_state_without_fingerprints_rematches_every_row(tmp_path, monkeypatch):
+    monkeypatch.setattr(roster_diff, 'ROSTER_STATE_DIR', str(tmp_path))
+    df = pd.DataFrame({'SourceID': ['a', 'b'], 'Name': ['Oak', 'Elm']})
+    save_roster_state(DSO, df['SourceID'], row_hashes(df), pd.Series([True, True]), 'sig-1')
+    state = load_roster_state(DSO)
+    assert state['fingerprints'] is None
+    assert diff_roster(df, state, pd.Series([0, 0], dtype=np.uint64))['process'].all()
+    assert not diff_roster(df, state)['process'].any()